@@ -0,0 +1,121 @@
+import numpy as np
+import scipy.sparse as sps
+import hashlib, json, os, shutil, tempfile
+
+## =============================================================================
+## content-addressed on-disk cache of generated operators
+## =============================================================================
+
+def _digest(obj):
+    """
+    JSON-able stand-in for a generating parameter: arrays and sparse
+    matrices are replaced by the sha1 of their contents, other objects
+    (e.g. drt.ParallelBeam) by their class name and attributes.
+    """
+    if obj is None or isinstance(obj, (bool, str)):
+        return obj
+    if isinstance(obj, (int, float, np.integer, np.floating)):
+        return float(obj)
+    if isinstance(obj, (list, tuple)):
+        return [_digest(o) for o in obj]
+    if isinstance(obj, dict):
+        return dict((str(k), _digest(v)) for k, v in obj.items())
+    if sps.issparse(obj):
+        A = obj.tocsr()
+        return ['sparse', list(A.shape), _digest(A.data), _digest(A.indices), _digest(A.indptr)]
+    if isinstance(obj, np.ndarray):
+        a = np.ascontiguousarray(obj)
+        h = hashlib.sha1(a.tobytes())
+        h.update(str((a.dtype.str, a.shape)).encode())
+        return h.hexdigest()
+    if hasattr(obj, '__dict__'):
+        return [type(obj).__name__, _digest(vars(obj))]
+    return repr(obj)
+
+def cache_key(**params):
+    """
+    sha1 key of the generating parameters (e.g. prob, n_1, n_2, m, k, r,
+    sigma, t, sparse, lam, K_diag); equal parameters give equal keys.
+    """
+    s = json.dumps(_digest(params), sort_keys=True)
+    return hashlib.sha1(s.encode()).hexdigest()
+
+class MatrixCache:
+    """
+    Directory of cached matrices, one subdirectory per cache_key. Sparse
+    matrices are stored as CSR (data, indices, indptr .npy files) and dense
+    arrays as a single .npy, with a small .json header each; loading
+    memory-maps the .npy files, so a cached problem opens without reading
+    its operators into memory.
+
+    Args:
+        root:   cache directory (created if missing)
+        mmap:   load arrays memory-mapped read-only (`r`) or into memory
+    """
+
+    def __init__(self, root, mmap=True):
+        self.root = root
+        self.mmap_mode = 'r' if mmap else None
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def path(self, key, name=''):
+        return os.path.join(self.root, key, name)
+
+    @staticmethod
+    def storable(A):
+        """ only explicit matrices are cached (not LinearOperators) """
+        return sps.issparse(A) or isinstance(A, np.ndarray)
+
+    def has(self, key, *names):
+        return all(os.path.exists(self.path(key, name + '.json')) for name in names)
+
+    def save(self, key, name, A, params=None):
+        """
+        Store A under (key, name). Files are written to a temporary
+        directory and moved into place, so a crashed or concurrent run
+        never leaves a half-written entry behind.
+        """
+        if not self.storable(A):
+            raise ValueError('can only cache ndarrays and sparse matrices, got %s' % type(A))
+        d = self.path(key)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        if params is not None and not os.path.exists(self.path(key, 'params.json')):
+            with open(self.path(key, 'params.json'), 'w') as fh:
+                json.dump(_digest(params), fh, sort_keys=True, indent=1)
+
+        tmp = tempfile.mkdtemp(dir=d)
+        try:
+            if sps.issparse(A):
+                A = A.tocsr()
+                meta = {'kind': 'csr', 'shape': list(A.shape)}
+                parts = {'data': A.data, 'indices': A.indices, 'indptr': A.indptr}
+            else:
+                meta = {'kind': 'matrix' if isinstance(A, np.matrix) else 'ndarray'}
+                parts = {'array': np.asarray(A)}
+            for part, a in parts.items():
+                np.save(os.path.join(tmp, '%s.%s.npy' % (name, part)), a)
+            with open(os.path.join(tmp, name + '.json'), 'w') as fh:
+                json.dump(meta, fh)
+            ## header last: an entry exists once its .json is in place
+            for f in sorted(os.listdir(tmp), key=lambda f: f.endswith('.json')):
+                os.rename(os.path.join(tmp, f), self.path(key, f))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def load(self, key, name):
+        with open(self.path(key, name + '.json')) as fh:
+            meta = json.load(fh)
+        part = lambda p: np.load(self.path(key, '%s.%s.npy' % (name, p)), mmap_mode=self.mmap_mode)
+        if meta['kind'] == 'csr':
+            return sps.csr_matrix((part('data'), part('indices'), part('indptr')), \
+                                  shape=tuple(meta['shape']), copy=False)
+        A = part('array')
+        if meta['kind'] == 'matrix':
+            A = np.asmatrix(A)
+        return A
+
+    def clear(self, key=None):
+        """ remove one entry (or the whole cache) """
+        shutil.rmtree(self.path(key) if key is not None else self.root, ignore_errors=True)
@@ -0,0 +1,371 @@
+"""
+Hotelling templates for many ROIs of one problem.
+
+    -   HotellingEngine: one factorization of Z = X^T X + lam B^T B shared by
+            any number of ROIs; the Z solves of all ROIs are done as one block
+            solve over the concatenated M^T and cached per pixel.
+    -   HotellingEngine.sweep: an h x k ROI slid across the image, reusing
+            the Z solves of overlapping windows, updating Kx incrementally and
+            streaming templates and SNRs to .npy files.
+    -   KxOperator, stochastic_diag, hutchpp_trace, detectability: matrix-free
+            figures of merit (diag(Kx) and trace(Kx) by Hutchinson/Hutch++
+            probes, SNR by CG with quadrature bounds) for ROIs too large to
+            form Kx.
+"""
+import numpy as np
+import numpy.linalg as la
+import scipy.linalg as sla
+import scipy.sparse as sps
+import scipy.sparse.linalg as spsla
+from numpy.lib.format import open_memmap
+import os
+
+import util, optimize
+
+class HotellingEngine:
+    """
+    Batched Hotelling templates w = Kx^{-1} sx and detectabilities
+    SNR = sqrt(sx^T Kx^{-1} sx) for many ROIs (selection matrices M).
+
+    For an ROI with pixels idx, M R = G[:, idx]^T with G = X Z^{-1} (the
+    columns of Z^{-1} at the ROI pixels, as in util.direct_mrxn), so
+        Kx = G_idx^T Kb G_idx,      sx = G_idx^T sb.
+    The columns g_p = X Z^{-1} e_p and Kb g_p are cached per pixel p, so
+    pixels shared between ROIs are solved for once.
+
+    Args:
+        X, Kb, lam, B:  problem operators (B defaults to the identity)
+        sb:             data signal (default for `templates`)
+        Zinv:           Fourier/DCT Z-solver (util.spectral_Z_solver): Z^{-1}
+                        if exact, else a preconditioner (see util.z_solver)
+        sparse:         factor Z with splu (else dense Cholesky)
+        n_1, n_2:       image size, for ROIs given as util.roi_indices kwargs
+        block:          right-hand sides per block solve (bounds the n x block
+                        dense workspace)
+    """
+
+    def __init__(self, X=None, Kb=None, lam=None, B=None, sb=None, Zinv=None, sparse=True, \
+                 n_1=None, n_2=None, block=256):
+        self.X, self.Kb, self.lam, self.B = X, Kb, lam, B
+        self.sb = None if sb is None else np.asarray(sb).reshape(-1)
+        self.n_1, self.n_2, self.block = n_1, n_2, int(block)
+        self.n = X.shape[1]
+        self.zsolve = util.z_solver(X=X, lam=lam, B=B, sparse=sparse, Zinv=Zinv)
+        self._cols = {}     # pixel -> (X Z^{-1} e_p, Kb X Z^{-1} e_p)
+        self.n_solves = 0
+
+    @classmethod
+    def from_problem(cls, prob):
+        """ engine for a problems.Problem (its ROI M is ignored) """
+        return cls(X=prob.X, Kb=prob.Kb, lam=prob.lam, B=prob.B, sb=prob.sb, \
+                   Zinv=getattr(prob, 'Zinv', None), sparse=prob.sparse, n_1=prob.n_1, n_2=prob.n_2)
+
+    def roi(self, spec):
+        """
+        Pixel indices of an ROI given as an index array, a k x n selection
+        matrix M (one unit entry per row) or a dict of util.roi_indices kwargs.
+        """
+        if isinstance(spec, dict):
+            return util.roi_indices(n_1=self.n_1, n_2=self.n_2, **spec)
+        if sps.issparse(spec) or (isinstance(spec, np.ndarray) and spec.ndim == 2):
+            M = sps.csr_matrix(spec)
+            if not (np.all(np.diff(M.indptr) == 1) and np.allclose(M.data, 1)):
+                raise ValueError('M must select one pixel per row')
+            return M.indices.copy()
+        return np.asarray(spec, dtype=int).reshape(-1)
+
+    def solve_pixels(self, pixels):
+        """ block solves for the pixels not cached yet """
+        new = [p for p in np.unique(pixels) if p not in self._cols]
+        for b0 in range(0, len(new), self.block):
+            blk = new[b0:b0+self.block]
+            E = np.zeros((self.n, len(blk)))
+            E[blk, np.arange(len(blk))] = 1.0
+            G = np.asarray(self.X.dot(self.zsolve(E))).reshape(-1, len(blk))
+            H = np.asarray(self.Kb.dot(G))
+            for j, p in enumerate(blk):
+                self._cols[p] = (G[:, j], H[:, j])
+            self.n_solves += len(blk)
+
+    def kx_operator(self, spec, sb=None):
+        """ (KxOperator, sx) for one ROI, without solving for its pixels """
+        sb = self.sb if sb is None else np.asarray(sb).reshape(-1)
+        M = util.gen_M(n_1=self.n, idx=self.roi(spec))
+        Kx = KxOperator(self.X, self.Kb, M, self.zsolve)
+        return Kx, np.asarray(M.dot(self.zsolve(np.asarray(self.X.T.dot(sb))))).reshape(-1)
+
+    def forget(self, pixels=None):
+        """ drop cached columns (all if `pixels` is None) """
+        if pixels is None:
+            self._cols.clear()
+        for p in ([] if pixels is None else pixels):
+            self._cols.pop(p, None)
+
+    def columns(self, idx):
+        """ (G_idx, Kb G_idx), m x k each """
+        self.solve_pixels(idx)
+        G = np.column_stack([self._cols[p][0] for p in idx])
+        H = np.column_stack([self._cols[p][1] for p in idx])
+        return G, H
+
+    @staticmethod
+    def _template(Kx, sx):
+        try:
+            w = sla.cho_solve(sla.cho_factor(Kx), sx)
+        except la.LinAlgError:
+            ## Kx numerically semidefinite (as in util.direct_solve)
+            w = la.solve(Kx, sx)
+        return w, np.sqrt(max(sx.dot(w), 0.0))
+
+    def template(self, spec, sb=None):
+        """ (w, SNR, Kx, sx) for one ROI """
+        sb = self.sb if sb is None else np.asarray(sb).reshape(-1)
+        G, H = self.columns(self.roi(spec))
+        Kx, sx = G.T.dot(H), G.T.dot(sb)
+        w, snr = self._template(Kx, sx)
+        return w, snr, Kx, sx
+
+    def templates(self, specs, sb=None):
+        """
+        Templates and detectabilities for all ROIs in `specs`, with the Z
+        solves of every ROI pixel done in one batched pass.
+        Returns
+            ws: list of k_i x 1 templates
+            snrs: array of detectabilities
+        """
+        rois = [self.roi(spec) for spec in specs]
+        self.solve_pixels(np.concatenate(rois))
+        ws, snrs = [], np.zeros(len(rois))
+        for i, idx in enumerate(rois):
+            w, snrs[i], _, _ = self.template(idx, sb=sb)
+            ws.append(w.reshape(-1, 1))
+        return ws, snrs
+
+    def sweep(self, k, h=1, rows=None, cols=None, step=1, sb=None, out_dir=None):
+        """
+        Slides an h x k ROI (h image rows, k image columns; pixels in the
+        column-major order of util.roi_indices(rect=...)) across the image:
+        along each strip of rows starting at `rows` (default all), the left
+        column moves through `cols` (default every `step`-th column).
+
+        Along a strip, neighbouring windows share all but step*h pixels: the
+        cached Z solves are reused, and Kx and sx are updated by dropping the
+        leaving pixels and appending the entering ones (O(step k m) per move
+        instead of O(k^2 m)). All Z solves of a strip are done as one block
+        solve; cached rows that no later strip uses are evicted.
+
+        Args:
+            out_dir:    if given, results are streamed to positions.npy,
+                        snr.npy and templates.npy (memory-mapped) there
+        Returns:
+            positions:  P x 2 (top row, left column) of each window
+            snrs:       P detectabilities
+            ws:         P x (h k) templates
+        """
+        n_1, n_2 = self.n_1, self.n_2
+        sb = self.sb if sb is None else np.asarray(sb).reshape(-1)
+        rows = np.arange(n_1-h+1) if rows is None else np.asarray(rows, dtype=int)
+        cols = np.arange(0, n_2-k+1, step) if cols is None else np.asarray(cols, dtype=int)
+        P, K = rows.size*cols.size, h*k
+
+        if out_dir is not None:
+            if not os.path.isdir(out_dir):
+                os.makedirs(out_dir)
+            mk = lambda name, shape, dtype: open_memmap(os.path.join(out_dir, name + '.npy'), \
+                                                        mode='w+', dtype=dtype, shape=shape)
+        else:
+            mk = lambda name, shape, dtype: np.zeros(shape, dtype=dtype)
+        positions, snrs, ws = mk('positions', (P, 2), int), mk('snr', (P,), float), mk('templates', (P, K), float)
+
+        window = lambda i0, j0: np.add.outer(np.arange(j0, j0+k)*n_1, np.arange(i0, i0+h)).ravel()
+        q = 0
+        for a, i0 in enumerate(rows):
+            ## one block solve for the whole strip, then drop rows no later strip uses
+            strip = np.concatenate([window(i0, j0) for j0 in cols])
+            self.solve_pixels(strip)
+            j_prev, Kx, sx = None, None, None
+            for j0 in cols:
+                shift = None if j_prev is None else (j0 - j_prev)*h
+                if shift is None or shift <= 0 or shift >= K:
+                    G, H = self.columns(window(i0, j0))
+                    Kx, sx = G.T.dot(H), G.T.dot(sb)
+                else:
+                    ## incremental update: keep G_keep, append G_new
+                    G_new, H_new = self.columns(window(i0, j0)[K-shift:])
+                    G = np.column_stack([G[:, shift:], G_new])
+                    C = G[:, :K-shift].T.dot(H_new)
+                    Kx_new = np.empty((K, K))
+                    Kx_new[:K-shift, :K-shift] = Kx[shift:, shift:]
+                    Kx_new[:K-shift, K-shift:] = C
+                    Kx_new[K-shift:, :K-shift] = C.T
+                    Kx_new[K-shift:, K-shift:] = G_new.T.dot(H_new)
+                    Kx, sx = Kx_new, np.concatenate([sx[shift:], G_new.T.dot(sb)])
+                w, snr = self._template(Kx, sx)
+                positions[q], snrs[q], ws[q] = (i0, j0), snr, w
+                j_prev, q = j0, q+1
+            later = rows[a+1:]
+            for i in range(i0, i0+h):
+                if not np.any((later <= i) & (i < later+h)):
+                    self.forget(np.arange(n_2)*n_1 + i)
+            if out_dir is not None:
+                for A in (positions, snrs, ws):
+                    A.flush()
+        return positions, snrs, ws
+
+
+## =============================================================================
+## matrix-free figures of merit
+## =============================================================================
+
+class KxOperator(spsla.LinearOperator):
+    """
+    Kx = M Z^{-1} X^T Kb X Z^{-1} M^T (k x k, symmetric) applied through two
+    Z solves per product (`zsolve` as returned by util.z_solver); products
+    with blocks of vectors use one block solve each.
+    """
+
+    def __init__(self, X, Kb, M, zsolve):
+        self.X, self.Kb, self.M, self.zsolve = X, Kb, M, zsolve
+        k = M.shape[0]
+        super(KxOperator, self).__init__(dtype=np.dtype(float), shape=(k, k))
+
+    def _matmat(self, V):
+        Y = self.zsolve(np.asarray(self.M.T.dot(V)))
+        Y = self.zsolve(np.asarray(self.X.T.dot(self.Kb.dot(self.X.dot(Y)))))
+        return np.asarray(self.M.dot(Y))
+
+    def _matvec(self, v):
+        return self._matmat(np.asarray(v).reshape(-1, 1)).reshape(-1)
+
+    _rmatmat, _rmatvec = _matmat, _matvec
+
+    def _adjoint(self):
+        return self
+
+def _rademacher(rng, k, b):
+    return rng.randint(2, size=(k, b)) * 2.0 - 1.0
+
+def stochastic_diag(A, tol=10**-2, block=16, max_probes=1024, n_deflate=0, seed=None):
+    """
+    Hutchinson estimate of diag(A) for a symmetric operator A (e.g. a
+    KxOperator), from products with blocks of Rademacher probes z:
+        diag(A) ~ mean_z z * (A z),
+    with a standard error per entry from the spread of the samples. Blocks
+    are added until every standard error is below tol ||estimate||_inf (or
+    `max_probes` probes are used); a norm-wise test, since a relative one
+    never passes for zero entries (e.g. pixels outside the support).
+
+    With n_deflate > 0 the dominant range Q = orth(A S) (S Gaussian, k x
+    n_deflate) is removed first (diag++): diag(Q Q^T A) is computed
+    exactly from A Q and only diag((I - Q Q^T) A) is estimated, which
+    removes most of the variance when A has a decaying spectrum.
+
+    Returns
+        d: estimate of diag(A)
+        err: standard errors of d
+        n_matvecs: products with A used
+    """
+    A = spsla.aslinearoperator(A)
+    k = A.shape[0]
+    rng = np.random.RandomState(seed)
+    d0, Q, AQ = np.zeros(k), np.zeros((k, 0)), np.zeros((k, 0))
+    n_matvecs = 0
+    if n_deflate > 0:
+        Q, _ = la.qr(np.asarray(A.matmat(rng.randn(k, n_deflate))))
+        AQ = np.asarray(A.matmat(Q))
+        d0 = np.sum(Q * AQ, axis=1)
+        n_matvecs += 2*n_deflate
+
+    s1, s2, N = np.zeros(k), np.zeros(k), 0
+    while N < max_probes:
+        b = min(block, max_probes - N)
+        Zb = _rademacher(rng, k, b)
+        S = Zb * (np.asarray(A.matmat(Zb)) - Q.dot(AQ.T.dot(Zb)))
+        s1 += S.sum(axis=1)
+        s2 += (S**2).sum(axis=1)
+        N, n_matvecs = N + b, n_matvecs + b
+        mean = s1 / N
+        err = np.sqrt(np.maximum(s2/N - mean**2, 0.0) / max(N-1, 1))
+        if N > 1 and np.all(err <= tol * np.abs(d0 + mean).max()):
+            break
+    return d0 + mean, err, n_matvecs
+
+def hutchpp_trace(A, n_matvecs=99, seed=None, tol=None, block=16, max_matvecs=None):
+    """
+    Hutch++ estimate of trace(A) for a symmetric PSD operator: one third of
+    the products find Q = orth(A S), trace(Q^T A Q) is exact, and the rest
+    are Hutchinson probes of (I - Q Q^T) A (I - Q Q^T). The error falls
+    as O(1/n_matvecs) instead of O(1/sqrt(n_matvecs)).
+
+    With `tol`, blocks of `block` further probes are added (as in
+    stochastic_diag) until the standard error is below tol |estimate| or
+    `max_matvecs` products (default 10 n_matvecs) are used.
+
+    Returns
+        t: trace estimate
+        err: standard error of t (from the Hutchinson part)
+    """
+    A = spsla.aslinearoperator(A)
+    k = A.shape[0]
+    rng = np.random.RandomState(seed)
+    r = max(1, n_matvecs // 3)
+    Q, _ = la.qr(np.asarray(A.matmat(rng.randn(k, r))))
+    t0 = np.trace(Q.T.dot(np.asarray(A.matmat(Q))))
+    if max_matvecs is None:
+        max_matvecs = 10*n_matvecs
+    samples, b = np.zeros(0), max(2, n_matvecs - 2*r)
+    while b > 0:
+        G = _rademacher(rng, k, b)
+        G -= Q.dot(Q.T.dot(G))
+        samples = np.append(samples, np.sum(G * np.asarray(A.matmat(G)), axis=0))
+        t, err = t0 + samples.mean(), samples.std(ddof=1) / np.sqrt(samples.size)
+        if tol is None or err <= tol * abs(t):
+            break
+        b = min(block, max_matvecs - 2*r - samples.size)
+    return t, err
+
+def detectability(Kx, sx, tol=10**-6, max_iter=500, lam_min=None):
+    """
+    SNR = sqrt(sx^T Kx^{-1} sx) by CG on Kx w = sx using only products with
+    Kx. SNR^2 is a quadratic form in Kx^{-1}, not a trace, so it is not
+    estimated by probes: the CG energies sx^T w_j increase monotonically
+    to SNR^2 (Gauss quadrature lower bounds), and the gap
+        SNR^2 - sx^T w_j = r_j^T Kx^{-1} r_j <= ||r_j||^2 / lam_min
+    gives an upper bound when a lower bound `lam_min` on the smallest
+    eigenvalue of Kx is known. Without it, lam_min is estimated by the
+    smallest Ritz value of the CG run (ConjugateGradientsSolver.
+    ritz_values); Ritz values approach lam_min from above, so the upper
+    end is then an estimate rather than a guaranteed bound.
+    Args
+        tol: relative residual ||Kx w - sx|| / ||sx||
+    Returns
+        snr, (lower, upper) bounds on SNR, and the number of iterations
+    """
+    Kx = spsla.aslinearoperator(Kx)
+    sx = np.asarray(sx, dtype=float).reshape(-1)
+    w = np.zeros(sx.size)
+    r = sx.copy()
+    p = r.copy()
+    rTr = r.dot(r)
+    sx_norm = np.sqrt(rTr)
+    alphas, betas = [], []
+    i = 0
+    while i < max_iter and np.sqrt(rTr) > tol * sx_norm:
+        q = np.asarray(Kx.matvec(p)).reshape(-1)
+        a = rTr / p.dot(q)
+        w += a*p
+        r -= a*q
+        new_rTr = r.dot(r)
+        p = r + (new_rTr / rTr)*p
+        alphas.append(a)
+        betas.append(new_rTr / rTr)
+        rTr = new_rTr
+        i += 1
+    snr2 = sx.dot(w)
+    if lam_min is None and alphas:
+        lam_min = optimize.ConjugateGradientsSolver().ritz_values(alphas, betas)[0]
+    if rTr == 0:
+        upper = np.sqrt(snr2)
+    else:
+        upper = np.inf if lam_min is None else np.sqrt(snr2 + rTr / lam_min)
+    return np.sqrt(snr2), (np.sqrt(snr2), upper), i
@@ -1,7 +1,7 @@
 """
 Solvers of linear systems of equations.
 
-    -   Conjugate Gradients
+    -   Conjugate Gradients (and deflated CG recycling Ritz vectors across solves)
     -   Direct Solve (via scipy.linalg/scipy.sparse.linalg)
     -   via Decomposition (LU/QR/Cholesky)
     -   Gradient Descent
@@ -9,6 +9,9 @@ Solvers of linear systems of equations.
     -   Iterative Refinement (w/ option of constant or decaying epsilon)
             (see IterativeRefinementSolver and
              IterativeRefinementGeneralSolver for more info)
+    -   Randomized SVD (randomized_svd), giving factored LowRank matrices
+    -   Randomized TSVD / Tikhonov spectral filtering (TSVDSolver)
+    -   Lanczos estimates of ||A||_2, extreme eigenvalues and condition numbers
     -   A number of other (obsolete?) methods, including:
         -   Arnoldi Iterations
         -   Jacobi Iterations
@@ -71,6 +74,8 @@ class Solver:
                                       ||x - x_true|| at each iteration.
                           kwargs:   Solver-specific parameters, e.g.
                                         -'eps' for iterative refinement
+                                          (default 2 ||A||_2, estimated to
+                                          relative accuracy 'norm_tol')
                                         -'recalc' for GD/CG
 
         Returns:
@@ -99,6 +104,16 @@ class Solver:
         else:
             return self._bare(tol, x, max_iter, **kwargs)
 
+    def _norm_A(self, tol=10**-2):
+        """
+        ||A||_2 estimate (norm_estimate), computed once per A and reused by
+        later solves.
+        """
+        cached = getattr(self, '_A_norm', None)
+        if cached is None or cached[0] is not self.A or cached[1] > tol:
+            self._A_norm = (self.A, tol, norm_estimate(self.A, tol=tol))
+        return self._A_norm[2]
+
     def _full(*args, **kwargs):
         raise NotImplementedError('_full not implemented?')
 
@@ -562,6 +577,10 @@ class ConjugateGradientsSolver(Solver):
     Extra parameter(s) for Solver.solve(...):
         (int) recalc:   Directly recalculate the residual b - Ax every 'recalc'
                             iterations.
+        (bool) ritz:    Record the CG coefficients (alpha_j, beta_j); after the
+                            solve, `ritz` holds the Ritz values of A (the
+                            eigenvalues of the Lanczos tridiagonal matrix) and
+                            `cond_est` their ratio, at no extra matvecs.
     """
 
     def __str__(self):
@@ -583,14 +602,50 @@ class ConjugateGradientsSolver(Solver):
     def __repr__(self):
         return self.__str__()
 
+    def _start_ritz(self, kwargs):
+        self._record_on = bool(kwargs.get('ritz', False))
+        self.alphas, self.betas = [], []
+        self.ritz, self.cond_est = None, None
+
+    def _record(self, a, beta=None):
+        if self._record_on:
+            if beta is not None:
+                self.betas.append(beta)
+            self.alphas.append(a)
+
+    def _finish_ritz(self):
+        if self.alphas:
+            self.ritz = self.ritz_values()
+            self.cond_est = self.ritz[-1] / self.ritz[0]
+
+    def ritz_values(self, alphas=None, betas=None):
+        """
+        Ritz values of A from CG coefficients (default: those recorded by the
+        last solve with ritz=True). CG with step sizes alpha_j and direction
+        updates beta_j is Lanczos with the tridiagonal matrix
+            T_jj = 1/alpha_j + beta_{j-1}/alpha_{j-1},
+            T_j,j+1 = sqrt(beta_j)/alpha_j,
+        whose eigenvalues approximate the extreme eigenvalues of A from
+        inside (the largest converge first).
+        """
+        a = np.asarray(self.alphas if alphas is None else alphas, dtype=float)
+        b = np.asarray(self.betas if betas is None else betas, dtype=float)[:a.size-1]
+        diag = 1.0 / a
+        diag[1:] += b / a[:-1]
+        off = np.sqrt(b) / a[:-1]
+        return la.eigvalsh(np.diag(diag) + np.diag(off, 1) + np.diag(off, -1))
+
     def _full(self, tol, x, max_iter, x_true, **kwargs):
         if 'recalc' not in kwargs:
             recalc = 20
         else:
             recalc = int(kwargs['recalc'])
 
+        self._start_ritz(kwargs)
+
         if 'restart' not in kwargs:
-            restart = max_iter
+            ## no restart: i never exceeds max_iter
+            restart = max_iter + 1
         else:
             restart = int(kwargs['restart'])
 
@@ -628,6 +683,7 @@ class ConjugateGradientsSolver(Solver):
         Ad = self.A.dot(d)
         a = rTr / np.dot(d.T, Ad)
         x += a * d
+        self._record(a)
 
         # ======================================================================
 
@@ -652,6 +708,8 @@ class ConjugateGradientsSolver(Solver):
             new_rTr = np.dot(new_r.T, new_r)
             beta = new_rTr / rTr
             if (i % restart) == 0:
+                ## restarts break the Lanczos relation: stop recording
+                self._record_on = False
                 if restart_mtd == "gd":
                     d = new_r
                 elif restart_mtd == "beale":
@@ -670,9 +728,11 @@ class ConjugateGradientsSolver(Solver):
             Ad = self.A.dot(d)
 
             a = rTr / np.dot(d.T, Ad)
+            self._record(a, beta)
 
             x += a * d
 
+        self._finish_ritz()
         if x_true is None:
             return x, i, residuals
             #return x, i, residuals, ds, rs  # DEBUG
@@ -684,6 +744,7 @@ class ConjugateGradientsSolver(Solver):
             recalc = 20
         else:
             recalc = int(kwargs['recalc'])
+        self._start_ritz(kwargs)
 
         ## reshape bug fix
         self.b = self.b.reshape(len(self.b),)
@@ -700,6 +761,7 @@ class ConjugateGradientsSolver(Solver):
         Ad = self.A.dot(d)
         a = rTr / np.dot(d.T, Ad)
         x += a * d
+        self._record(a)
 
         for i in range(1, max_iter):
             if (i % recalc) == 0:
@@ -718,9 +780,11 @@ class ConjugateGradientsSolver(Solver):
             Ad = self.A.dot(d)
 
             a = rTr / np.dot(d.T, Ad)
+            self._record(a, beta)
 
             x += a * d
 
+        self._finish_ritz()
         return x
 
     def path(self, tol=10**-5, x_0=None, max_iter=500, **kwargs):
@@ -777,34 +841,265 @@ class ConjugateGradientsSolver(Solver):
 
         return path
 
-# TODO: _bare and path
+def _rayleigh_ritz(S, AS, k):
+    """
+    The k Ritz vectors of the smallest Ritz values of symmetric A on
+    span(S), and their images under A (from AS = A S, no products).
+    """
+    lam, V = la.eigh(S.T.dot(S))
+    keep = lam > 10**-10 * lam[-1]
+    T = V[:, keep] / np.sqrt(lam[keep])
+    G = T.T.dot(S.T.dot(AS)).dot(T)
+    _, Y = la.eigh(0.5*(G + G.T))
+    C = T.dot(Y[:, :k])
+    return S.dot(C), AS.dot(C)
+
+class RecycleSpace:
+    """
+    Bounded recycle space for DeflatedCGSolver: W (n x size) spans
+    approximate eigenvectors of the smallest eigenvalues of A, harvested
+    from earlier solves. One space can be shared by all solves with the
+    same or a nearby matrix (e.g. the shifted A + eps I of
+    IterativeRefinementGeneralSolver): A W is recomputed (`size` products)
+    when A or W changes.
+
+    Args:
+        size:       number of recycled vectors
+        window:     Lanczos vectors kept during a solve before they are
+                    compressed to 2 size Ritz vectors (default 4 size; must
+                    exceed 2 size, so the window has room after compression)
+    """
+
+    def __init__(self, size=10, window=None):
+        self.size = int(size)
+        self.window = 4*self.size if window is None else int(window)
+        if self.window <= 2*self.size:
+            raise ValueError('window (%d) must exceed 2 size (%d)' % (self.window, 2*self.size))
+        self.W, self.AW, self.E, self.A = None, None, None, None
+
+    def bind(self, A):
+        """ make A W and W^T A W current for A """
+        if A is not self.A and self.W is not None:
+            self.AW = np.asarray(A.dot(self.W))
+            self._factor()
+        self.A = A
+
+    def _factor(self):
+        E = self.W.T.dot(self.AW)
+        self.E = sla.cho_factor(0.5*(E + E.T))
+
+    def coarse(self, c):
+        """ (W^T A W)^{-1} c """
+        return sla.cho_solve(self.E, c)
+
+    def harvest(self, S, AS):
+        """
+        Rayleigh-Ritz on span[W, S] to refine W. A S from the CG recurrences
+        is accurate enough to pick the Ritz vectors, but not for deflation:
+        A W is recomputed (one block product) at the next bind.
+        """
+        if self.W is not None:
+            S, AS = np.hstack([self.W, S]), np.hstack([self.AW, AS])
+        self.W, _ = _rayleigh_ritz(S, AS, self.size)
+        self.A = None
+
+class DeflatedCGSolver(ConjugateGradientsSolver):
+    """
+    Deflated conjugate gradients (Saad, Yeung, Erhel, Guyomarc'h 2000) with a
+    RecycleSpace W: the initial guess is corrected by a Galerkin solve on W
+    and every search direction is kept A-orthogonal to W,
+        p_{j+1} = r_{j+1} + beta_j p_j - W mu_{j+1},
+        mu_{j+1} = (W^T A W)^{-1} (A W)^T r_{j+1},
+    so CG runs on the spectrum with the recycled eigenvalues removed (cost
+    O(n size) per step).
+
+    W is refined during every solve as in eigCG (Stathopoulos and Orginos
+    2010): the normalized residuals (the Lanczos vectors of the solve) are
+    collected in a window, with A r_j = A p_j - beta_{j-1} A p_{j-1} +
+    A W mu_j from the CG recurrences (no extra products); a full window is
+    compressed by Rayleigh-Ritz to its smallest Ritz vectors (plus those of
+    the window without its last vector, which keeps the restarted Lanczos
+    process from stagnating), and at the end of the solve W is updated by
+    Rayleigh-Ritz on [W, window]. Repeated solves with the same or a slowly
+    changing matrix, as in pocs/dr/raar, then stop spending iterations on
+    the same bad eigenmodes.
+
+    Args:
+        space:      RecycleSpace to use (shared between solvers), or None
+                    for a new one of size `n_recycle`
+    Extra parameter(s) for Solver.solve(...): `recalc` as for CG; each
+    recalculated residual is projected again (W^T r = 0), which keeps the
+    deflated iteration stable once the residual reaches rounding level.
+    """
+
+    def __init__(self, A=None, b=None, full_output=False, space=None, n_recycle=10, **kwargs):
+        Solver.__init__(self, A=A, b=b, full_output=full_output, **kwargs)
+        self.space = RecycleSpace(n_recycle) if space is None else space
+
+    def __str__(self):
+        l1 = 'Deflated Conjugate Gradients Solver\n'
+        if self.A is None:
+            l2 = 'A: None; '
+        else:
+            l2 = 'A: %d x %d; ' % (self.A.shape[0], self.A.shape[1])
+        if self.b is None:
+            l2 += 'b: None\n'
+        else:
+            l2 += 'b: %d x %d\n' % (len(self.b), len(self.b.T))
+        W = self.space.W
+        l3 = 'recycle: %d/%d; ' % (0 if W is None else W.shape[1], self.space.size)
+        if self.full_output:
+            l3 += 'full_output: True'
+        else:
+            l3 += 'full_output: False'
+        return l1+l2+l3
+
+    def _run(self, tol, x, max_iter, x_true, recalc, path=None):
+        A, sp = self.A, self.space
+        sp.bind(A)
+        ## work on vectors; x is returned in the shape of x_0
+        b = np.asarray(self.b).reshape(-1)
+        shape = np.shape(x)
+        x = np.asarray(x, dtype=float).reshape(-1)
+        if x_true is not None:
+            x_true = np.asarray(x_true).reshape(-1)
+        W, AW = sp.W, sp.AW
+        k = sp.size
+
+        start_time = time.time()
+        x_difs = None if x_true is None else [la.norm(x - x_true)]
+
+        ## Galerkin correction on W, so that W^T r_0 = 0
+        r = b - A.dot(x)
+        if W is not None:
+            x = x + W.dot(sp.coarse(W.T.dot(r)))
+            r = b - A.dot(x)
+        r_norm = la.norm(r)
+        residuals = [(r_norm, time.time() - start_time)]
+        if path is not None:
+            path.append(x.reshape(shape))
+
+        ## window of Lanczos vectors r_j / ||r_j|| and their images
+        S, AS = np.zeros((len(b), sp.window)), np.zeros((len(b), sp.window))
+        n_s = 0
+        mu = None if W is None else sp.coarse(AW.T.dot(r))
+        p = r if W is None else r - W.dot(mu)
+        Ap_old, beta = None, 0.0
+        rTr = r.dot(r)
+        i = 0
+        while r_norm > tol and i < max_iter:
+            Ap = np.asarray(A.dot(p)).reshape(-1)
+
+            ## A r_j from the recurrences
+            Ar = Ap if Ap_old is None else Ap - beta*Ap_old
+            if W is not None:
+                Ar = Ar + AW.dot(mu)
+            if n_s == sp.window:
+                Z1, AZ1 = _rayleigh_ritz(S, AS, k)
+                Z2, AZ2 = _rayleigh_ritz(S[:, :-1], AS[:, :-1], k)
+                Zs, AZs = _rayleigh_ritz(np.hstack([Z1, Z2]), np.hstack([AZ1, AZ2]), 2*k)
+                n_s = Zs.shape[1]
+                S[:, :n_s], AS[:, :n_s] = Zs, AZs
+            S[:, n_s], AS[:, n_s] = r / r_norm, Ar / r_norm
+            n_s += 1
+
+            a = rTr / p.dot(Ap)
+            x = x + a*p
+            i += 1
+            if (i % recalc) == 0:
+                ## true residual, projected again so that W^T r = 0
+                r = b - A.dot(x)
+                if W is not None:
+                    c = sp.coarse(W.T.dot(r))
+                    x, r = x + W.dot(c), r - AW.dot(c)
+            else:
+                r = r - a*Ap
+            r_norm = la.norm(r)
+            residuals.append((r_norm, time.time() - start_time))
+            if x_true is not None:
+                x_difs.append(la.norm(x - x_true))
+            if path is not None:
+                path.append(x.reshape(shape))
+
+            new_rTr = r.dot(r)
+            beta = new_rTr / rTr
+            p = r + beta*p
+            if W is not None:
+                mu = sp.coarse(AW.T.dot(r))
+                p -= W.dot(mu)
+            rTr, Ap_old = new_rTr, Ap
+
+        if n_s > 0:
+            sp.harvest(S[:, :n_s], AS[:, :n_s])
+        return x.reshape(shape), i, residuals, x_difs
+
+    def _full(self, tol, x, max_iter, x_true, **kwargs):
+        recalc = int(kwargs.get('recalc', 20))
+        x, i, residuals, x_difs = self._run(tol, x, max_iter, x_true, recalc)
+        if x_true is None:
+            return x, i, residuals
+        else:
+            return x, i, residuals, x_difs
+
+    def _bare(self, tol, x, max_iter, **kwargs):
+        recalc = int(kwargs.get('recalc', 20))
+        return self._run(tol, x, max_iter, None, recalc)[0]
+
+    def path(self, tol=10**-5, x_0=None, max_iter=500, **kwargs):
+        recalc = int(kwargs.get('recalc', 20))
+        self._check_ready()
+        if x_0 is None:
+            x = np.zeros(self.A.shape[1])
+        else:
+            x = np.copy(x_0)
+        path = []
+        self._run(tol, x, max_iter, None, recalc, path=path)
+        return path
+
+# TODO: path
 class PreconditionedCGSolver(Solver):
     """
     See algorithm 5.3 (page 119) in Nocedal and Wright.
-    Requires an intermediate solver.
+    Requires an intermediate solver for M y = r, or `Minv`, which applies
+    M^{-1} directly (e.g. util.SpectralZSolver built with precond=True).
     """
 
-    def __init__(self, A, b, M, \
-                    intermediate_solver, \
-                    intermediate_iter, intermediate_tol, \
-                    full_output=False):
+    def __init__(self, A, b, M=None, \
+                    intermediate_solver=None, \
+                    intermediate_iter=None, intermediate_tol=None, \
+                    full_output=False, Minv=None):
         self.A, self.b = A, b
         self.full_output = full_output
-        self.M = M
+        self.M, self.Minv = M, Minv
 
         # For solving:   M * y(i) = r(i)
         self.intermediate_solver = intermediate_solver
-        self.intermediate_iter = int(intermediate_iter)
-        self.intermediate_tol = float(intermediate_tol)
+        if Minv is None:
+            self.intermediate_iter = int(intermediate_iter)
+            self.intermediate_tol = float(intermediate_tol)
 
     def _check_ready(self):
         if self.A.shape[0] != len(self.b):
             raise la.LinAlgError('A\'s dimensions do not line up with b\'s.')
 
-        assert isinstance(self.M, np.ndarray) or isinstance(self.M, sp.spmatrix)
         assert self.A.shape[0] == self.A.shape[1]
+        if self.Minv is not None:
+            assert self.Minv.shape == self.A.shape
+            return
+        assert isinstance(self.M, np.ndarray) or isinstance(self.M, sp.spmatrix)
         assert self.M.shape == self.A.shape
 
+    def _precondition(self, r, x):
+        """ y = M^{-1} r """
+        if self.Minv is not None:
+            return np.asarray(self.Minv.dot(r)).reshape(r.shape)
+        inter_solver = self.intermediate_solver(A=self.M, b=r)
+        return inter_solver.solve(tol=self.intermediate_tol, x_0=np.copy(x), \
+                                  max_iter=self.intermediate_iter)
+
+    def _bare(self, tol, x, max_iter, **kwargs):
+        return self._full(tol, x, max_iter, None, **kwargs)[0]
+
 
     def _full(self, tol, x, max_iter, x_true, **kwargs):
         """
@@ -837,9 +1132,7 @@ class PreconditionedCGSolver(Solver):
         # FIRST DESCENT STEP: find initial search direction p(0) by solving
         # M y(0) = r(0) for y(0) and letting p(0) = -y(0)
         i = 1
-        inter_solver = self.intermediate_solver(A=self.M, b=r)
-        y = inter_solver.solve(tol=self.intermediate_tol, x_0=np.copy(x), \
-                                max_iter=self.intermediate_iter)
+        y = self._precondition(r, x)
         p = -np.copy(y)
 
         Ap = self.A.dot(p)
@@ -869,10 +1162,7 @@ class PreconditionedCGSolver(Solver):
             i += 1
 
             # If not, take another step
-            inter_solver.b = new_r
-            new_y = inter_solver.solve(tol=self.intermediate_tol, x_0=np.copy(x), \
-                                            max_iter=self.intermediate_iter)
-                                                    # ^ (5.39d) ^
+            new_y = self._precondition(new_r, x)     # (5.39d)
 
             new_rTy = np.dot(new_r.T, new_y)
 
@@ -1116,10 +1406,7 @@ class IterativeRefinementSolver(Solver):
 
     def _full(self, tol, x, max_iter, x_true, **kwargs):
         if 'eps' not in kwargs:
-            if sp.issparse(self.A):
-                eps = 2 * sparsela.norm(self.A)
-            else:
-                eps = 2 * la.norm(self.A)
+            eps = 2 * self._norm_A(float(kwargs.get('norm_tol', 10**-2)))
         else:
             eps = float(kwargs['eps'])
 
@@ -1159,10 +1446,7 @@ class IterativeRefinementSolver(Solver):
 
     def _bare(self, tol, x, max_iter, **kwargs):
         if 'eps' not in kwargs:
-            if sp.issparse(self.A):
-                eps = 2 * sparsela.norm(self.A)
-            else:
-                eps = 2 * la.norm(self.A)
+            eps = 2 * self._norm_A(float(kwargs.get('norm_tol', 10**-2)))
         else:
             eps = float(kwargs['eps'])
 
@@ -1175,7 +1459,7 @@ class IterativeRefinementSolver(Solver):
             eps *= 0.5
 
 
-            if sp.issparse(A_e):
+            if sp.issparse(self.A):
                 A_e = self.A + eps * sp.eye(self.A.shape[0])
                 x += sparsela.inv(A_e).dot(r)
             else:
@@ -1186,10 +1470,7 @@ class IterativeRefinementSolver(Solver):
 
     def path(self, tol=10**-5, x_0=None, max_iter=500, **kwargs):
         if 'eps' not in kwargs:
-            if sp.issparse(self.A):
-                eps = 2 * sparsela.norm(self.A)
-            else:
-                eps = 2 * la.norm(self.A)
+            eps = 2 * self._norm_A(float(kwargs.get('norm_tol', 10**-2)))
         else:
             eps = float(kwargs['eps'])
 
@@ -1211,7 +1492,7 @@ class IterativeRefinementSolver(Solver):
 
             eps *= 0.5
 
-            if sp.issparse(A_e):
+            if sp.issparse(self.A):
                 A_e = self.A + eps * sp.eye(self.A.shape[0])
                 x += sparsela.inv(A_e).dot(r)
             else:
@@ -1237,7 +1518,7 @@ class IterativeRefinementGeneralSolver(Solver):
     # OVERRIDES Solver CONSTRUCTOR
     def __init__(self, A=None, b=None, full_output=False, \
             intermediate_solver=None, intermediate_iter=100, \
-            intermediate_continuation=True):
+            intermediate_continuation=True, intermediate_kwargs=None):
 
         ## data input/output parameters
         self.A, self.b = A, b
@@ -1247,6 +1528,9 @@ class IterativeRefinementGeneralSolver(Solver):
         self.intermediate_solver = intermediate_solver
         self.intermediate_iter = intermediate_iter
         self.intermediate_continuation = intermediate_continuation
+        ## extra constructor arguments, e.g. a shared RecycleSpace (space=...)
+        ## so that a DeflatedCGSolver recycles across the shifts
+        self.intermediate_kwargs = {} if intermediate_kwargs is None else intermediate_kwargs
 
 
     def __str__(self):
@@ -1283,7 +1567,7 @@ class IterativeRefinementGeneralSolver(Solver):
 
     def _full(self, tol, x, max_iter, x_true, **kwargs):
         if 'eps' not in kwargs:
-            eps = 2 * la.norm(self.A)
+            eps = 2 * self._norm_A(float(kwargs.get('norm_tol', 10**-2)))
         else:
             eps = float(kwargs['eps'])
         if 'decay_rate' not in kwargs:
@@ -1319,7 +1603,8 @@ class IterativeRefinementGeneralSolver(Solver):
             A_e = self.A + eps * np.identity(len(self.A))
 
             # call intermediate solver method
-            solver_object = self.intermediate_solver(A_e, r, full_output=self.full_output)
+            solver_object = self.intermediate_solver(A_e, r, full_output=self.full_output, \
+                                                     **self.intermediate_kwargs)
 
             d_i, i_i, r_i, x_d_i = solver_object.solve(
                 tol=10**-5, x_0=r, max_iter=self.intermediate_iter, recalc=20, \
@@ -1338,7 +1623,7 @@ class IterativeRefinementGeneralSolver(Solver):
 
     def _bare(self, tol, x, max_iter, **kwargs):
         if 'eps' not in kwargs:
-            eps = 2 * la.norm(self.A)
+            eps = 2 * self._norm_A(float(kwargs.get('norm_tol', 10**-2)))
         else:
             eps = float(kwargs['eps'])
 
@@ -1353,7 +1638,8 @@ class IterativeRefinementGeneralSolver(Solver):
             A_e = self.A + eps * np.identity(len(self.A))
 
             ## call intermediate solver method
-            solver_object = self.intermediate_solver(A_e, r, full_output=self.full_output)
+            solver_object = self.intermediate_solver(A_e, r, full_output=self.full_output, \
+                                                     **self.intermediate_kwargs)
             d_i, i, r_i, x_d_i = solver_object.solve(tol=10**-5, x_0=r, \
                 max_iter=self.intermediate_iter, recalc=20, x_true=None)
             x += d_i
@@ -1362,7 +1648,7 @@ class IterativeRefinementGeneralSolver(Solver):
 
     def path(self, tol=10**-5, x_0=None, max_iter=500, **kwargs):
         if 'eps' not in kwargs:
-            eps = 2 * la.norm(self.A)
+            eps = 2 * self._norm_A(float(kwargs.get('norm_tol', 10**-2)))
         else:
             eps = float(kwargs['eps'])
 
@@ -1386,7 +1672,8 @@ class IterativeRefinementGeneralSolver(Solver):
             A_e = self.A + eps * np.identity(len(self.A))
 
             # call intermediate solver method
-            solver_object = self.intermediate_solver(A_e, r, full_output=self.full_output)
+            solver_object = self.intermediate_solver(A_e, r, full_output=self.full_output, \
+                                                     **self.intermediate_kwargs)
             d_i, i, r_i = solver_object.solve(tol=10**-5, x_0=r, \
                 max_iter=self.intermediate_iter, recalc=20, x_true=None)
             
@@ -1401,6 +1688,322 @@ class IterativeRefinementGeneralSolver(Solver):
 
 
 
+# ==============================================================================
+# RANDOMIZED LOW-RANK FACTORIZATION
+# ==============================================================================
+class LowRank:
+    """
+    Factored matrix U diag(s) Vt (e.g. from randomized_svd), applied without
+    forming the product: storage and products cost O((rows + cols) rank).
+    """
+
+    def __init__(self, U, s, Vt):
+        self.U, self.s, self.Vt = U, s, Vt
+        self.shape = (U.shape[0], Vt.shape[1])
+        self.rank = s.size
+
+    def dot(self, x):
+        return self.U.dot(self.s.reshape(-1, *([1]*(np.ndim(x)-1))) * self.Vt.dot(x))
+
+    @property
+    def T(self):
+        return LowRank(self.Vt.T, self.s, self.U.T)
+
+    def left(self, M):
+        """ M times this matrix, still factored """
+        return LowRank(np.asarray(M.dot(self.U)), self.s, self.Vt)
+
+    def toarray(self):
+        return (self.U * self.s).dot(self.Vt)
+
+    @property
+    def nbytes(self):
+        return self.U.nbytes + self.s.nbytes + self.Vt.nbytes
+
+def randomized_svd(A, rank=None, tol=None, block=10, n_oversample=10, n_power=1, max_rank=None, seed=None):
+    """
+    Randomized SVD (range finder + small dense SVD, Halko-Martinsson-Tropp)
+    using only products with A and A^T.
+
+    The range is grown `block` Gaussian probes at a time, each refined by
+    `n_power` power iterations (re-orthonormalized), until either `rank` +
+    `n_oversample` directions are found or the probabilistic bound
+    10 sqrt(2/pi) max_i ||(I - QQ^T) A w_i|| on the residual falls below
+    tol * sigma_1.
+
+    Args:
+        A:          matrix, sparse matrix or LinearOperator (with rmatvec)
+        rank:       target rank (or None, with `tol`)
+        tol:        relative accuracy ||A - U S Vt|| <~ tol ||A||
+        max_rank:   cap on the range dimension (default min(A.shape))
+
+    Returns:
+        LowRank U diag(s) Vt, truncated to `rank` or to s > tol s_1
+    """
+    if rank is None and tol is None:
+        raise ValueError('specify `rank` and/or `tol`')
+    A = sparsela.aslinearoperator(A)
+    m, n = A.shape
+    max_rank = min(m, n) if max_rank is None else min(max_rank, m, n)
+    target = max_rank if rank is None else min(rank + n_oversample, max_rank)
+    rng = np.random.RandomState(seed)
+    AH = A.H
+
+    Q = np.zeros((m, 0))
+    Bt = np.zeros((n, 0))       # (Q^T A)^T, grown with Q
+    while Q.shape[1] < target:
+        b = min(block, target - Q.shape[1])
+        Y = np.asarray(A.matmat(rng.randn(n, b)))
+        ## error bound from the plain probes A w_i (before power iterations)
+        err = 10*np.sqrt(2/np.pi) * la.norm(Y - Q.dot(Q.T.dot(Y)), axis=0).max()
+        for _ in range(n_power):
+            Y, _ = la.qr(Y - Q.dot(Q.T.dot(Y)))
+            Y = np.asarray(A.matmat(np.asarray(AH.matmat(Y))))
+        ## project out the current range (twice, for stability)
+        Y -= Q.dot(Q.T.dot(Y))
+        Y -= Q.dot(Q.T.dot(Y))
+        Qb, _ = la.qr(Y)
+        Qb, _ = la.qr(Qb - Q.dot(Q.T.dot(Qb)))     # keep Q orthonormal as Y -> 0
+        Q = np.hstack([Q, Qb])
+        Bt = np.hstack([Bt, np.asarray(AH.matmat(Qb))])
+        if tol is not None and rank is None:
+            if err <= tol * la.norm(Bt, 2):
+                break
+
+    Ub, s, Vt = la.svd(Bt.T, full_matrices=False)
+    keep = s.size if rank is None else min(rank, s.size)
+    if tol is not None:
+        keep = min(keep, max(1, int(np.sum(s > tol * s[0]))))
+    return LowRank(Q.dot(Ub[:, :keep]), s[:keep], Vt[:keep])
+
+class TSVDSolver(Solver):
+    """
+    Regularized solutions of Ax = b by spectral filtering of a randomized
+    (truncated) SVD A ~ U diag(s) V^T:
+
+        x = V diag(f(s) / s) U^T b,
+            'tikhonov':     f = s^2 / (s^2 + param)     (min ||Ax-b||^2 + param ||x||^2)
+            'truncation':   f = 1 for the `param` largest s, else 0
+
+    param=None (the default) leaves x unregularized within the factored
+    rank: 0 for Tikhonov, every factored singular value for truncation.
+
+    The factorization (randomized_svd with `n_power` power iterations) is
+    computed on the first solve and kept, so further right-hand sides and
+    filter parameters cost O((m + n) rank) each.
+
+    b may be a vector or an m x r block (r right-hand sides); x then has
+    the matching shape (n,) or n x r.
+
+    Args:
+        rank, tol:  target rank / relative accuracy of the factorization
+                    (see randomized_svd)
+        svd:        precomputed LowRank factorization of A
+    """
+
+    def __init__(self, A=None, b=None, full_output=False, rank=None, tol=None, \
+                 n_power=2, seed=None, svd=None, **kwargs):
+        Solver.__init__(self, A=A, b=b, full_output=full_output, **kwargs)
+        self.rank, self.tol = rank, tol
+        self.n_power, self.seed = n_power, seed
+        self.svd = svd
+
+    def __str__(self):
+        l1 = 'Randomized TSVD Solver\n'
+        if self.A is None:
+            l2 = 'A: None; '
+        else:
+            l2 = 'A: %d x %d; ' % (self.A.shape[0], self.A.shape[1])
+        if self.b is None:
+            l2 += 'b: None\n'
+        else:
+            l2 += 'b: %d x %d\n' % (len(self.b), len(self.b.T))
+        if self.svd is None:
+            l3 = 'rank: not factored yet; '
+        else:
+            l3 = 'rank: %d; ' % self.svd.rank
+        if self.full_output:
+            l3 += 'full_output: True'
+        else:
+            l3 += 'full_output: False'
+        return l1+l2+l3
+
+    def __repr__(self):
+        return self.__str__()
+
+    def factor(self):
+        """ randomized SVD of A (once) """
+        if self.svd is None:
+            if self.rank is None and self.tol is None:
+                raise AttributeError('set `rank` and/or `tol` (or pass `svd`).')
+            self.svd = randomized_svd(self.A, rank=self.rank, tol=self.tol, \
+                                      n_power=self.n_power, seed=self.seed)
+        return self.svd
+
+    def filter_factors(self, filter='tikhonov', param=None):
+        """ f(s) / s for the given filter """
+        s = self.factor().s
+        if filter == 'tikhonov':
+            return s / (s**2 + (0.0 if param is None else param))
+        elif filter == 'truncation':
+            k = s.size if param is None else int(param)
+            return np.where(np.arange(s.size) < k, 1.0 / s, 0.0)
+        else:
+            raise ValueError("filter must be 'tikhonov' or 'truncation'")
+
+    def filtered(self, b=None, params=(None,), filter='tikhonov'):
+        """
+        Regularized solutions for every parameter in `params` and every
+        column of b (default self.b), from one projection U^T b.
+
+        Returns
+            array with the parameters along the last axis: n x len(params)
+            (b a vector) or n x r x len(params) (b an m x r block)
+        """
+        svd = self.factor()
+        b = np.asarray(self.b if b is None else b)
+        c = svd.U.T.dot(b)
+        F = np.column_stack([self.filter_factors(filter, p) for p in params])
+        if c.ndim == 1:
+            return svd.Vt.T.dot(F * c[:, None])
+        return np.einsum('nk,kp,kr->nrp', svd.Vt.T, F, c)
+
+    def _full(self, tol, x, max_iter, x_true, filter='tikhonov', param=None, **kwargs):
+
+        ## initialize
+        i = 0
+        start_time = time.time()
+        residuals = []
+        b = np.asarray(self.b)
+        if x.ndim < b.ndim:
+            ## same initial guess for every column of b
+            x = np.tile(x.reshape(-1, 1), (1,) + b.shape[1:])
+        if x_true is not None:
+            x_difs = [la.norm(x - x_true)]
+
+        ## residuals (0)
+        r = b - self.A.dot(x)
+        residuals.append((la.norm(r), time.time() - start_time))
+
+        ## solve
+        x = self.filtered(params=(param,), filter=filter)[..., 0]
+
+        ## residuals (1)
+        r = b - self.A.dot(x)
+        residuals.append((la.norm(r), time.time() - start_time))
+
+        if x_true is not None:
+            x_difs.append(la.norm(x - x_true))
+
+        if x_true is None:
+            return x, i, residuals
+        else:
+            return x, i, residuals, x_difs
+
+    def _bare(self, tol, x, max_iter, filter='tikhonov', param=None, **kwargs):
+        return self.filtered(params=(param,), filter=filter)[..., 0]
+
+    def path(self, tol=10**-5, x_0=None, max_iter=500, filter='tikhonov', params=None, **kwargs):
+        """ regularized solutions along `params` (default: every truncation rank) """
+        self._check_ready()
+        if params is None:
+            filter, params = 'truncation', range(1, self.factor().rank + 1)
+        xs = self.filtered(params=params, filter=filter)
+        return [xs[..., j] for j in range(xs.shape[-1])]
+
+# ==============================================================================
+# SPECTRAL ESTIMATES
+# ==============================================================================
+def lanczos_extremes(A, tol=10**-2, max_iter=100, which='both', seed=None):
+    """
+    Extreme eigenvalues of a symmetric A (matrix, sparse matrix or
+    LinearOperator) by Lanczos with full reorthogonalization, using only
+    products with A. Iterations stop once the Ritz residual bound
+    beta_j |s_j| of the wanted extreme Ritz values is below tol times their
+    size (each eigenvalue is then within that distance of a Ritz value).
+
+    The largest eigenvalues converge in a few dozen steps; the smallest
+    converge at a rate governed by the condition number, so lam_min is an
+    upper estimate (and lam_max / lam_min a lower estimate of the
+    condition number) when max_iter is reached first.
+
+    Args:
+        which:  'both', 'max' or 'min' extreme(s) checked for convergence
+    Returns:
+        lam_min, lam_max (Ritz values), n_iter
+    """
+    A = sparsela.aslinearoperator(A)
+    n = A.shape[0]
+    max_iter = min(max_iter, n)
+    rng = np.random.RandomState(seed)
+    Q = np.zeros((n, max_iter+1))
+    q = rng.randn(n)
+    Q[:, 0] = q / la.norm(q)
+    alphas, betas = [], []
+    for j in range(max_iter):
+        w = np.asarray(A.matvec(Q[:, j])).reshape(-1)
+        if j > 0:
+            w -= betas[-1] * Q[:, j-1]
+        alphas.append(Q[:, j].dot(w))
+        w -= alphas[-1] * Q[:, j]
+        w -= Q[:, :j+1].dot(Q[:, :j+1].T.dot(w))
+        beta = la.norm(w)
+        T = np.diag(alphas) + np.diag(betas, 1) + np.diag(betas, -1)
+        theta, S = la.eigh(T)
+        res = beta * np.abs(S[-1])
+        scale = np.abs(theta).max()
+        done_min = which == 'max' or res[0] <= tol * max(abs(theta[0]), 10**-16 * scale)
+        done_max = which == 'min' or res[-1] <= tol * abs(theta[-1])
+        if (done_min and done_max) or beta <= 10**-14 * scale:
+            break
+        betas.append(beta)
+        Q[:, j+1] = w / beta
+    return theta[0], theta[-1], j+1
+
+def _is_symmetric(A, rtol=10**-10, seed=None):
+    """
+    A == A^T, compared entrywise for dense/sparse A, else by one random
+    test u^T (A v) == v^T (A u) with probes from a local RandomState(seed)
+    (the global np.random state is left alone)
+    """
+    if A.shape[0] != A.shape[1]:
+        return False
+    if sp.issparse(A):
+        D = abs(A - A.T)
+        return D.nnz == 0 or D.max() <= rtol * abs(A).max()
+    if isinstance(A, np.ndarray):
+        return np.abs(A - A.T).max() <= rtol * np.abs(A).max()
+    rng = np.random.RandomState(seed)
+    u, v = rng.randn(A.shape[0]), rng.randn(A.shape[0])
+    Av, Au = np.asarray(A.dot(v)).reshape(-1), np.asarray(A.dot(u)).reshape(-1)
+    return abs(u.dot(Av) - v.dot(Au)) <= rtol * la.norm(Av) * la.norm(u)
+
+def norm_estimate(A, tol=10**-2, max_iter=100, symmetric=None, seed=None):
+    """
+    ||A||_2 to relative accuracy ~tol by Lanczos: on A itself if it is
+    symmetric (largest |Ritz value|), else on A^T A. Costs O(nnz(A))
+    per step instead of a full norm or SVD.
+    """
+    if symmetric is None:
+        symmetric = _is_symmetric(A, seed=seed)
+    if symmetric:
+        lo, hi, _ = lanczos_extremes(A, tol=tol, max_iter=max_iter, which='both', seed=seed)
+        return max(abs(lo), abs(hi))
+    A = sparsela.aslinearoperator(A)
+    AtA = sparsela.LinearOperator((A.shape[1], A.shape[1]), dtype=float, \
+                                  matvec=lambda v: A.rmatvec(A.matvec(v)))
+    _, hi, _ = lanczos_extremes(AtA, tol=tol, max_iter=max_iter, which='max', seed=seed)
+    return np.sqrt(hi)
+
+def cond_estimate(A, tol=10**-2, max_iter=300, seed=None):
+    """
+    lam_max / lam_min of a symmetric positive-definite A from Lanczos Ritz
+    values (a lower estimate of the condition number if lam_min has not
+    converged within max_iter; see lanczos_extremes).
+    """
+    lo, hi, _ = lanczos_extremes(A, tol=tol, max_iter=max_iter, which='both', seed=seed)
+    return hi / lo
+
 # TODO: BiCGStab
 
 
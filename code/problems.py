@@ -2,10 +2,9 @@ import numpy as np
 import scipy.sparse as sps
 import numpy.linalg as la
 import scipy.sparse.linalg as spsla
-import matplotlib.pyplot as plt
 import time, traceback, sys
 
-import util, optimize
+import util, optimize, cache
 import tomo1D.blur_1d as blur_1d
 import tomo2D.blur_2d as blur_2d
 import tomo2D.drt as drt
@@ -30,14 +29,48 @@ class Problem:
         - ESI      :    True = generates equiv symm indef representation
         - ESIN     :    True = generates equiv symm indef NORMAL eqn representation
         - ESI3     :    True = generates expanded ESI 3x3 system per Sean's notes
-        - dir_soln :    True = generates direct inverse Hotelling template
+        - dir_soln :    True = generates direct Hotelling template (MR_direct, w_direct)
+
+    The ESI/ESIN/ESI3 systems and the direct solution are built eagerly by
+    create_problem when their flag is True, and otherwise lazily on first
+    access of ESI_A/ESI_b, ESIN_A/ESIN_b, ESI3_A/ESI3_b or MR_direct/w_direct.
+    The full reconstruction operator R_direct (n x m) is only built if read,
+    and w_iter is the template from util.iterative_solve (never forms R).
+    Zinv is the exact Fourier/DCT Z^{-1} (util.spectral_Z_solver) for
+    periodic or reflective blur; for other blur it is the inexact spectral
+    form (Zinv.exact False), which preconditions the CG solves with Z.
+
+    With a `cache_dir` (see create_problem) only explicit matrices are
+    stored. A matrix-free X (op='kron', 'fft', 'matfree' or 'symmetric') and
+    the operator forms of the systems built from it are rebuilt on every
+    run; for op='symmetric' that re-traces the fundamental rays. With
+    K_diag=None the random Kb is drawn before the cache key is computed, so
+    the key holds its values: runs never share entries (nor reuse a
+    previous run's random Kb). Pass K_diag to reuse the cache.
+
+    kwargs:
+        - headless :    True = never plot and never import matplotlib
+                        (batch jobs); implies plot=False
+        - plot     :    plot the generated image
+        - levels   :    number of level changes in the generated image
+        - geometry :    drt.ParallelBeam or drt.FanBeam for x-ray problems;
+                        sets `m` (which must equal geometry.m if given)
+        - n_jobs   :    worker processes tracing the rays of an x-ray X
+                        (default 1; see drt.gen_X)
     """
 
+    ## attribute -> method building it on first access (see __getattr__)
+    _lazy = {'ESI_A': '_set_esi', 'ESI_b': '_set_esi', \
+             'ESIN_A': '_set_esin', 'ESIN_b': '_set_esin', \
+             'ESI3_A': '_set_esi3', 'ESI3_b': '_set_esi3', \
+             'MR_direct': '_set_direct', 'w_direct': '_set_direct', \
+             'R_direct': '_set_rxn', 'w_iter': '_set_iterative'}
+
     def __init__(   self, prob=None, dim=None, \
                     n_1=None, n_2=None, m=None, \
                     k=None, r=None, lam=None, B=None, \
-                    ESI=True, ESIN=True, ESI3=True, \
-                    dir_soln=True,
+                    ESI=False, ESIN=False, ESI3=False, \
+                    dir_soln=False,
                     **kwargs
                 ):
 
@@ -61,8 +94,14 @@ class Problem:
                 self.dim = 2
                 self.n = self.n_1 * self.n_2
 
+        ## x-ray geometry: the single source of `m` when given
+        self.geometry = kwargs.get('geometry', None)
+        if self.geometry is not None:
+            self._check_geometry(self.geometry)
         if self.m is None:
-            if self.prob == 'b':
+            if self.geometry is not None:
+                self.m = self.geometry.m
+            elif self.prob == 'b':
                 self.m = self.n
             else:
                 print('must specify `m` for x-ray problem')
@@ -72,13 +111,19 @@ class Problem:
 
         ## set defaults --------------------------------------------------------
         self.levels = kwargs.get('levels',3)
-        self.plot = kwargs.get('plot',True)
+        self.headless = kwargs.get('headless',False)
+        self.plot = kwargs.get('plot',not self.headless) and not self.headless
+        self.n_jobs = kwargs.get('n_jobs',1)
 
         if bool(kwargs):
             print('=============== Setting Defaults ==================')
             print(kwargs)
             print('===================================================')
 
+    def _check_geometry(self, geometry):
+        if self.m is not None and self.m != geometry.m:
+            raise ValueError('m = %s but geometry fires %s rays' % (self.m, geometry.m))
+
     def __str__(self):
         l0 = '=================== setup ====================\n'
         l1 = '(n_1, n_2, m) = (' + str(self.n_1) +', ' + str(self.n_2) + ', ' + str(self.m) + ')\n'
@@ -99,16 +144,43 @@ class Problem:
     def __repr__(self):
         return self.__str__()
 
+    def __getattr__(self, name):
+        ## only reached for attributes not set yet: build lazy ones on demand
+        builder = Problem._lazy.get(name)
+        if builder is None or 'sb' not in self.__dict__:
+            raise AttributeError(name)
+        getattr(self, builder)()
+        return self.__dict__[name]
+
     def _set_inputs(self, **kwargs):
         if 'K_diag' and 'sigma' and 't' and 'sparse' in kwargs:
             self.K_diag = kwargs['K_diag']
             self.sigma = kwargs['sigma']
             self.t = kwargs['t']
             self.sparse = kwargs['sparse']
+            self.boundary = kwargs.get('boundary', 'periodic')
+            self.op = kwargs.get('op', 'sparse')
+            self._set_geometry(kwargs.get('geometry', None))
+            self.cache_dir = kwargs.get('cache_dir', None)
+            self.hot_tol = kwargs.get('hot_tol', 10**-8)
+            if self.K_diag is None and self.cache_dir is not None:
+                ## draw the random Kb (as util.gen_Kb would) before keying
+                self.K_diag = abs(np.random.randn(self.m))
         else:
             print('must specify all of `K_diag`, `sigma`, `t`, and `sparse`')
             raise
 
+    def _set_geometry(self, geometry):
+        ## geometry may be given to Problem(...) or create_problem, not both
+        ## differently: `m` was derived from (or checked against) the first
+        if geometry is None:
+            return
+        if self.geometry is not None and \
+           cache.cache_key(g=geometry) != cache.cache_key(g=self.geometry):
+            raise ValueError('create_problem geometry differs from the one given to Problem')
+        self._check_geometry(geometry)
+        self.geometry = geometry
+
     def _set_image(self, **kwargs):
         ## generate image f ----------------------------------------------------
         if self.dim == 1:
@@ -128,14 +200,63 @@ class Problem:
         ## vectorize image to generate true signal -----------------------------
         self.sx = self.f.flatten('F').reshape(self.n, 1, order='F')
 
+    def _set_cache(self, **kwargs):
+        ## content-addressed cache of the generated matrices (if `cache_dir`) --
+        self._cache, self._key = None, None
+        if self.cache_dir is not None:
+            self._cache = cache.MatrixCache(self.cache_dir)
+            self._params = dict(prob=self.prob, dim=self.dim, n_1=self.n_1, n_2=self.n_2, m=self.m, \
+                                k=self.k, r=self.r, lam=self.lam, B=self.B, K_diag=self.K_diag, \
+                                sigma=self.sigma, t=self.t, sparse=self.sparse, boundary=self.boundary, \
+                                op=self.op, geometry=self.geometry, sx=self.sx)
+            self._key = cache.cache_key(**self._params)
+
+    def _load_cached(self, *names):
+        """ set attributes `names` from the cache; False if any is missing """
+        if self._cache is None or not self._cache.has(self._key, *names):
+            return False
+        for name in names:
+            setattr(self, name, self._cache.load(self._key, name))
+        return True
+
+    def _store_cached(self, *names):
+        if self._cache is None:
+            return
+        for name in names:
+            A = getattr(self, name)
+            if self._cache.storable(A):
+                self._cache.save(self._key, name, A, params=self._params)
+
     def _set_operators(self, **kwargs):
         ## generate Kb and operators X & M -------------------------------------
+        if not self._load_cached('Kb', 'X', 'M'):
+            self._gen_operators(**kwargs)
+            self._store_cached('Kb', 'X', 'M')
+
+        ## generate B regularization if empty ----------------------------------
+        if self.B is None: self.B = sps.eye(self.n)
+
+        ## Fourier/DCT Z-solver (declared for periodic/reflect blur, else detected)
+        if self.prob == 'b' and self.boundary in ('periodic', 'reflect'):
+            boundary = self.boundary
+        else:
+            boundary = None
+        self.Zinv = util.spectral_Z_solver(X=self.X, lam=self.lam, B=self.B, \
+                                           n_1=self.n_1, n_2=self.n_2, boundary=boundary)
+        if self.Zinv is None and self.prob == 'b':
+            ## not diagonalized (zero boundary or B != I): the spectral form
+            ## still preconditions the CG solves with Z (Zinv.exact is False)
+            self.Zinv = util.spectral_Z_solver(X=self.X, lam=self.lam, B=self.B, \
+                                               n_1=self.n_1, n_2=self.n_2, precond=True)
+
+    def _gen_operators(self, **kwargs):
         if self.dim == 1:
             if self.prob == 'b':
                 self.Kb, self.X, self.M = util.gen_instance_1d_blur(m=self.m, n=self.n, k=self.k, \
                                                                     K_diag=self.K_diag, \
                                                                     sigma=self.sigma, t=self.t, \
-                                                                    sparse=self.sparse)
+                                                                    sparse=self.sparse, boundary=self.boundary, \
+                                                                    op=self.op)
             elif self.prob == 'x':
                 print('`x`-xray only allowed for 2D')
                 sys.exit(0)
@@ -148,12 +269,14 @@ class Problem:
                                                                     ri=self.r, k=self.k,
                                                                     K_diag=self.K_diag, \
                                                                     sigma=self.sigma, t=self.t, \
-                                                                    sparse=self.sparse)
+                                                                    sparse=self.sparse, boundary=self.boundary, \
+                                                                    op=self.op)
             elif self.prob == 'x':
                 self.Kb, self.X, self.M = util.gen_instance_2d_xray(m=self.m, n_1=self.n_1, n_2=self.n_2, \
                                                                     ri=self.r, k=self.k,
                                                                     K_diag=self.K_diag, \
-                                                                    sparse=self.sparse)
+                                                                    sparse=self.sparse, op=self.op, \
+                                                                    geometry=self.geometry, n_jobs=self.n_jobs)
             else:
                 print('problem type not supported, choose `b`-blur or `x`-xray')
                 sys.exit(0)
@@ -161,34 +284,57 @@ class Problem:
             print('dim > 2 not implemented yet')
             sys.exit(0)
 
-        ## generate B regularization if empty ----------------------------------
-        if self.B is None: self.B = sps.eye(self.n)
-
     def _set_systems(self, **kwargs):
-        ## generate equivalent symmetric system (ESI) --------------------------
+        ## build the flagged systems now (the rest stay lazy) ------------------
+        if self.ESIN and not self.ESI:
+            self.ESI = True
         if self.ESI:
+            self._set_esi()
+        if self.ESIN:
+            self._set_esin()
+        if self.ESI3:
+            self._set_esi3()
+
+    def _set_esi(self):
+        ## generate equivalent symmetric system (ESI) --------------------------
+        if not self._load_cached('ESI_A', 'ESI_b'):
             self.ESI_A, self.ESI_b = util.gen_ESI_system(   X=self.X, Kb=self.Kb, B=self.B, \
                                                             M=self.M, lam=self.lam, sb=self.sb  )
+            self._store_cached('ESI_A', 'ESI_b')
 
+    def _set_esin(self):
         ## generate ESI^T ESI normal equations ---------------------------------
-        if self.ESIN:
-            if not self.ESI:
-                self.ESI = True
-                self.ESI_A, self.ESI_b = util.gen_ESI_system(   X=self.X, Kb=self.Kb, B=self.B, \
-                                                                M=self.M, lam=self.lam, sb=self.sb  )
+        if not self._load_cached('ESIN_A', 'ESIN_b'):
             self.ESIN_A = self.ESI_A.T.dot(self.ESI_A)
             self.ESIN_b = self.ESI_A.T.dot(self.ESI_b)
+            self._store_cached('ESIN_A', 'ESIN_b')
 
+    def _set_esi3(self):
         ## generate ESI3 equations ---------------------------------------------
-        if self.ESI3:
+        if not self._load_cached('ESI3_A', 'ESI3_b'):
             self.ESI3_A, self.ESI3_b = util.gen_ESI3_system(   X=self.X, Kb=self.Kb, B=self.B, \
                                                             M=self.M, lam=self.lam, sb=self.sb  )
+            self._store_cached('ESI3_A', 'ESI3_b')
 
     def _set_direct(self, **kwargs):
-        ## generate direct solve Hotelling Template (small problems) -----------
-        if self.dir_soln:
-            self.R_direct = util.direct_rxn(X=self.X, lam=self.lam)
-            self.w_direct,_,_ = util.direct_solve(Kb=self.Kb, R=self.R_direct, M=self.M, sb=self.sb)
+        ## generate direct solve Hotelling Template (k solves with Z) ----------
+        if not self._load_cached('MR_direct', 'w_direct'):
+            self.MR_direct = util.direct_mrxn(X=self.X, lam=self.lam, B=self.B, M=self.M, \
+                                              sparse=self.sparse, Zinv=self.Zinv)
+            self.w_direct,_,_ = util.direct_solve(Kb=self.Kb, MR=self.MR_direct, sb=self.sb)
+            self._store_cached('MR_direct', 'w_direct')
+
+    def _set_rxn(self, **kwargs):
+        ## full reconstruction operator R = Z^{-1} X^T (m solves with Z) -------
+        if not self._load_cached('R_direct'):
+            self.R_direct = util.direct_rxn(X=self.X, lam=self.lam, B=self.B, \
+                                            sparse=self.sparse, Zinv=self.Zinv)
+            self._store_cached('R_direct')
+
+    def _set_iterative(self, **kwargs):
+        ## Hotelling template by nested CG (no R, M R or Kx formed) ------------
+        self.w_iter = util.iterative_solve(X=self.X, Kb=self.Kb, M=self.M, B=self.B, lam=self.lam, \
+                                           sb=self.sb, Zinv=self.Zinv, tol=self.hot_tol)
 
     def create_problem(self, **kwargs):
         """
@@ -202,19 +348,43 @@ class Problem:
                 - K_diag  :   diagonal for data covariance matrix Kb
                 - sigma   :   sd for Gaussian blur
                 - t       :   pixels for discretized Gaussian blur
+
+            + optionally (blur problems):
+                - boundary:   `periodic` (default), `zero` or `reflect`
+                - op      :   `sparse` (default), `kron` (2D matrix-free X) or
+                              `fft` (FFT-based matrix-free X, periodic only)
+
+            + optionally (x-ray problems):
+                - op      :   `sparse` (default), `matfree` (rays traced on demand)
+                              or `symmetric` (symmetry-compressed rays)
+                - geometry:   drt.ParallelBeam or drt.FanBeam, if not already
+                              given to Problem(...) (then it must be the same;
+                              `m` must equal geometry.m)
+
+            + optionally:
+                - cache_dir:  directory of a cache.MatrixCache; Kb, X, M, the
+                              ESI systems and the direct solution are stored
+                              there keyed by the generating parameters and
+                              reloaded (memory-mapped) on later calls (only
+                              explicit matrices; see the class docstring)
+                - hot_tol  :  relative residual of the iterative template
+                              w_iter (default 1e-8)
         """
         ## set attributes ------------------------------------------------------
         self._set_inputs(**kwargs)
         self._set_image(**kwargs)
+        self._set_cache(**kwargs)
         self._set_operators(**kwargs)
 
         ## set data signal -----------------------------------------------------
         self.sb = self.X.dot(self.sx)
-        if self.dim == 2:
+        if not self.headless:
+            import matplotlib.pyplot as plt
+        if self.dim == 2 and not self.headless:
             plt.imshow(self.sb.reshape(self.n_1, self.n_2, order='F'))
             plt.title('blurred image')
             plt.show()
-        if self.dim == 1:
+        if self.dim == 1 and not self.headless:
             plt.plot(self.sb.reshape(self.n, 1, order='F'))
             plt.title('blurred image')
             plt.show()
@@ -228,6 +398,38 @@ class Problem:
             self._set_direct(**kwargs)
 
 
+    def load_problem(self, X=None, Kb=None, M=None, sb=None, **kwargs):
+        """
+        Set up the problem from given operators and data (e.g. measured data,
+        see `hotomo_problem`) instead of generating them; the true image is
+        unknown, so `sx` is None.
+
+        kwargs:
+            + specify ANY/NONE of:
+                - sparse   :   `True` (default) or `False`
+                - cache_dir:   as in `create_problem`
+                - hot_tol  :   as in `create_problem`
+        """
+        self.X, self.Kb, self.M, self.sb, self.sx = X, Kb, M, sb, None
+        self.K_diag = Kb.diagonal() if hasattr(Kb, 'diagonal') else np.diag(Kb)
+        self.sigma, self.t, self.geometry = None, None, None
+        self.sparse = kwargs.get('sparse', True)
+        self.boundary, self.op = None, 'sparse'
+        self.cache_dir = kwargs.get('cache_dir', None)
+        self.hot_tol = kwargs.get('hot_tol', 10**-8)
+        self._set_cache(**kwargs)
+        if self._cache is not None:
+            self._params.update(sx=None, X=X, Kb=Kb, M=M, sb=sb)
+            self._key = cache.cache_key(**self._params)
+
+        if self.B is None: self.B = sps.eye(self.n)
+        self.Zinv = util.spectral_Z_solver(X=self.X, lam=self.lam, B=self.B, n_1=self.n_1, n_2=self.n_2)
+
+        if self.ESI or self.ESIN or self.ESI3:
+            self._set_systems(**kwargs)
+        if self.dir_soln:
+            self._set_direct(**kwargs)
+
     def summarize(self):
         print(self.__repr__())
         print('================== contents ==================')
@@ -256,6 +458,44 @@ class Problem:
         print('ESI3_A shape  = ' + str(self.ESI3_A.shape))
         print('ESI3_b shape  = ' + str(self.ESI3_b.shape))
 
+def hotomo_problem(path=None, X=None, lam=None, mmap=True, sparse=True, n_1=35, n_2=None, **kwargs):
+    """
+    Problem for the HOTomoMats data set (util.load_hotomo), ready for
+    projection.test_proj_alg and the solvers.
+
+    Args:
+        - path     :    data directory (default data/HOTomoMats)
+        - X        :    system matrix; required when Amat.npy is not in `path`
+        - lam      :    regularization parameter (default: first of lambdas.npy)
+        - mmap     :    memory-map the data arrays
+        - n_1, n_2 :    image rows and columns (default 35 rows, and as many
+                        columns as the pixels of M give); n_1 n_2 must equal
+                        the number of columns of M and X
+        - kwargs   :    passed to Problem (ESI, ESIN, ESI3, dir_soln, B) and to
+                        Problem.load_problem (cache_dir, hot_tol)
+    """
+    Kb, X_data, M, sb, lams = util.load_hotomo(path=path, mmap=mmap, sparse=sparse)
+    if X is None:
+        X = X_data
+    if X is None:
+        raise ValueError('Amat.npy not found in %s: pass the system matrix as `X`' % (path or util.HOTOMO_DIR))
+    if lam is None:
+        lam = float(lams[0])
+
+    ## image size: checked against the data here, not at the first product
+    n = M.shape[1]
+    if n_2 is None:
+        n_2 = n // n_1
+    if n_1*n_2 != n or X.shape[1] != n:
+        raise ValueError('%d x %d image, but M has %d and X has %d columns' % (n_1, n_2, n, X.shape[1]))
+    if X.shape[0] != Kb.shape[0]:
+        raise ValueError('X has %d rows, but the data has %d measurements' % (X.shape[0], Kb.shape[0]))
+
+    opts = dict((key, kwargs.pop(key)) for key in ('ESI', 'ESIN', 'ESI3', 'dir_soln', 'B') if key in kwargs)
+    p = Problem(prob='x', dim=2, n_1=n_1, n_2=n_2, m=X.shape[0], k=M.shape[0], lam=lam, **opts)
+    p.load_problem(X=X, Kb=Kb, M=M, sb=sb, sparse=sparse, **kwargs)
+    return p
+
 if __name__ == '__main__':
     ## 1D BLUR
     p_1d_blur = Problem(prob='b', dim=1, \
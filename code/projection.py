@@ -23,8 +23,62 @@ import tomo2D.drt as drt
 import matplotlib.pyplot as plt
 from tomo2D import blur_2d as blur_2d
 
+class ConstraintProjector:
+    """
+    Exact orthogonal projector onto the constraint set
+        (I - M.T M)(A.T A + lam B.T B) u = 0   <=>   u in range(Z^-1 M.T)
+    for when Z^-1 is cheap to apply (see util.spectral_Z_solver). Costs k
+    applications of Z^-1 up front; stands in for the constraint
+    ConjugateGradientsSolver (same `A`, `b` and `solve(x_0=...)`).
+    """
+
+    def __init__(self, A, Zinv, M):
+        self.A = A
+        self.b = np.zeros(A.shape[0])
+        if sps.issparse(M):
+            MT = M.T.toarray()
+        else:
+            MT = np.asarray(M.T)
+        self.Q, _ = la.qr(Zinv.dot(MT))
+
+    def solve(self, x_0=None, **kwargs):
+        return self.Q.dot(self.Q.T.dot(x_0))
+
+def _system_matrices(Kb, A, lam, M, B=None):
+    """
+    Matrices of the minimization and constraint systems shared by pocs, dr
+    and raar:
+        A.T Kb A                           (minimization)
+        (I - M.T M)(A.T A + lam B.T B)     (constraint [2])
+    formed explicitly for dense or sparse A, and as LinearOperators for a
+    matrix-free A (e.g. blur_2d.FFTBlurOperator2d, drt.XrayOperator).
+
+    Returns:
+        min_A, constr_A, B (B defaulted to the identity)
+    """
+    n = A.shape[1]
+    if isinstance(A, spsla.LinearOperator):
+        if B is None:
+            B = sps.eye(n)
+        AtKbA = lambda v: A.T.dot(Kb.dot(A.dot(v)))
+        min_A = spsla.LinearOperator((n, n), dtype=float, matvec=AtKbA, rmatvec=AtKbA)
+        P = spsla.aslinearoperator(sps.eye(n) - M.T.dot(M))
+        return min_A, P * util.z_operator(X=A, lam=lam, B=B), B
+
+    if sps.issparse(A):
+        iden = sps.eye
+        assert sps.issparse(M)
+    else:
+        iden = np.identity
+        assert not sps.issparse(M)
+
+    # B default: identity
+    if B is None:
+        B = iden(n)
+    return A.T.dot(Kb.dot(A)), (iden(n) - M.T.dot(M)).dot(A.T.dot(A) + lam * B.T.dot(B)), B
+
 def pocs(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
-        sl=None, verbose=False, R=None):
+        sl=None, verbose=False, R=None, Zinv=None, MR=None, recycle=0):
     """
     Projection onto Convex Sets.
 
@@ -41,7 +95,7 @@ def pocs(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
     ============================================================================
     Args:
           Kb:     Covariance matrix (in data space).
-           A:     Forward projector/blurrer.
+           A:     Forward projector/blurrer (dense, sparse or LinearOperator).
           sb:     Signal in data space.
          lam:     Regularization strength.
            M:     Mask matrix.
@@ -52,37 +106,39 @@ def pocs(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
                     (linear constraint must be completely accurate).
 
         full_output: TODO - for plotting intermediate info...
+        Zinv:     Fast Z^-1 (util.spectral_Z_solver); if given and exact, the
+                    constraint is enforced by exact projection
+                    (ConstraintProjector).
+          MR:     M R (util.direct_mrxn), used instead of R for the
+                    Hotelling residuals of full_output.
+     recycle:     if > 0, the minimization systems are solved by deflated
+                    CG recycling this many approximate eigenvectors across
+                    iterations (optimize.DeflatedCGSolver).
 
     Returns:
         Optimal u.
     """
     t0 = time.time()
     n = A.shape[1]
-
-    if sps.issparse(A):
-        iden = sps.eye
-        assert sps.issparse(M)
-    else:
-        iden = np.identity
-        assert not sps.issparse(M)
-
-    # B default: identity
-    if B is None: 
-        B = iden(n)
+    min_A, constr_A, B = _system_matrices(Kb, A, lam, M, B=B)
 
     u = np.zeros(n)
 
     # Set up solver for minimization term
     # A.T Kb A u = A.T sb
     min_solver = optimize.ConjugateGradientsSolver(
-        A=A.T.dot(Kb.dot(A)), b=A.T.dot(sb), full_output=0
+        A=min_A, b=A.T.dot(sb), full_output=0
     )
+    if recycle:
+        min_solver = optimize.DeflatedCGSolver(A=min_solver.A, b=min_solver.b, \
+                                               full_output=0, n_recycle=recycle)
 
     # Set up solver for constraint term [2]
     constr_solver = optimize.ConjugateGradientsSolver(
-        A=(iden(n) - M.T.dot(M)).dot(A.T.dot(A) + lam * B.T.dot(B)), \
-        b=np.zeros(n), full_output=0
+        A=constr_A, b=np.zeros(n), full_output=0
     )
+    if Zinv is not None and Zinv.exact:
+        constr_solver = ConstraintProjector(constr_solver.A, Zinv, M)
 
     start_time = time.time()
     times = []
@@ -91,8 +147,8 @@ def pocs(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
     us = []
     us.append(u)
     if full_output:
-        if R is None:
-            print 'full_output requires R'
+        if R is None and MR is None:
+            print 'full_output requires R or MR'
             sys.exit(0)
         hot_resids = []    # hotelling template check
 
@@ -137,11 +193,10 @@ def pocs(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
 
         ## check eq outside of timed loop
         if full_output:
+            Kx, sx = util.hotelling_system(Kb=Kb, M=M, sb=sb, R=R, MR=MR)
             for uu in us:
                 w = util.calc_hot(X=A, B=B, lam=lam, M=M, u=uu)
-                hot_resids.append(
-                    la.norm(M.dot(R).dot(Kb).dot(R.T).dot(M.T).dot(w) - M.dot(R).dot(sb))
-                    )
+                hot_resids.append(la.norm(Kx.dot(w) - sx))
 
             #raw_input()
     except KeyboardInterrupt:
@@ -155,7 +210,7 @@ def pocs(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
         return u
 
 def dr(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
-        order=None, sl=None, verbose=False, R=None):
+        order=None, sl=None, verbose=False, R=None, Zinv=None, MR=None, recycle=0):
     """
     Douglas-Rachford.
 
@@ -169,7 +224,7 @@ def dr(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
     ============================================================================
     Args:
           Kb:     Covariance matrix (in data space).
-           A:     Forward projector/blurrer.
+           A:     Forward projector/blurrer (dense, sparse or LinearOperator).
           sb:     Signal in data space.
          lam:     Regularization strength.
            M:     Mask matrix.
@@ -182,6 +237,14 @@ def dr(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
           sl:     step length, default is 2 (i.e., reflection)
 
         full_output: TODO - for plotting intermediate info...
+        Zinv:     Fast Z^-1 (util.spectral_Z_solver); if given and exact, the
+                    constraint is enforced by exact projection
+                    (ConstraintProjector).
+          MR:     M R (util.direct_mrxn), used instead of R for the
+                    Hotelling residuals of full_output.
+     recycle:     if > 0, the minimization systems are solved by deflated
+                    CG recycling this many approximate eigenvectors across
+                    iterations (optimize.DeflatedCGSolver).
 
     Returns:
         Optimal u.
@@ -190,16 +253,8 @@ def dr(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
     # shape
     t0 = time.time()
     n = A.shape[1]
-    # sparsity
-    if sps.issparse(A):
-        iden = sps.eye
-        assert sps.issparse(M)
-    else:
-        iden = np.identity
-        assert not sps.issparse(M)
-    # B default: identity
-    if B is None: 
-        B = iden(n)
+    # system matrices (explicit, or operators for a matrix-free A); B default: identity
+    min_A, constr_A, B = _system_matrices(Kb, A, lam, M, B=B)
     # sl default: reflection
     if sl is None: 
         sl = 2.
@@ -209,13 +264,17 @@ def dr(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
     ## operator - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     # A.T Kb A u = A.T sb
     min_solver = optimize.ConjugateGradientsSolver(
-        A=A.T.dot(Kb.dot(A)), b=A.T.dot(sb), full_output=0
+        A=min_A, b=A.T.dot(sb), full_output=0
     )
+    if recycle:
+        min_solver = optimize.DeflatedCGSolver(A=min_solver.A, b=min_solver.b, \
+                                               full_output=0, n_recycle=recycle)
     # (I - M.T M)(A.T A + lam B.T B) u = 0
     constr_solver = optimize.ConjugateGradientsSolver(
-        A=(iden(n) - M.T.dot(M)).dot(A.T.dot(A) + lam * B.T.dot(B)), \
-        b=np.zeros(n), full_output=0
+        A=constr_A, b=np.zeros(n), full_output=0
     )
+    if Zinv is not None and Zinv.exact:
+        constr_solver = ConstraintProjector(constr_solver.A, Zinv, M)
 
     min_resids = []         #
     constr_resids = []      #
@@ -226,8 +285,8 @@ def dr(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
 
     if full_output:
         hot_resids = []
-        if R is None:
-            print 'full_output requires R'
+        if R is None and MR is None:
+            print 'full_output requires R or MR'
             sys.exit(0)
 
 
@@ -327,11 +386,10 @@ def dr(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
 
     ## check eq outside of timed loop
     if full_output:
+        Kx, sx = util.hotelling_system(Kb=Kb, M=M, sb=sb, R=R, MR=MR)
         for uu in us:
             w = util.calc_hot(X=A, B=B, lam=lam, M=M, u=uu)
-            hot_resids.append(
-                la.norm(M.dot(R).dot(Kb).dot(R.T).dot(M.T).dot(w) - M.dot(R).dot(sb))
-                )
+            hot_resids.append(la.norm(Kx.dot(w) - sx))
 
     if full_output:
         tt = time.time()-t0
@@ -343,7 +401,7 @@ def dr(Kb, A, sb, lam, M, B=None, max_iter=500, tol=10**-5, full_output=0, \
         return w_0
 
 def raar(Kb, A, sb, lam, M, beta, B=None, max_iter=500, tol=10**-5, \
-        full_output=0, sl=None, verbose=False, R=None):
+        full_output=0, sl=None, verbose=False, R=None, Zinv=None, MR=None, recycle=0):
 
     """
     Relaxed Averaged Alternating Reflections.
@@ -355,7 +413,7 @@ def raar(Kb, A, sb, lam, M, beta, B=None, max_iter=500, tol=10**-5, \
     ============================================================================
     Args:
           Kb:     Covariance matrix (in data space).
-           A:     Forward projector/blurrer.
+           A:     Forward projector/blurrer (dense, sparse or LinearOperator).
           sb:     Signal in data space.
          lam:     Regularization strength.
            M:     Mask matrix.
@@ -367,23 +425,21 @@ def raar(Kb, A, sb, lam, M, beta, B=None, max_iter=500, tol=10**-5, \
           sl:     step length, default is 2 (i.e., reflection)
 
         full_output: TODO - for plotting intermediate info...
+        Zinv:     Fast Z^-1 (util.spectral_Z_solver); if given and exact, the
+                    constraint is enforced by exact projection
+                    (ConstraintProjector).
+          MR:     M R (util.direct_mrxn), used instead of R for the
+                    Hotelling residuals of full_output.
+     recycle:     if > 0, the minimization systems are solved by deflated
+                    CG recycling this many approximate eigenvectors across
+                    iterations (optimize.DeflatedCGSolver).
 
     Returns:
         Optimal u.
     """
     t0 = time.time()
     n = A.shape[1]
-
-    if sps.issparse(A):
-        iden = sps.eye
-        assert sps.issparse(M)
-    else:
-        iden = np.identity
-        assert not sps.issparse(M)
-
-    # B default: identity
-    if B is None:
-        B = iden(n)
+    min_A, constr_A, B = _system_matrices(Kb, A, lam, M, B=B)
 
     # sl default: reflection
     if sl is None:
@@ -396,14 +452,18 @@ def raar(Kb, A, sb, lam, M, beta, B=None, max_iter=500, tol=10**-5, \
     # Set up solver for minimization term (P1)
     # A.T Kb A u = A.T sb
     min_solver = optimize.ConjugateGradientsSolver(
-        A=A.T.dot(Kb.dot(A)), b=A.T.dot(sb), full_output=0
+        A=min_A, b=A.T.dot(sb), full_output=0
     )
+    if recycle:
+        min_solver = optimize.DeflatedCGSolver(A=min_solver.A, b=min_solver.b, \
+                                               full_output=0, n_recycle=recycle)
 
     # Set up solver for constraint term [2] (P2)
     constr_solver = optimize.ConjugateGradientsSolver(
-        A=(iden(n) - M.T.dot(M)).dot(A.T.dot(A) + lam * B.T.dot(B)), \
-        b=np.zeros(n), full_output=0
+        A=constr_A, b=np.zeros(n), full_output=0
     )
+    if Zinv is not None and Zinv.exact:
+        constr_solver = ConstraintProjector(constr_solver.A, Zinv, M)
 
     start_time = time.time()
     times = []
@@ -413,8 +473,8 @@ def raar(Kb, A, sb, lam, M, beta, B=None, max_iter=500, tol=10**-5, \
     us.append(u)
 
     if full_output:
-        if R is None:
-            print 'full_output requires R'
+        if R is None and MR is None:
+            print 'full_output requires R or MR'
             sys.exit(0)
 
         hot_resids = []
@@ -488,11 +548,10 @@ def raar(Kb, A, sb, lam, M, beta, B=None, max_iter=500, tol=10**-5, \
 
     ## check eq outside of timed loop
     if full_output:
+        Kx, sx = util.hotelling_system(Kb=Kb, M=M, sb=sb, R=R, MR=MR)
         for uu in us:
             w = util.calc_hot(X=A, B=B, lam=lam, M=M, u=uu)
-            hot_resids.append(
-                la.norm(M.dot(R).dot(Kb).dot(R.T).dot(M.T).dot(w) - M.dot(R).dot(sb))
-                )
+            hot_resids.append(la.norm(Kx.dot(w) - sx))
 
     # print('============================================')
     # print('FINAL min err: %.2f' % min_resid)
@@ -520,44 +579,51 @@ def test_proj_alg(prob=None, method=None, plot=True, **kwargs):
     sl_raar = kwargs.setdefault('sl_raar', 2)
     tol = kwargs.setdefault('tol', 1e-5)
     max_iter = kwargs.setdefault('max_iter', int(500))
+    Zinv = kwargs.setdefault('Zinv', getattr(prob, 'Zinv', None))
+    recycle = kwargs.setdefault('recycle', 0)
 
     ## rename
     B, lam, k, X, Kb = prob.B, prob.lam, prob.k, prob.X, prob.Kb
-    M, R_direct, sb, w_direct = prob.M, prob.R_direct, prob.sb, prob.w_direct
-    minres_A, minres_b = prob.ESI_A, prob.ESI_b
-    cg_A, cg_b = prob.ESIN_A, prob.ESIN_b
-    minres3_A, minres3_b = prob.ESI3_A, prob.ESI3_b
+    M, MR_direct, sb, w_direct = prob.M, prob.MR_direct, prob.sb, prob.w_direct
+    Kx, sx = util.hotelling_system(Kb=Kb, sb=sb, MR=MR_direct)
+    ## only touch the systems `method` uses (Problem builds them lazily)
+    if method in ('minres', 'all'):
+        minres_A, minres_b = prob.ESI_A, prob.ESI_b
+    if method in ('cg', 'all'):
+        cg_A, cg_b = prob.ESIN_A, prob.ESIN_b
+    if method == 'minres3':
+        minres3_A, minres3_b = prob.ESI3_A, prob.ESI3_b
     n = X.shape[1]
+    hot_err = lambda uu, ESI=False: util.calc_hot(X=X, B=B, lam=lam, M=M, u=uu, ESI=ESI) - w_direct
 
     ## compute resids and errs
     if method == 'raar':
         ## compute resids
         u, min_resids, con_resids, times, us, hot_resids, tt = raar(
             Kb, X, sb, lam, M, beta, B=B, max_iter=max_iter, tol=tol, full_output=1, \
-            sl=sl_raar, R=R_direct
+            sl=sl_raar, MR=MR_direct, Zinv=Zinv, recycle=recycle
         )
-        ## compute hot errs
-        Z = X.T.dot(X) + lam*B.T.dot(B)
-        hot_errs = [la.norm(M.dot(Z).dot(uu)-w_direct) for uu in us]
+        ## compute hot errs (M Z u - w_direct)
+        hot_errs = [la.norm(hot_err(uu)) for uu in us]
 
     elif method == 'dr':
         ## compute resids
         u, min_resids, con_resids, _, times, us, hot_resids, tt = dr(
-            Kb, X, sb, lam, M, B=B, max_iter=max_iter, tol=tol, full_output=1, sl=sl_dr, R=R_direct
+            Kb, X, sb, lam, M, B=B, max_iter=max_iter, tol=tol, full_output=1, sl=sl_dr, MR=MR_direct, \
+            Zinv=Zinv, recycle=recycle
         )
-        ## compute hot errs
-        Z = X.T.dot(X) + lam*B.T.dot(B)
-        hot_errs = [la.norm(M.dot(Z).dot(uu)-w_direct) for uu in us]
+        ## compute hot errs (M Z u - w_direct)
+        hot_errs = [la.norm(hot_err(uu)) for uu in us]
 
     elif method == 'pocs':
         ## compute resids
         u, min_resids, con_resids, times, us, hot_resids, tt = pocs(
-            Kb, X, sb, lam, M, B=B, max_iter=max_iter, tol=tol, full_output=1, R=R_direct
+            Kb, X, sb, lam, M, B=B, max_iter=max_iter, tol=tol, full_output=1, MR=MR_direct, \
+            Zinv=Zinv, recycle=recycle
         )
 
-        ## compute hot errs
-        Z = X.T.dot(X) + lam*B.T.dot(B)
-        hot_errs = [la.norm(M.dot(Z).dot(uu)-w_direct) for uu in us]
+        ## compute hot errs (M Z u - w_direct)
+        hot_errs = [la.norm(hot_err(uu)) for uu in us]
 
     elif method == 'minres':
         ## compute residuals
@@ -570,12 +636,11 @@ def test_proj_alg(prob=None, method=None, plot=True, **kwargs):
         for uu in us:
             w = util.calc_hot(X=X, B=B, lam=lam, M=M, u=uu, ESI=True)
             hot_resids.append(
-                la.norm(M.dot(R_direct).dot(Kb).dot(R_direct.T).dot(M.T).dot(w) - M.dot(R_direct).dot(sb))
+                la.norm(Kx.dot(w) - sx)
                 )
 
-        ## compute hot errs
-        Z = X.T.dot(X) + lam*B.T.dot(B)
-        hot_errs = [la.norm(M.dot(Z).dot(uu[0:n])-w_direct) for uu in us]
+        ## compute hot errs (M Z u - w_direct)
+        hot_errs = [la.norm(hot_err(uu, ESI=True)) for uu in us]
 
     elif method == 'cg':
         ## compute resids
@@ -590,12 +655,11 @@ def test_proj_alg(prob=None, method=None, plot=True, **kwargs):
         for uu in us:
             w = util.calc_hot(X=X, B=B, lam=lam, M=M, u=uu, ESI=True)
             hot_resids.append(
-                la.norm(M.dot(R_direct).dot(Kb).dot(R_direct.T).dot(M.T).dot(w) - M.dot(R_direct).dot(sb))
+                la.norm(Kx.dot(w) - sx)
                 )
 
-        ## compute hot errs
-        Z = X.T.dot(X) + lam*B.T.dot(B)
-        hot_errs = [la.norm(M.dot(Z).dot(uu[0:n])-w_direct) for uu in us]
+        ## compute hot errs (M Z u - w_direct)
+        hot_errs = [la.norm(hot_err(uu, ESI=True)) for uu in us]
 
     elif method == 'minres3':
         ## compute resids
@@ -607,26 +671,25 @@ def test_proj_alg(prob=None, method=None, plot=True, **kwargs):
         for uu in us:
             w = util.calc_hot(X=X, B=B, lam=lam, M=M, u=uu, ESI=True)
             hot_resids.append(
-                la.norm(M.dot(R_direct).dot(Kb).dot(R_direct.T).dot(M.T).dot(w) - M.dot(R_direct).dot(sb))
+                la.norm(Kx.dot(w) - sx)
                 )
 
-        ## compute hot errs
-        Z = X.T.dot(X) + lam*B.T.dot(B)
-        hot_errs = [la.norm(M.dot(Z).dot(uu[0:n])-w_direct) for uu in us]
+        ## compute hot errs (M Z u - w_direct)
+        hot_errs = [la.norm(hot_err(uu, ESI=True)) for uu in us]
 
     elif method == 'all':
         ## compute resids
         u_r, min_resids_r, con_resids_r, times_r, us_r, hot_resids_r, tt_r = raar(
             Kb, X, sb, lam, M, beta, B=B, max_iter=max_iter,\
-            tol=tol, full_output=1, sl=sl_raar, R=R_direct
+            tol=tol, full_output=1, sl=sl_raar, MR=MR_direct, Zinv=Zinv, recycle=recycle
         )
         u_d, min_resids_d, con_resids_d, _, times_d, us_d, hot_resids_d, tt_d = dr(
             Kb, X, sb, lam, M, B=B, max_iter=max_iter, \
-                    tol=tol, full_output=1, sl=sl_dr, R=R_direct
+                    tol=tol, full_output=1, sl=sl_dr, MR=MR_direct, Zinv=Zinv, recycle=recycle
         )
         u_p, min_resids_p, con_resids_p, times_p, us_p, hot_resids_p, tt_p = pocs(
             Kb, X, sb, lam, M, B=B, max_iter=max_iter, \
-                    tol=tol, full_output=1, R=R_direct
+                    tol=tol, full_output=1, MR=MR_direct, Zinv=Zinv, recycle=recycle
         )
         u_m, _, us_m, min_resids_m, times_m, tt_m = spsla.minres_track(A=minres_A, \
                 b=minres_b, tol=tol, maxiter=max_iter)
@@ -636,7 +699,7 @@ def test_proj_alg(prob=None, method=None, plot=True, **kwargs):
         for uu in us_m:
             w = util.calc_hot(X=X, B=B, lam=lam, M=M, u=uu, ESI=True)
             hot_resids_m.append(
-                la.norm(M.dot(R_direct).dot(Kb).dot(R_direct.T).dot(M.T).dot(w) - M.dot(R_direct).dot(sb))
+                la.norm(Kx.dot(w) - sx)
                 )
 
         cgs = optimize.ConjugateGradientsSolver(A=cg_A, b=cg_b, full_output=1)
@@ -650,7 +713,7 @@ def test_proj_alg(prob=None, method=None, plot=True, **kwargs):
         for uu in us_c:
             w = util.calc_hot(X=X, B=B, lam=lam, M=M, u=uu, ESI=True)
             hot_resids_c.append(
-                la.norm(M.dot(R_direct).dot(Kb).dot(R_direct.T).dot(M.T).dot(w) - M.dot(R_direct).dot(sb))
+                la.norm(Kx.dot(w) - sx)
                 )
 
         u_3, _, us_3, min_resids_3, times_3, tt_3 = spsla.minres_track(A=minres_A, \
@@ -661,17 +724,16 @@ def test_proj_alg(prob=None, method=None, plot=True, **kwargs):
         for uu in us_m:
             w = util.calc_hot(X=X, B=B, lam=lam, M=M, u=uu, ESI=True)
             hot_resids_3.append(
-                la.norm(M.dot(R_direct).dot(Kb).dot(R_direct.T).dot(M.T).dot(w) - M.dot(R_direct).dot(sb))
+                la.norm(Kx.dot(w) - sx)
                 )
 
-        ## compute hot errs
-        Z = X.T.dot(X) + lam*B.T.dot(B)
-        hot_errs_r = [la.norm(w_direct - M.dot(Z).dot(uu)) for uu in us_r]
-        hot_errs_d = [la.norm(w_direct - M.dot(Z).dot(uu)) for uu in us_d]
-        hot_errs_p = [la.norm(w_direct - M.dot(Z).dot(uu)) for uu in us_p]
-        hot_errs_m = [la.norm(w_direct - M.dot(Z).dot(uu[0:n])) for uu in us_m]
-        hot_errs_c = [la.norm(w_direct - M.dot(Z).dot(uu[0:n])) for uu in us_c]
-        hot_errs_3 = [la.norm(w_direct - M.dot(Z).dot(uu[0:n])) for uu in us_3]
+        ## compute hot errs (M Z u - w_direct)
+        hot_errs_r = [la.norm(hot_err(uu)) for uu in us_r]
+        hot_errs_d = [la.norm(hot_err(uu)) for uu in us_d]
+        hot_errs_p = [la.norm(hot_err(uu)) for uu in us_p]
+        hot_errs_m = [la.norm(hot_err(uu, ESI=True)) for uu in us_m]
+        hot_errs_c = [la.norm(hot_err(uu, ESI=True)) for uu in us_c]
+        hot_errs_3 = [la.norm(hot_err(uu, ESI=True)) for uu in us_3]
 
         min_resids_all = [
             min_resids_r, min_resids_d, min_resids_p, min_resids_m, min_resids_c, min_resids_3
@@ -1041,7 +1103,7 @@ def test_proj_alg(prob=None, method=None, plot=True, **kwargs):
 #
 #         ## compute errors
 #         R_direct = util.direct_rxn(X=X, lam=lam)
-#         w_direct, Kx, sx = util.direct_solve(Kb=Kb, R=R_direct, M=M, sb=sb)
+#         w_direct, Kx, sx = util.direct_solve(Kb=Kb, MR=MR_direct, M=M, sb=sb)
 #
 #         Z = X.T.dot(X) + lam*B.T.dot(B)
 #         raar_errs = [la.norm(M.dot(Z).dot(u)-w_direct) for u in raars]
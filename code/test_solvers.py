@@ -1,9 +1,11 @@
 import numpy as np
 import numpy.linalg as la
 import matplotlib.pyplot as plt
-import sys, os
+import sys, os, tempfile, shutil
 import time, datetime
-import util, optimize
+import scipy.sparse as sps
+import util, optimize, hotelling, problems
+from tomo2D import drt
 from scipy import optimize as scopt
 from scipy.sparse import linalg as scla
 from collections import OrderedDict
@@ -687,6 +689,680 @@ def load_IR_data():
         c_arrs.append(ar)
 
     return b_arrs, c_arrs
+
+# Test Fourier/DCT Z-solver against a sparse LU of Z
+def test_spectral_Z(n_1=16, n_2=16, lam=10**-2, sigma=3, t=10, n_rhs=3):
+    """
+    Test util.spectral_Z_solver(...) against splu of Z = X^T X + lam I for
+    periodic (FFT) and reflective (DCT) blur, with the structure declared
+    and detected. Prints the largest relative error of Z^{-1} V.
+    """
+    n = n_1*n_2
+    V = np.random.randn(n, n_rhs)
+    for boundary in ['periodic', 'reflect']:
+        _, X, _ = util.gen_instance_2d_blur(m=n, n_1=n_1, n_2=n_2, ri=n_1//2, k=3, K_diag=np.ones(n), \
+                                            sigma=sigma, t=t, sparse=True, boundary=boundary)
+        Z = X.T.dot(X) + lam*sps.eye(n)
+        ZiV = scla.splu(sps.csc_matrix(Z)).solve(V)
+        for declared in [boundary, None]:
+            Zinv = util.spectral_Z_solver(X=X, lam=lam, B=None, n_1=n_1, n_2=n_2, boundary=declared)
+            err = la.norm(Zinv.matmat(V) - ZiV) / la.norm(ZiV)
+            print('%-8s (boundary=%s): relative error %.2e' % (boundary, declared, err))
+
+# Test vectorized Siddon against the ray-by-ray version
+def test_siddon(n_1=16, n_2=20, m=24, n_random=40):
+    """
+    Test drt.siddon_triplets(...) against drt.siddon_algorithm(...) on the
+    central rays of drt.gen_eep and on random rays between two sides of the
+    grid (siddon_algorithm needs end points on the boundary). Prints the
+    largest difference of a row of X.
+    """
+    x_grid, y_grid = drt.gen_grids(n_1, n_2)
+    x1, y1, x2, y2 = drt.gen_rays(x_grid, y_grid, m=m)
+
+    ## random points on the left/right and bottom/top sides
+    u = np.random.uniform(0, 1, (2, n_random))
+    xs = x_grid[0] + u*(x_grid[-1] - x_grid[0])
+    ys = y_grid[0] + u*(y_grid[-1] - y_grid[0])
+    x1 = np.concatenate([x1, x_grid[0]*np.ones(n_random), xs[0]])
+    y1 = np.concatenate([y1, ys[0], y_grid[0]*np.ones(n_random)])
+    x2 = np.concatenate([x2, x_grid[-1]*np.ones(n_random), xs[1]])
+    y2 = np.concatenate([y2, ys[1], y_grid[-1]*np.ones(n_random)])
+
+    rows, cols, lens = drt.siddon_triplets(x1, y1, x2, y2, x_grid, y_grid, batch=16)
+    X = sps.csr_matrix((lens, (rows, cols)), shape=(x1.size, n_1*n_2)).toarray()
+    err = 0.0
+    for i in range(x1.size):
+        X_i = drt.siddon_algorithm(x1[i], y1[i], x2[i], y2[i], x_grid, y_grid)
+        err = max(err, np.abs(X[i] - X_i).max())
+    print('%d rays: max |siddon_triplets - siddon_algorithm| = %.2e' % (x1.size, err))
+
+# Test the sliding-window Hotelling sweep against one template per window
+def test_sweep(n_1=12, n_2=14, lam=10**-2, sigma=3, t=10, h=2, k=3, step=2):
+    """
+    Test hotelling.HotellingEngine.sweep(...), which updates Kx and sx
+    incrementally between windows, against HotellingEngine.template(...)
+    for every window on a fresh engine. Prints the largest relative
+    differences of the templates and SNRs.
+    """
+    n = n_1*n_2
+    Kb, X, _ = util.gen_instance_2d_blur(m=n, n_1=n_1, n_2=n_2, ri=n_1//2, k=3, \
+                                         K_diag=np.random.uniform(1, 2, n), \
+                                         sigma=sigma, t=t, sparse=True, boundary='zero')
+    sb = X.dot(np.random.randn(n))
+    kw = dict(X=X, Kb=Kb, lam=lam, sb=sb, n_1=n_1, n_2=n_2)
+    positions, snrs, ws = hotelling.HotellingEngine(**kw).sweep(k, h=h, step=step)
+
+    engine = hotelling.HotellingEngine(**kw)
+    w_err, snr_err = 0.0, 0.0
+    for (i0, j0), snr, w in zip(positions, snrs, ws):
+        w_q, snr_q, _, _ = engine.template(dict(rect=(i0, i0+h, j0, j0+k)))
+        w_err = max(w_err, la.norm(w - w_q) / la.norm(w_q))
+        snr_err = max(snr_err, abs(snr - snr_q) / snr_q)
+    print('%d windows: relative error of templates %.2e, SNRs %.2e' % (len(snrs), w_err, snr_err))
+
+# Test updated Z factorizations against refactoring from scratch
+def test_zfactor(n_1=10, n_2=10, lam=10**-2, n_det=12, n_rhs=3):
+    """
+    Test util.ZFactor(...) as x-ray angles are added and removed: the
+    Woodbury update (with and without automatic refactoring), its explicit
+    refactor() and the Cholesky up/downdate, against a direct solve with
+    Z = X^T X + lam I for the final rays. Prints the relative errors.
+    """
+    thetas = np.linspace(0, np.pi, 9)[:8]
+    rays = lambda th: drt.gen_X(n_1, n_2, sp_rep=True, geometry=drt.ParallelBeam(None, n_det=n_det, thetas=th))
+    X0, X_add, X_rem = rays(thetas[:4]), rays(thetas[4:]), rays(thetas[:2])
+    X = rays(thetas[2:])
+    n = n_1*n_2
+    V = np.random.randn(n, n_rhs)
+    ZiV = la.solve((X.T.dot(X) + lam*sps.eye(n)).toarray(), V)
+
+    variants = [('woodbury', dict(method='woodbury', max_rank=None)), \
+                ('woodbury, max_rank', dict(method='woodbury', max_rank=2*n_det)), \
+                ('woodbury, refactor()', dict(method='woodbury', max_rank=None)), \
+                ('cholesky', dict(method='cholesky'))]
+    for name, kw in variants:
+        F = util.ZFactor(X=X0, lam=lam, sparse=True, **kw)
+        F.add_rays(X_add)
+        F.remove_rays(X_rem)
+        if name.endswith('refactor()'):
+            F.refactor()
+        print('%-22s relative error %.2e' % (name + ':', la.norm(F.solve(V) - ZiV) / la.norm(ZiV)))
+
+# Test deflated CG against CG on a sequence of right-hand sides
+def test_deflated_cg(n=300, n_small=8, n_solves=4, tol=10**-8):
+    """
+    Test optimize.DeflatedCGSolver(...) against ConjugateGradientsSolver(...)
+    on repeated solves with one SPD matrix with `n_small` outlying small
+    eigenvalues: both should reach the same x, and the deflated solver
+    should need fewer iterations once its RecycleSpace holds the
+    corresponding eigenvectors.
+    """
+    Q, _ = la.qr(np.random.randn(n, n))
+    eigs = np.concatenate([np.logspace(-5, -3, n_small), np.linspace(0.1, 1, n-n_small)])
+    A = (Q * eigs).dot(Q.T)
+    space = optimize.RecycleSpace(n_small)
+    for s in range(n_solves):
+        b = np.random.randn(n)
+        x_cg, i_cg, _ = optimize.ConjugateGradientsSolver(A=A, b=b, full_output=True).solve(tol=tol, max_iter=5*n)
+        x_d, i_d, _ = optimize.DeflatedCGSolver(A=A, b=b, full_output=True, space=space).solve(tol=tol, max_iter=5*n)
+        err = la.norm(x_d - x_cg) / la.norm(x_cg)
+        print('solve %d: CG %d iterations, deflated CG %d, relative difference %.2e' % (s, i_cg, i_d, err))
+
+# Test the randomized TSVD / Tikhonov solver against the exact SVD
+def test_tsvd(m=60, n=40, k=10, lam=10**-1):
+    """
+    Test optimize.TSVDSolver(...) with a full-rank factorization: the default
+    parameter against la.lstsq for both filters, the rank-k truncation and
+    Tikhonov with `lam` against the exact SVD. Prints the relative errors.
+    """
+    A = np.random.randn(m, n)
+    b = np.random.randn(m)
+    U, s, Vt = la.svd(A, full_matrices=False)
+    c = U.T.dot(b)
+    x_ls = la.lstsq(A, b, rcond=-1)[0]
+    x_k = Vt[:k].T.dot(c[:k] / s[:k])
+    x_lam = Vt.T.dot(s / (s**2 + lam) * c)
+
+    rel = lambda x, y: la.norm(x - y) / la.norm(y)
+    solver = optimize.TSVDSolver(A=A, b=b, rank=n, seed=0)
+    print('tikhonov, default param:   relative error %.2e' % rel(solver.solve(filter='tikhonov'), x_ls))
+    print('truncation, default param: relative error %.2e' % rel(solver.solve(filter='truncation'), x_ls))
+    print('truncation, param=%d:      relative error %.2e' % (k, rel(solver.solve(filter='truncation', param=k), x_k)))
+    print('tikhonov, param=%.0e:   relative error %.2e' % (lam, rel(solver.solve(filter='tikhonov', param=lam), x_lam)))
+
+# Test the Lanczos norm and eigenvalue estimates against exact values
+def test_lanczos_estimates(n=200, cond_num=10**3, tol=10**-3):
+    """
+    Test optimize.lanczos_extremes(...), norm_estimate(...) and
+    cond_estimate(...) against la.eigvalsh, la.norm(A, 2) and la.cond on an
+    SPD, a symmetric indefinite and a rectangular matrix, and check that the
+    estimates leave the global np.random state alone. Prints the relative
+    errors.
+    """
+    Q, _ = la.qr(np.random.randn(n, n))
+    lams = np.logspace(0, np.log10(cond_num), n)
+    A = (Q * lams).dot(Q.T)
+    S = (Q * np.linspace(-2, 1, n)).dot(Q.T)
+    C = np.random.randn(n + 50, n)
+
+    state = np.random.get_state()
+    lo, hi, it = optimize.lanczos_extremes(A, tol=tol, max_iter=n, which='both')
+    ev = la.eigvalsh(A)
+    print('lanczos_extremes (%d steps): relative errors %.2e, %.2e' % \
+          (it, abs(lo - ev[0]) / ev[0], abs(hi - ev[-1]) / ev[-1]))
+    for name, B, D in [('SPD', A, A), ('symmetric', S, S), ('rectangular', C, C), \
+                       ('sparse', sps.csr_matrix(S), S), ('LinearOperator', scla.aslinearoperator(C), C)]:
+        nrm = la.norm(D, 2)
+        print('norm_estimate, %-15s relative error %.2e' % (name + ':', abs(optimize.norm_estimate(B, tol=tol) - nrm) / nrm))
+    c = la.cond(A)
+    print('cond_estimate:                 relative error %.2e' % (abs(optimize.cond_estimate(A, tol=tol, max_iter=n) - c) / c))
+    print('global random state unchanged: %s' % np.all(np.random.get_state()[1] == state[1]))
+
+# Test the HOTomoMats loader and its size checks
+def test_hotomo(density=0.01):
+    """
+    Test problems.hotomo_problem(...) with a random system matrix (Amat.npy
+    is not shipped): the Problem gets the 35 x 70 image of the data set, and
+    an X or image size that does not match the data raises a ValueError.
+    """
+    X = sps.random(1050, 2450, density=density, format='csr')
+    p = problems.hotomo_problem(X=X, headless=True)
+    print('(n_1, n_2, m, k) = (%d, %d, %d, %d)' % (p.n_1, p.n_2, p.m, p.k))
+    for name, kw in [('n_1=30', dict(X=X, n_1=30)), ('X with 2400 columns', dict(X=X[:, :2400])), \
+                     ('X with 1000 rows', dict(X=X[:1000]))]:
+        try:
+            problems.hotomo_problem(headless=True, **kw)
+            print('%s: no error' % name)
+        except ValueError as e:
+            print('%s: ValueError (%s)' % (name, e))
+
+# Test the matrix-free Hotelling figures of merit against an explicit Kx
+def test_kx_estimates(n_1=12, n_2=12, lam=10**-2, sigma=3, t=10, k=20, tol=5*10**-2):
+    """
+    Test hotelling.stochastic_diag(...), hutchpp_trace(...) and
+    detectability(...) on a KxOperator against diag(Kx), trace(Kx) and
+    sqrt(sx^T Kx^{-1} sx) from the explicit Kx. For stochastic_diag, 5
+    pixels are moved outside the support (zero diagonal, rounding-level
+    coupling), which must not keep it from stopping before max_probes.
+    Prints the errors.
+    """
+    n = n_1*n_2
+    Kb, X, _ = util.gen_instance_2d_blur(m=n, n_1=n_1, n_2=n_2, ri=n_1//2, k=3, K_diag=np.ones(n), \
+                                         sigma=sigma, t=t, sparse=True, boundary='zero')
+    M = util.gen_M(n_1=n, idx=np.sort(np.random.choice(n, k, replace=False)))
+    zsolve = util.z_solver(X=X, lam=lam, sparse=True)
+    Kx_op = hotelling.KxOperator(X, Kb, M, zsolve)
+    Kx = Kx_op.matmat(np.eye(k))
+    sx = M.dot(zsolve(X.T.dot(np.random.randn(n))))
+
+    ## 5 pixels outside the support: zero diagonal, rounding-level coupling
+    out = np.arange(k-5, k)
+    A = Kx.copy()
+    A[out, :], A[:, out] = 0.0, 0.0
+    E = np.zeros((k, k))
+    E[out, :k-5] = 10**-14 * np.abs(Kx).max() * np.random.randn(5, k-5)
+    A += E + E.T
+    d, err, n_mv = hotelling.stochastic_diag(A, tol=tol, max_probes=4096, seed=0)
+    print('stochastic_diag: %d probes, max |d - diag| / ||diag||_inf = %.2e' % \
+          (n_mv, np.abs(d - np.diag(A)).max() / np.abs(np.diag(A)).max()))
+    tr, tr_err = hotelling.hutchpp_trace(Kx_op, n_matvecs=12, tol=tol, seed=0)
+    print('hutchpp_trace: relative error %.2e, |t - trace| / err = %.2f' % \
+          (abs(tr - np.trace(Kx)) / np.trace(Kx), abs(tr - np.trace(Kx)) / tr_err))
+    snr_true = np.sqrt(sx.dot(la.solve(Kx, sx)))
+    snr, (lo, up), it = hotelling.detectability(Kx_op, sx, tol=10**-6)
+    print('detectability: %d iterations, relative error %.2e, SNR in [%.6g, %.6g] (exact %.6g)' % \
+          (it, abs(snr - snr_true) / snr_true, lo, up, snr_true))
+
+# Test the FFT blur operators against the explicit periodic X
+def test_fft_blur(n=30, n_1=12, n_2=16, sigma=3, t=10, n_rhs=4):
+    """
+    Test the FFT blur operators (op='fft' of util.gen_instance_1d_blur and
+    util.gen_instance_2d_blur) against the sparse periodic X: products
+    with vectors and with blocks of vectors, and their adjoints. Prints the
+    largest differences.
+    """
+    gen = {1: lambda op: util.gen_instance_1d_blur(m=n, n=n, k=3, K_diag=np.ones(n), sigma=sigma, t=t, \
+                                                   sparse=True, op=op)[1], \
+           2: lambda op: util.gen_instance_2d_blur(m=n_1*n_2, n_1=n_1, n_2=n_2, ri=n_1//2, k=3, \
+                                                   K_diag=np.ones(n_1*n_2), sigma=sigma, t=t, \
+                                                   sparse=True, op=op)[1]}
+    for dim, N in [(1, n), (2, n_1*n_2)]:
+        X, F = gen[dim]('sparse').toarray(), gen[dim]('fft')
+        V = np.random.randn(N, n_rhs)
+        errs = [np.abs(F.matvec(V[:, 0]) - X.dot(V[:, 0])).max(), np.abs(F.rmatvec(V[:, 0]) - X.T.dot(V[:, 0])).max(), \
+                np.abs(F.matmat(V) - X.dot(V)).max(), np.abs(F.H.matmat(V) - X.T.dot(V)).max()]
+        print('%dD: max error of X v %.2e, X^T v %.2e, X V %.2e, X^T V %.2e' % tuple([dim] + errs))
+
+# Test the on-disk matrix cache round trip
+def test_cache(n_1=12, n_2=12, lam=10**-2, sigma=3, t=10, k=4):
+    """
+    Test problems.Problem(...).create_problem(cache_dir=...): a second run
+    with the same parameters reloads Kb, X, M and the direct solution from
+    the cache (memory-mapped) unchanged, while K_diag=None draws a new Kb
+    per run instead of reusing the cached one.
+    """
+    n = n_1*n_2
+    cache_dir = tempfile.mkdtemp()
+    dense = lambda A: A.toarray() if sps.issparse(A) else np.asarray(A)
+    try:
+        runs = []
+        for _ in range(2):
+            p = problems.Problem(prob='b', n_1=n_1, n_2=n_2, k=k, lam=lam, dir_soln=True, headless=True)
+            p.create_problem(K_diag=np.ones(n), sigma=sigma, t=t, sparse=True, cache_dir=cache_dir)
+            runs.append(p)
+        p0, p1 = runs
+        err = max(np.abs(dense(getattr(p0, a)) - dense(getattr(p1, a))).max() for a in ('Kb', 'X', 'M', 'w_direct'))
+        print('reloaded from cache: %s, max difference %.2e' % (isinstance(p1.w_direct, np.memmap), err))
+
+        Kbs = []
+        for _ in range(2):
+            p = problems.Problem(prob='b', n_1=n_1, n_2=n_2, k=k, lam=lam, headless=True)
+            p.create_problem(K_diag=None, sigma=sigma, t=t, sparse=True, cache_dir=cache_dir)
+            Kbs.append(dense(p.Kb).diagonal())
+        print('K_diag=None: runs draw different Kb: %s' % (not np.allclose(Kbs[0], Kbs[1])))
+    finally:
+        shutil.rmtree(cache_dir)
+
+# Test the ROI descriptions
+def test_roi(n_1=16, n_2=20):
+    """
+    Test util.roi_indices: the row window matches gen_M_2d, and the rect,
+    disc and mask ROIs match the same regions marked on an explicit
+    (column-major) image; an ROI past the image edge raises ValueError.
+    """
+    I, J = np.meshgrid(np.arange(n_1), np.arange(n_2), indexing='ij')
+    img_idx = lambda inside: np.flatnonzero(inside.ravel(order='F'))
+    M = util.gen_M_2d(ri=[3, 8], k=6, n_1=n_1, n_2=n_2)
+    rows = util.roi_indices(n_1=n_1, n_2=n_2, ri=[3, 8], k=6)
+    print('rows match gen_M_2d: %s' % np.array_equal(rows, np.sort(M.indices)))
+    rect = util.roi_indices(n_1=n_1, n_2=n_2, rect=(2, 7, 4, 12))
+    ok_rect = np.array_equal(np.sort(rect), img_idx((I >= 2) & (I < 7) & (J >= 4) & (J < 12)))
+    disc = util.roi_indices(n_1=n_1, n_2=n_2, disc=(7.5, 9., 4.))
+    ok_disc = np.array_equal(np.sort(disc), img_idx((I-7.5)**2 + (J-9.)**2 <= 16.))
+    mask = np.random.rand(n_1, n_2) < 0.2
+    ok_mask = np.array_equal(util.roi_indices(n_1=n_1, n_2=n_2, mask=mask), img_idx(mask))
+    print('rect: %s, disc: %s, mask: %s' % (ok_rect, ok_disc, ok_mask))
+    try:
+        util.roi_indices(n_1=n_1, n_2=n_2, disc=(2., 9., 4.))
+        print('disc off the image edge: no error')
+    except ValueError as e:
+        print('disc off the image edge: ValueError (%s)' % e)
+
+# Test the 1d blur boundaries
+def test_banded(n=30, sigma=2, t=5):
+    """
+    Test blur_1d.banded_operator_1d for each boundary against a direct
+    convolution of the padded signal (np.pad modes `wrap`, `constant` and
+    `symmetric`), and the periodic operator against the row_k rows.
+    """
+    from tomo1D import blur_1d
+    template, template_inds = blur_1d.template_1d(sigma=sigma, t=t)
+    v = np.random.randn(n)
+    for boundary, mode in [('periodic', 'wrap'), ('zero', 'constant'), ('reflect', 'symmetric')]:
+        X = blur_1d.banded_operator_1d(n=n, template=template, template_inds=template_inds, boundary=boundary)
+        vp = np.pad(v, t, mode=mode)
+        Xv = np.array([sum(w*vp[i+j+t] for w, j in zip(template, template_inds)) for i in range(n)])
+        print('%s: max error of X v %.2e' % (boundary, np.abs(X.dot(v) - Xv).max()))
+    X = blur_1d.banded_operator_1d(n=n, template=template, template_inds=template_inds, sparse=False)
+    R = np.vstack([blur_1d.row_k(k=i, template=template, template_inds=template_inds, n=n, sparse=False) for i in range(n)])
+    print('periodic: max difference from row_k %.2e' % np.abs(X - R).max())
+
+# Test the matrix-free Kronecker blur
+def test_kron_blur(n_1=12, n_2=16, sigma=2, t=4, n_rhs=3):
+    """
+    Test gen_instance_2d_blur(op='kron') for each boundary against the
+    explicit sparse X, and X against a direct 2d convolution of the padded
+    (column-major) image with the separable template.
+    """
+    from tomo1D import blur_1d
+    template, template_inds = blur_1d.template_1d(sigma=sigma, t=t)
+    W = np.outer(template, template)
+    gen = lambda op, boundary: util.gen_instance_2d_blur(m=n_1*n_2, n_1=n_1, n_2=n_2, ri=n_1//2, k=3, \
+                                                         K_diag=np.ones(n_1*n_2), sigma=sigma, t=t, \
+                                                         sparse=True, boundary=boundary, op=op)[1]
+    V = np.random.randn(n_1*n_2, n_rhs)
+    for boundary, mode in [('periodic', 'wrap'), ('zero', 'constant'), ('reflect', 'symmetric')]:
+        X, K = gen('sparse', boundary).toarray(), gen('kron', boundary)
+        Fp = np.pad(V[:, 0].reshape(n_1, n_2, order='F'), t, mode=mode)
+        Y = np.array([[(W*Fp[i:i+2*t+1, j:j+2*t+1]).sum() for j in range(n_2)] for i in range(n_1)])
+        errs = [np.abs(X.dot(V[:, 0]) - Y.ravel(order='F')).max(), np.abs(K.matvec(V[:, 0]) - X.dot(V[:, 0])).max(), \
+                np.abs(K.rmatvec(V[:, 0]) - X.T.dot(V[:, 0])).max(), np.abs(K.matmat(V) - X.dot(V)).max()]
+        print('%s: max error of X v %.2e, kron X v %.2e, X^T v %.2e, X V %.2e' % tuple([boundary] + errs))
+
+# Test the parallel ray tracing
+def test_trace_rays(n_1=16, n_2=20, m=200, n_jobs=2):
+    """
+    Test drt.trace_rays(..., n_jobs) and drt.gen_X(..., n_jobs): the rays
+    are traced in a process pool (small batches, so several chunks) and the
+    triplets and X must be identical to the serial build.
+    """
+    x_grid, y_grid = drt.gen_grids(n_1, n_2)
+    x1, y1, x2, y2 = drt.gen_rays(x_grid, y_grid, m=m)
+    serial = drt.siddon_triplets(x1, y1, x2, y2, x_grid, y_grid, batch=16)
+    pooled = drt.trace_rays(x1, y1, x2, y2, x_grid, y_grid, batch=16, n_jobs=n_jobs)
+    same = all(np.array_equal(a, b) for a, b in zip(serial, pooled))
+    print('%d rays on %d workers: triplets identical to serial: %s' % (m, n_jobs, same))
+    X = drt.gen_X(n_1, n_2, m=m, sp_rep=True, batch=16)
+    X_p = drt.gen_X(n_1, n_2, m=m, sp_rep=True, batch=16, n_jobs=n_jobs)
+    print('gen_X: max |X(n_jobs=%d) - X| = %.2e' % (n_jobs, abs(X_p - X).max()))
+
+# Test the matrix-free x-ray projector
+def test_xray_operator(n_1=16, n_2=20, m=60, n_rhs=3):
+    """
+    Test drt.XrayOperator against the explicit X of drt.gen_X: X v, X^T w
+    and X V, retracing every product (cache_nnz=0) and with the traced
+    batches cached (each product run twice, the second from the cache).
+    """
+    X = drt.gen_X(n_1, n_2, m=m, sp_rep=True).toarray()
+    V, w = np.random.randn(n_1*n_2, n_rhs), np.random.randn(m)
+    for cache_nnz in [0, X.size]:
+        A = drt.XrayOperator(n_1, n_2, m=m, batch=16, cache_nnz=cache_nnz)
+        errs = np.zeros(3)
+        for _ in range(2):
+            errs = np.maximum(errs, [np.abs(A.matvec(V[:, 0]) - X.dot(V[:, 0])).max(), \
+                                     np.abs(A.rmatvec(w) - X.T.dot(w)).max(), np.abs(A.matmat(V) - X.dot(V)).max()])
+        print('cache_nnz=%d (%d batches cached): max error of X v %.2e, X^T w %.2e, X V %.2e' \
+              % tuple([cache_nnz, len(A._cache)] + list(errs)))
+
+# Test the scanner geometries
+def test_geometry(n_1=16, n_2=20, n_angles=18, n_det=9):
+    """
+    Test drt.ParallelBeam and drt.FanBeam in gen_X: n_det=1 parallel rays
+    reproduce the central rays of gen_eep, X has one row per ray, and each
+    row of X sums to the length of its ray clipped to the image rectangle.
+    A fan-beam source inside the image raises ValueError.
+    """
+    x_grid, y_grid = drt.gen_grids(n_1, n_2)
+    lo, hi = np.array([x_grid[0], y_grid[0]]), np.array([x_grid[-1], y_grid[-1]])
+
+    def chord(x1, y1, x2, y2):
+        ## clip p1 + a (p2 - p1), 0 <= a <= 1, to the image (slab method)
+        p, d = np.array([x1, y1]), np.array([x2 - x1, y2 - y1])
+        a0, a1 = 0.0, 1.0
+        for ax in range(2):
+            if d[ax] == 0:
+                if not lo[ax] <= p[ax] <= hi[ax]:
+                    return 0.0
+                continue
+            t0, t1 = sorted([(lo[ax] - p[ax])/d[ax], (hi[ax] - p[ax])/d[ax]])
+            a0, a1 = max(a0, t0), min(a1, t1)
+        return max(a1 - a0, 0.0)*la.norm(d)
+
+    X = drt.gen_X(n_1, n_2, m=n_angles, sp_rep=True)
+    X_1 = drt.gen_X(n_1, n_2, sp_rep=True, geometry=drt.ParallelBeam(n_angles))
+    print('ParallelBeam(n_det=1): max difference from gen_X(m) %.2e' % abs(X_1 - X).max())
+    for geom in [drt.ParallelBeam(n_angles, n_det=n_det, spacing=1.7), drt.FanBeam(n_angles, n_det, src_radius=30.)]:
+        X = drt.gen_X(n_1, n_2, sp_rep=True, geometry=geom)
+        rays = np.array(drt.gen_rays(x_grid, y_grid, geometry=geom)).T
+        err = np.abs(np.asarray(X.sum(axis=1)).ravel() - [chord(*r) for r in rays]).max()
+        print('%s: %d x %d, max error of the row sums %.2e' % (geom.__class__.__name__, X.shape[0], X.shape[1], err))
+    try:
+        drt.gen_X(n_1, n_2, sp_rep=True, geometry=drt.FanBeam(n_angles, n_det, src_radius=10.))
+        print('source inside the image: no error')
+    except ValueError as e:
+        print('source inside the image: ValueError (%s)' % e)
+
+# Test the symmetry-compressed x-ray projector
+def test_symmetric_xray(n_rhs=3):
+    """
+    Test drt.SymmetricXrayOperator against the serial gen_X: X v, X^T w,
+    X V, X^T W and tocsr() on a rectangular and a square grid, for the
+    default rays and a fan beam. Prints the stored rows of X0 vs m.
+    """
+    cases = [(16, 20, dict(m=60)), (16, 16, dict(m=64)), \
+             (16, 16, dict(geometry=drt.FanBeam(n_angles=16, n_det=11, src_radius=30.)))]
+    for n_1, n_2, kw in cases:
+        X = drt.gen_X(n_1, n_2, sp_rep=True, **kw).toarray()
+        A = drt.SymmetricXrayOperator(n_1, n_2, batch=16, **kw)
+        V, W = np.random.randn(n_1*n_2, n_rhs), np.random.randn(X.shape[0], n_rhs)
+        errs = [np.abs(A.matvec(V[:, 0]) - X.dot(V[:, 0])).max(), np.abs(A.rmatvec(W[:, 0]) - X.T.dot(W[:, 0])).max(), \
+                np.abs(A.matmat(V) - X.dot(V)).max(), np.abs(A.H.matmat(W) - X.T.dot(W)).max(), \
+                np.abs(A.tocsr().toarray() - X).max()]
+        print('%d x %d, %d rays (%d stored): max error of X v %.2e, X^T w %.2e, X V %.2e, X^T W %.2e, tocsr %.2e' \
+              % tuple([n_1, n_2, X.shape[0], A.X0.shape[0]] + errs))
+
+# Test the lazy, headless Problem
+def test_lazy_problem(n_1=10, n_2=12, lam=10**-2, sigma=3, t=10, k=4):
+    """
+    Test problems.Problem(headless=True) with no ESI/direct flags: nothing
+    is built by create_problem, each system is built on its first access
+    (then stored as a plain attribute) and equals the eager construction;
+    reading one before create_problem raises AttributeError.
+    """
+    n = n_1*n_2
+    dense = lambda A: A.toarray() if sps.issparse(A) else np.asarray(A)
+    p = problems.Problem(prob='b', n_1=n_1, n_2=n_2, k=k, lam=lam, headless=True)
+    try:
+        p.ESI_A
+        print('ESI_A before create_problem: no error')
+    except AttributeError:
+        print('ESI_A before create_problem: AttributeError')
+    p.create_problem(K_diag=np.ones(n), sigma=sigma, t=t, sparse=True)
+    lazy = sorted(problems.Problem._lazy)
+    print('built by create_problem: %s' % [a for a in lazy if a in p.__dict__])
+    ESI_A, ESI_b = util.gen_ESI_system(X=p.X, Kb=p.Kb, B=p.B, M=p.M, lam=lam, sb=p.sb)
+    ESI3_A, _ = util.gen_ESI3_system(X=p.X, Kb=p.Kb, B=p.B, M=p.M, lam=lam, sb=p.sb)
+    w, _, _ = util.direct_solve(Kb=p.Kb, R=util.direct_rxn(X=p.X, lam=lam), M=p.M, sb=p.sb)
+    errs = [np.abs(dense(p.ESI_A) - dense(ESI_A)).max(), np.abs(dense(p.ESIN_A) - dense(ESI_A.T.dot(ESI_A))).max(), \
+            np.abs(dense(p.ESI3_A) - dense(ESI3_A)).max(), la.norm(p.w_direct - w)/la.norm(w)]
+    print('max error of ESI_A %.2e, ESIN_A %.2e, ESI3_A %.2e; rel error of w_direct %.2e' % tuple(errs))
+    print('built after access: %s' % [a for a in lazy if a in p.__dict__])
+
+# Test the ROI-restricted direct template
+def test_direct_mrxn(n_1=10, n_2=12, m=40, lam=10**-2, sigma=3, t=10, k=4):
+    """
+    Test util.direct_mrxn (k solves with Z) against M R from the full
+    util.direct_rxn, for sparse and dense blur X, the exact spectral Zinv
+    and a sparse x-ray X, and the template direct_solve(MR=...) against
+    direct_solve(R=..., M=...).
+    """
+    n = n_1*n_2
+    _, X, M = util.gen_instance_2d_blur(m=n, n_1=n_1, n_2=n_2, ri=n_1//2, k=k, K_diag=np.ones(n), \
+                                        sigma=sigma, t=t, sparse=True)
+    Zinv = util.spectral_Z_solver(X=X, lam=lam, n_1=n_1, n_2=n_2, boundary='periodic')
+    _, X_x, M_x = util.gen_instance_2d_xray(m=m, n_1=n_1, n_2=n_2, ri=n_1//2, k=k, K_diag=np.ones(m), sparse=True)
+    cases = [('sparse blur', X, M, True, None), ('dense blur', X.toarray(), M.toarray(), False, None), \
+             ('spectral Zinv', X, M, True, Zinv), ('sparse x-ray', X_x, M_x, True, None)]
+    for name, X, M, sparse, Zi in cases:
+        R = util.direct_rxn(X=X, lam=lam, sparse=sparse, Zinv=Zi)
+        MR = util.direct_mrxn(X=X, lam=lam, M=M, sparse=sparse, Zinv=Zi)
+        MR_full = M.dot(R)
+        MR_full = MR_full.toarray() if sps.issparse(MR_full) else np.asarray(MR_full)
+        sb = X.dot(np.random.randn(n))
+        Kb = sps.eye(X.shape[0]) if sparse else np.eye(X.shape[0])
+        w = util.direct_solve(Kb=Kb, MR=MR, sb=sb)[0]
+        w_full = util.direct_solve(Kb=Kb, R=R, M=M, sb=sb)[0]
+        print('%s: rel error of M R %.2e, of w %.2e' % (name, la.norm(MR - MR_full)/la.norm(MR_full), \
+                                                        la.norm(w - w_full)/la.norm(w_full)))
+
+# Test the nested iterative Hotelling solve
+def test_iterative_solve(n_1=10, n_2=12, lam=10**-2, sigma=3, t=10, k=4, tol=10**-8):
+    """
+    Test util.z_cg (plain and spectrally preconditioned CG on Z) and
+    util.iterative_solve (outer CG on Kx, inner CG with Z) against
+    util.direct_solve, for periodic blur with no / exact Zinv, zero-boundary
+    blur with the inexact Zinv as preconditioner, and the matrix-free X.
+    """
+    n = n_1*n_2
+    K_diag = 1. + np.random.rand(n)
+    for boundary, op, zinv in [('periodic', 'sparse', None), ('periodic', 'sparse', 'exact'), \
+                               ('zero', 'sparse', 'precond'), ('zero', 'kron', 'precond')]:
+        gen = lambda op: util.gen_instance_2d_blur(m=n, n_1=n_1, n_2=n_2, ri=n_1//2, k=k, K_diag=K_diag, \
+                                                   sigma=sigma, t=t, sparse=True, boundary=boundary, op=op)
+        Kb, X, M = gen(op)
+        X_s = gen('sparse')[1]
+        Zinv = None
+        if zinv is not None:
+            Zinv = util.spectral_Z_solver(X=X_s, lam=lam, n_1=n_1, n_2=n_2, boundary='periodic', \
+                                          precond=(zinv == 'precond'))
+        sb = X.dot(np.random.randn(n))
+        w_dir = util.direct_solve(Kb=Kb, MR=util.direct_mrxn(X=X_s, lam=lam, M=M), sb=sb)[0]
+
+        c = np.random.randn(n)
+        cg = util.z_cg(util.z_operator(X=X, lam=lam), Zinv)
+        cg.b = c
+        y, n_cg, _ = cg.solve(tol=10**-10*la.norm(c), max_iter=10*n)
+        Z = X_s.T.dot(X_s) + lam*sps.eye(n)
+        w, n_outer, _, n_inner = util.iterative_solve(X=X, Kb=Kb, M=M, lam=lam, sb=sb, Zinv=Zinv, tol=tol, \
+                                                      inner_max=tol, full_output=True)
+        print('%s %s, Zinv %s: z_cg rel residual %.2e in %d its; rel error of w %.2e (%d outer, %d inner its)' \
+              % (boundary, op, zinv, la.norm(Z.dot(y) - c)/la.norm(c), n_cg, la.norm(w - w_dir)/la.norm(w_dir), \
+                 n_outer, n_inner))
+
+# Test the multi-ROI Hotelling engine
+def test_engine_templates(n_1=12, n_2=14, lam=10**-2, sigma=3, t=10, block=8):
+    """
+    Test hotelling.HotellingEngine.templates(...) for overlapping ROIs given
+    as roi_indices kwargs, a selection matrix M and an index array against
+    util.direct_solve with direct_mrxn for each ROI on its own; the engine
+    solves with Z once per distinct ROI pixel.
+    """
+    n = n_1*n_2
+    Kb, X, _ = util.gen_instance_2d_blur(m=n, n_1=n_1, n_2=n_2, ri=n_1//2, k=3, \
+                                         K_diag=np.random.uniform(1, 2, n), \
+                                         sigma=sigma, t=t, sparse=True, boundary='zero')
+    sb = X.dot(np.random.randn(n))
+    specs = [dict(ri=[4, 6], k=5), dict(rect=(3, 7, 5, 9)), dict(disc=(6., 7., 2.5)), \
+             util.gen_M(n_1=n_1, n_2=n_2, rect=(0, 2, 0, 3)), np.array([5, 40, 41, 100])]
+    engine = hotelling.HotellingEngine(X=X, Kb=Kb, lam=lam, sb=sb, n_1=n_1, n_2=n_2, block=block)
+    ws, snrs = engine.templates(specs)
+    w_err, snr_err, pixels = 0.0, 0.0, set()
+    for spec, w, snr in zip(specs, ws, snrs):
+        idx = engine.roi(spec)
+        pixels.update(idx)
+        M = util.gen_M(n_1=n, idx=idx)
+        w_d, _, sx = util.direct_solve(Kb=Kb, MR=util.direct_mrxn(X=X, lam=lam, M=M), sb=sb)
+        snr_d = np.sqrt(np.asarray(sx).reshape(-1).dot(w_d.reshape(-1)))
+        w_err = max(w_err, la.norm(w - w_d) / la.norm(w_d))
+        snr_err = max(snr_err, abs(snr - snr_d) / snr_d)
+    print('%d ROIs: relative error of templates %.2e, SNRs %.2e; %d solves for %d distinct pixels' \
+          % (len(specs), w_err, snr_err, engine.n_solves, len(pixels)))
+
+# Test the randomized low-rank factorization of R
+def test_randomized_svd(m=80, n=60, rank=10, tol=10**-6, n_1=10, n_2=12, lam=10**-2, sigma=3, t=10, k=4):
+    """
+    Test optimize.randomized_svd(...) on a matrix with geometrically
+    decaying singular values (fixed rank against the exact leading singular
+    values, and the accuracy `tol`), then util.lowrank_rxn against the
+    explicit M R of util.direct_mrxn and its template from direct_solve.
+    Prints the relative errors.
+    """
+    U, _ = la.qr(np.random.randn(m, n))
+    V, _ = la.qr(np.random.randn(n, n))
+    s = 2.0**-np.arange(n)
+    A = (U * s).dot(V.T)
+    F = optimize.randomized_svd(A, rank=rank, seed=0)
+    print('rank %d: max rel error of the singular values %.2e' % (F.rank, np.abs(F.s/s[:rank] - 1).max()))
+    F = optimize.randomized_svd(A, tol=tol, seed=0)
+    print('tol %.0e: rank %d, ||A - U S Vt|| / ||A|| = %.2e, ||A^T - (U S Vt)^T|| / ||A|| = %.2e' \
+          % (tol, F.rank, la.norm(A - F.toarray(), 2)/s[0], la.norm(A.T - F.T.toarray(), 2)/s[0]))
+
+    N = n_1*n_2
+    Kb, X, M = util.gen_instance_2d_blur(m=N, n_1=n_1, n_2=n_2, ri=n_1//2, k=k, K_diag=np.random.uniform(1, 2, N), \
+                                         sigma=sigma, t=t, sparse=True)
+    sb = X.dot(np.random.randn(N))
+    MR = util.direct_mrxn(X=X, lam=lam, M=M)
+    w = util.direct_solve(Kb=Kb, MR=MR, sb=sb)[0]
+    for name, F in [('M R', util.lowrank_rxn(X=X, lam=lam, M=M, tol=10**-10, seed=0)), \
+                    ('R', util.lowrank_rxn(X=X, lam=lam, tol=tol, seed=0))]:
+        MR_F = F if name == 'M R' else F.left(M)
+        w_F = util.direct_solve(Kb=Kb, MR=MR_F, sb=sb)[0]
+        print('lowrank_rxn %s: rank %d, rel error of M R %.2e, of w %.2e' \
+              % (name, F.rank, la.norm(MR_F.toarray() - MR)/la.norm(MR), la.norm(w_F - w)/la.norm(w)))
+
+# Test the regularization parameter selection
+def test_lam_selector(n_1=10, n_2=12, sigma=3, t=10, noise=10**-2, k=30):
+    """
+    Test util.LamSelector(...) with whitening and a bidiagonal B: with a
+    full bidiagonalization the residual and solution norms, GCV, L-curve
+    curvature (Hansen's formula) and the solutions are checked against the
+    exact SVD of W X B^{-1} and direct solves; the lam chosen by each method
+    with `k` and with all steps is compared with the exact choice (GCV
+    needs k past the numerical rank, see LamSelector).
+    """
+    n = n_1*n_2
+    K_diag = np.random.uniform(1, 2, n)
+    Kb, X, _ = util.gen_instance_2d_blur(m=n, n_1=n_1, n_2=n_2, ri=n_1//2, k=3, K_diag=K_diag, \
+                                         sigma=sigma, t=t, sparse=True)
+    B = sps.eye(n) - 0.5*sps.eye(n, k=1)
+    g = X.dot(np.random.rand(n)) + noise*np.sqrt(K_diag)*np.random.randn(n)
+    W = np.diag(1/np.sqrt(K_diag))
+    A = W.dot(X.toarray()).dot(la.inv(B.toarray()))
+    U, s, Vt = la.svd(A)
+    c = U.T.dot(W.dot(g))
+    lams = np.logspace(-8, 0, 41)
+
+    T = s[None, :]**2 + lams[:, None]
+    rho = np.sum((lams[:, None]/T)**2 * c**2, axis=1)
+    eta = np.sum(s**2/T**2 * c**2, axis=1)
+    ## Hansen's curvature, in the parameter mu = sqrt(lam) of mu^2 ||B f||^2
+    mu = np.sqrt(lams)
+    d_eta = -4*mu * np.sum(s**2*c**2/T**3, axis=1)
+    kappa = -2*eta*rho/d_eta * (mu**2*d_eta*rho + 2*mu*eta*rho + mu**4*eta*d_eta) / (mu**4*eta**2 + rho**2)**1.5
+    gcv = rho / (n - np.sum(s**2/T, axis=1))**2
+    delta = noise*np.sqrt(n)
+    exact = {'gcv': gcv, 'lcurve': kappa, 'discrepancy': np.sqrt(rho) - delta}
+    Z = lambda lam: X.T.dot(sps.diags(1/K_diag)).dot(X) + lam*B.T.dot(B)
+    rel = lambda x, y: np.abs(x - y).max() / np.abs(y).max()
+
+    full = util.LamSelector(X=X, g=g, B=B, Kb=Kb, k=n)
+    rho_k, eta_k = full.norms(lams)
+    f_err = max(rel(full.solution(lam), scla.spsolve(Z(lam).tocsc(), X.T.dot(g/K_diag))) for lam in lams[::10])
+    print('k=%d: rel error of ||r||^2 %.2e, ||B f||^2 %.2e, GCV %.2e, curvature %.2e, solutions %.2e' \
+          % (full.k, rel(rho_k, rho), rel(eta_k, eta), rel(full.gcv(lams, projected=False), gcv), \
+             rel(full.curvature(lams), kappa), f_err))
+    sel = util.LamSelector(X=X, g=g, B=B, Kb=Kb, k=k)
+    for method, kw in [('gcv', {}), ('lcurve', {}), ('discrepancy', dict(delta=delta))]:
+        best = {'gcv': np.argmin, 'lcurve': np.argmax}.get(method)
+        lam_x = lams[best(exact[method])] if best else lams[exact[method] <= 0].max()
+        print('%s: lam %.2e with k=%d, %.2e with k=%d, exact %.2e' % (method, sel.select(lams, method=method, **kw)[0], \
+              sel.k, full.select(lams, method=method, **kw)[0], full.k, lam_x))
+
+# Test the Ritz values recorded by CG
+def test_cg_ritz(n=100, cond_num=10**3, n_iter=8):
+    """
+    Test ConjugateGradientsSolver.solve(..., ritz=True): after a few
+    iterations the Ritz values equal the eigenvalues of A projected onto
+    the Krylov space of b (Rayleigh-Ritz), and after a full solve their
+    extremes and `cond_est` match la.eigvalsh and la.cond. Both the full
+    and the bare solver are checked.
+    """
+    Q, _ = la.qr(np.random.randn(n, n))
+    A = (Q * np.logspace(0, np.log10(cond_num), n)).dot(Q.T)
+    A = (A + A.T) / 2
+    b = np.random.randn(n)
+    ev = la.eigvalsh(A)
+    K, _ = la.qr(np.column_stack([la.matrix_power(A, j).dot(b) for j in range(n_iter)]))
+    ritz_K = la.eigvalsh(K.T.dot(A).dot(K))
+    for full_output in [True, False]:
+        cg = optimize.ConjugateGradientsSolver(A=A, b=b, full_output=full_output)
+        cg.solve(tol=10**-14*la.norm(b), x_0=np.zeros(n), max_iter=n_iter, ritz=True)
+        err_K = np.abs(cg.ritz - ritz_K).max() / ev[-1]
+        cg.solve(tol=10**-10*la.norm(b), x_0=np.zeros(n), max_iter=10*n, ritz=True)
+        print('full_output=%s: %d its, rel error of Ritz values %.2e; %d its, rel error of the extremes %.2e, %.2e, of cond_est %.2e' \
+              % (full_output, n_iter, err_K, len(cg.alphas), abs(cg.ritz[0]/ev[0] - 1), abs(cg.ritz[-1]/ev[-1] - 1), \
+                 abs(cg.cond_est/la.cond(A) - 1)))
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
 
 
 
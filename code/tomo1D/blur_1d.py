@@ -1,10 +1,11 @@
+import sys
 import numpy as np
 import numpy.linalg as la
 import scipy.linalg as spla
 import scipy.sparse as sps
+import scipy.sparse.linalg as spsla
 from pprint import pprint
 from scipy.stats import norm
-import matplotlib.pyplot as plt
 
 np.set_printoptions(linewidth=200)
 
@@ -14,6 +15,7 @@ def gen_f(n, save=False, p1=0.4, p2=0.6, plot=True):
         name = "f_impulse"+"_"+str(n)
         np.save(name,f_impulse)
     if plot:
+        import matplotlib.pyplot as plt
         plt.plot(range(n),f_impulse)
         plt.title("f_impulse image")
         plt.show()
@@ -101,14 +103,56 @@ def row_k(k=0, template=None, template_inds=None, n=None, sparse=True, debug=Fal
     ## return
     return r_k
 
-def fwdblur_operator_1d(n=None, sigma=3, t=10, sparse=True, plot=False, debug=False):
+def banded_operator_1d(n=None, template=None, template_inds=None, boundary='periodic', sparse=True):
+    """
+    Builds the n x n blur operator from a template in one vectorized call:
+    row k applies `template` to pixels k + `template_inds`.
+    Args
+        - n             :  pixels of original image
+        - template      :  window and Gaussian approximation
+        - template_inds :  pixel offsets of the template taps
+        - boundary      :  'periodic' (circulant), 'zero' (taps outside the
+                           image dropped) or 'reflect' (half-sample symmetric,
+                           pixel -1 mirrors pixel 0)
+        - sparse        :  return X as sparse csr_matrix
+    Returns
+        - X             :  n x n blur operator
+    """
+    template = np.asarray(template, dtype=float)
+    template_inds = np.asarray(template_inds, dtype=int)
+
+    ## every (row, tap) pair at once
+    rows = np.repeat(np.arange(n), len(template_inds))
+    cols = (np.arange(n)[:,None] + template_inds[None,:]).ravel()
+    vals = np.tile(template, n)
+
+    ## map taps falling outside the image
+    if boundary == 'periodic':
+        cols = cols % n
+    elif boundary == 'zero':
+        keep = (cols >= 0) & (cols < n)
+        rows, cols, vals = rows[keep], cols[keep], vals[keep]
+    elif boundary == 'reflect':
+        cols = cols % (2*n)
+        cols = np.where(cols >= n, 2*n-1-cols, cols)
+    else:
+        raise ValueError("boundary must be `periodic`, `zero` or `reflect`")
+
+    ## taps wrapping onto the same pixel are summed
+    X = sps.csr_matrix((vals, (rows, cols)), shape=(n, n))
+    if not sparse:
+        X = X.toarray()
+    return X
+
+def fwdblur_operator_1d(n=None, sigma=3, t=10, sparse=True, plot=False, debug=False, boundary='periodic'):
     """
     Returns an n x n np.array
     Args
-        - n      :  pixels of original image
-        - sparse :  creates X as sparse csr_matrix
+        - n        :  pixels of original image
+        - sparse   :  creates X as sparse csr_matrix
+        - boundary :  'periodic', 'zero' or 'reflect' (see banded_operator_1d)
     Returns
-        - X      :  n x n (Gaussian) blur operator
+        - X        :  n x n (Gaussian) blur operator
     """
     if n is None:
         print("specify `n`")
@@ -128,6 +172,7 @@ def fwdblur_operator_1d(n=None, sigma=3, t=10, sparse=True, plot=False, debug=Fa
 
     ## plot template
     if plot:
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots()
         ax.plot(template_inds, template, color='r')
         plt.xlabel("pixel")
@@ -135,17 +180,9 @@ def fwdblur_operator_1d(n=None, sigma=3, t=10, sparse=True, plot=False, debug=Fa
         ax.set_xticks(template_inds)
         plt.show()
 
-    ## construct sparse
-    if sparse:
-        X = row_k(k=0, template=template, template_inds=template_inds, n=n, sparse=True, debug=debug)
-        for k in range(1, n):
-            r_k = row_k(k=k, template=template, template_inds=template_inds, n=n, sparse=True, debug=debug)
-            X = sps.vstack([X, r_k])
-    else:
-        X = row_k(k=0, template=template, template_inds=template_inds, n=n, sparse=False, debug=debug)
-        for k in range(1, n):
-            r_k = row_k(k=k, template=template, template_inds=template_inds, n=n, sparse=False, debug=debug)
-            X = np.vstack([X, r_k])
+    ## construct banded operator
+    X = banded_operator_1d(n=n, template=template, template_inds=template_inds, \
+                           boundary=boundary, sparse=sparse)
 
     if debug:
         if sparse:
@@ -163,6 +200,46 @@ def fwdblur_operator_1d(n=None, sigma=3, t=10, sparse=True, plot=False, debug=Fa
     ## return
     return X
 
+def kernel_column_1d(n=None, sigma=3, t=10):
+    """
+    First column of the periodic (circulant) blur operator, i.e. the blur
+    kernel wrapped onto n pixels: X[i,0] = template[j] where i = -j mod n.
+    """
+    template, template_inds = template_1d(sigma=sigma, t=t)
+    c = np.zeros(n)
+    np.add.at(c, (-np.asarray(template_inds)) % n, template)
+    return c
+
+class FFTBlurOperator1d(spsla.LinearOperator):
+    """
+    Matrix-free periodic 1D Gaussian blur, applied as a circular convolution
+    with real FFTs in O(n log n) regardless of the window `t`. Drop-in for the
+    sparse X of fwdblur_operator_1d(boundary='periodic').
+
+    The kernel spectrum is computed once and cached in `spectrum`; the
+    adjoint uses its conjugate.
+    """
+
+    def __init__(self, n=None, sigma=3, t=10):
+        self.n = n
+        self.spectrum = np.fft.rfft(kernel_column_1d(n=n, sigma=sigma, t=t))
+        super(FFTBlurOperator1d, self).__init__(dtype=np.dtype(float), shape=(n, n))
+
+    def _apply(self, V, S):
+        V = np.asarray(V)
+        if V.ndim == 1:
+            return np.fft.irfft(S * np.fft.rfft(V), self.n)
+        return np.fft.irfft(S[:,None] * np.fft.rfft(V, axis=0), self.n, axis=0)
+
+    def _matvec(self, v):
+        return self._apply(v, self.spectrum)
+
+    def _rmatvec(self, w):
+        return self._apply(w, self.spectrum.conj())
+
+    def _matmat(self, V):
+        return self._apply(V, self.spectrum)
+
 def test_symm(X, d=8):
     """
     Test symmetry to `d` digits of precision
@@ -3,9 +3,9 @@ import numpy.linalg as la
 import scipy.linalg as sla
 import scipy.linalg as spla
 import scipy.sparse as sps
+import scipy.sparse.linalg as spsla
 from pprint import pprint
 from scipy.stats import norm
-import matplotlib.pyplot as plt
 from skimage import morphology
 
 import os, sys
@@ -47,6 +47,7 @@ def gen_f_rect(n_1, n_2, levels=3, save=False, plot=True):
         name = "f_rect"+"_"+str(n_1)+"_"+str(n_2)+"_"+str(levels)
         np.save(name,f_rect)
     if plot:
+        import matplotlib.pyplot as plt
         plt.imshow(f_rect)
         plt.title("f_rect image")
         plt.show()
@@ -67,6 +68,7 @@ def gen_f_diam(plot=True):
     f = np.pad(f, pad_width=(27,26), mode='constant', constant_values=(0, 0))
     f = f[18:53]
     if plot:
+        import matplotlib.pyplot as plt
         plt.imshow(f)
         plt.show()
     return f
@@ -124,33 +126,116 @@ def row_k(k=0, n_1=None, n_2=None, template=None, template_inds=None, sparse=Tru
     ## return
     return r_k
 
-def fwdblur_operator_2d(n_1=10, n_2=20, sigma=3, t=10, sparse=True, plot=False, debug=False):
+def fwdblur_operator_2d(n_1=10, n_2=20, sigma=3, t=10, sparse=True, plot=False, debug=False, boundary='periodic'):
+    """
+    Separable 2D Gaussian blur of an n_1 x n_2 image vectorized column-major
+    (`f.flatten('F')`), as the Kronecker factors
+        X_col = I_{n_2} kron B_col     (blurs down each column)
+        X_row = B_row kron I_{n_1}     (blurs along each row)
+    assembled directly in sparse form, so no n x n dense intermediate is
+    ever built. The full blur is X = X_col X_row = B_row kron B_col.
+    Args
+        - n_1      :  number of rows
+        - n_2      :  number of cols
+        - boundary :  'periodic', 'zero' or 'reflect' (see blur_1d.banded_operator_1d)
+    Returns
+        - X_col, X_row : (n_1*n_2) x (n_1*n_2) column and row blur operators
+    """
+    B_col, B_row = kron_factors_2d(n_1=n_1, n_2=n_2, sigma=sigma, t=t, \
+                                   plot=plot, debug=debug, boundary=boundary)
 
     ## COL BLUR - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    X_col = sps.kron(sps.eye(n_2), B_col, format='csr')
 
-    ## define block
-    B_col = blur_1d.fwdblur_operator_1d(n=n_1, sigma=sigma, t=t, sparse=sparse, plot=plot, debug=debug)
+    ## ROW BLUR - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    X_row = sps.kron(B_row, sps.eye(n_1), format='csr')
 
-    #print(type(B_col),"B_col type")
+    if not sparse:
+        X_col, X_row = X_col.toarray(), X_row.toarray()
+    return X_col, X_row
 
-    X_col = B_col
-    if sparse:
-        for col in range(n_2-1):
-            X_col = sps.block_diag((X_col,B_col))
-    else:
-        for col in range(n_2-1):
-            X_col = sla.block_diag((X_col,B_col))
+def kron_factors_2d(n_1=10, n_2=20, sigma=3, t=10, plot=False, debug=False, boundary='periodic'):
+    """
+    Returns the 1D blur blocks B_col (n_1 x n_1) and B_row (n_2 x n_2) of the
+    separable 2D blur, as sparse csr_matrix.
+    """
+    B_col = blur_1d.fwdblur_operator_1d(n=n_1, sigma=sigma, t=t, sparse=True, \
+                                        plot=plot, debug=debug, boundary=boundary)
+    B_row = blur_1d.fwdblur_operator_1d(n=n_2, sigma=sigma, t=t, sparse=True, \
+                                        plot=False, debug=debug, boundary=boundary)
+    return B_col, B_row
 
-    ## ROW BLUR - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    ## still slower than `col` version; poor sparse performance
-    template, template_inds = blur_1d.template_1d(sigma=sigma, t=t, debug=debug)
-    r0 = row_k(k=0, n_1=n_1, n_2=n_2, template=template, template_inds=template_inds, sparse=False, debug=debug)
-    X_row = sla.circulant(r0).T
-    if sparse:
-        X_row = sps.csr_matrix(X_row)
-    return X_col, X_row
+class KronBlurOperator(spsla.LinearOperator):
+    """
+    Matrix-free separable 2D blur X = B_row kron B_col acting on images
+    vectorized column-major: X vec(F) = vec(B_col F B_row^T). Only the two
+    small 1D blocks are stored, so memory is O(n_1 + n_2) times the window.
+
+    Args
+        - n_1, n_2 :  image rows and cols
+        - sigma, t :  Gaussian blur standard deviation and pixel window
+        - boundary :  'periodic', 'zero' or 'reflect'
+    """
+
+    def __init__(self, n_1=10, n_2=20, sigma=3, t=10, boundary='periodic'):
+        self.n_1, self.n_2 = n_1, n_2
+        self.B_col, self.B_row = kron_factors_2d(n_1=n_1, n_2=n_2, sigma=sigma, t=t, \
+                                                 boundary=boundary)
+        super(KronBlurOperator, self).__init__(dtype=np.dtype(float), shape=(n_1*n_2, n_1*n_2))
+
+    def _matvec(self, v):
+        V = np.asarray(v).reshape(self.n_1, self.n_2, order='F')
+        Y = self.B_row.dot(self.B_col.dot(V).T).T
+        return Y.reshape(-1, order='F')
+
+    def _rmatvec(self, w):
+        W = np.asarray(w).reshape(self.n_1, self.n_2, order='F')
+        Y = self.B_row.T.dot(self.B_col.T.dot(W).T).T
+        return Y.reshape(-1, order='F')
+
+class FFTBlurOperator2d(spsla.LinearOperator):
+    """
+    Matrix-free periodic separable 2D blur (B_row kron B_col) applied with a
+    2D real FFT of the column-major vectorized image, O(n log n) per product
+    regardless of the window `t`. Drop-in for the sparse X of
+    util.gen_instance_2d_blur with boundary='periodic'.
+
+    The kernel spectrum (outer product of the 1D column and row spectra) is
+    computed once and cached in `spectrum`; the adjoint uses its conjugate.
+    """
+
+    def __init__(self, n_1=10, n_2=20, sigma=3, t=10):
+        self.n_1, self.n_2 = n_1, n_2
+        s_col = np.fft.fft(blur_1d.kernel_column_1d(n=n_1, sigma=sigma, t=t))
+        s_row = np.fft.rfft(blur_1d.kernel_column_1d(n=n_2, sigma=sigma, t=t))
+        self.spectrum = np.outer(s_col, s_row)
+        super(FFTBlurOperator2d, self).__init__(dtype=np.dtype(float), shape=(n_1*n_2, n_1*n_2))
+
+    def _apply(self, v, S):
+        v = np.asarray(v)
+        if v.ndim == 1:
+            V = v.reshape(self.n_1, self.n_2, order='F')
+            Y = np.fft.irfft2(S * np.fft.rfft2(V), s=(self.n_1, self.n_2))
+            return Y.reshape(-1, order='F')
+        ## a block of images: one batched FFT over the first two axes
+        V = v.reshape(self.n_1, self.n_2, v.shape[1], order='F')
+        Y = np.fft.irfft2(S[:,:,None] * np.fft.rfft2(V, axes=(0, 1)), s=(self.n_1, self.n_2), axes=(0, 1))
+        return Y.reshape(-1, v.shape[1], order='F')
+
+    def _matvec(self, v):
+        return self._apply(v, self.spectrum)
+
+    def _rmatvec(self, w):
+        return self._apply(w, self.spectrum.conj())
+
+    def _matmat(self, V):
+        return self._apply(V, self.spectrum)
+
+    def _rmatmat(self, W):
+        return self._apply(W, self.spectrum.conj())
 
 def example(n_1=20, n_2=50, sigma=5, t=8):
+    import matplotlib.pyplot as plt
     f = gen_f_rect(n_1=n_1, n_2=n_2, levels=3, plot=True)
 
     X_col, X_row = fwdblur_operator_2d(n_1=n_1, n_2=n_2, sigma=sigma, t=t)
@@ -1,6 +1,8 @@
+import multiprocessing
 import numpy as np
 import numpy.linalg as la
 import scipy.sparse as sparse
+import scipy.sparse.linalg as spsla
 import pprint
 
 
@@ -200,6 +202,116 @@ def siddon_algorithm(x1, y1, x2, y2, x_grid, y_grid, debug=False):
     X_k = X_k.flatten()
     return X_k
 
+def siddon_triplets(x1, y1, x2, y2, x_grid, y_grid, batch=1024):
+    """Vectorized Siddon (1985): traces many rays at once with array ops.
+    Args:
+        x1, y1, x2, y2: arrays with the start/end point of each ray
+        x_grid: the x coordinates of the gridlines dividing cells
+        y_grid: the y coordinates of the gridlines dividing cells
+        batch: number of rays traced per vectorized pass (memory is
+               O(batch * (n_1 + n_2)))
+    Returns:
+        (rows, cols, lengths): COO triplets of the system matrix; `rows` is
+        the ray index, `cols` the pixel index flattened by row exactly as in
+        siddon_algorithm. Segments outside of the grid are dropped.
+    """
+    x1, y1 = np.atleast_1d(np.asarray(x1, dtype=float)), np.atleast_1d(np.asarray(y1, dtype=float))
+    x2, y2 = np.atleast_1d(np.asarray(x2, dtype=float)), np.atleast_1d(np.asarray(y2, dtype=float))
+    x_grid = np.asarray(x_grid, dtype=float)
+    y_grid = np.asarray(y_grid, dtype=float)
+    dx = np.abs(x_grid[1] - x_grid[0])
+    dy = np.abs(y_grid[1] - y_grid[0])
+    Nx, Ny = x_grid.size, y_grid.size
+
+    rows, cols, lens = [], [], []
+    for b0 in range(0, x1.size, batch):
+        sl = slice(b0, b0+batch)
+        bx1, by1, bx2, by2 = x1[sl], y1[sl], x2[sl], y2[sl]
+        ddx, ddy = bx2 - bx1, by2 - by1
+
+        # parametric values of every gridline crossing (nan for parallel rays)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ax = (x_grid[None,:] - bx1[:,None]) / ddx[:,None]
+            ay = (y_grid[None,:] - by1[:,None]) / ddy[:,None]
+        ax[ddx == 0.0, :] = np.nan
+        ay[ddy == 0.0, :] = np.nan
+
+        # range of parametric values inside the grid
+        amin = np.fmax(0.0, np.fmax(np.fmin(ax[:,0], ax[:,-1]), np.fmin(ay[:,0], ay[:,-1])))
+        amax = np.fmin(1.0, np.fmin(np.fmax(ax[:,0], ax[:,-1]), np.fmax(ay[:,0], ay[:,-1])))
+
+        # merge sets to form alpha; crossings outside [amin, amax] collapse
+        # onto amax and give zero-length segments
+        alpha = np.hstack([amin[:,None], ax, ay, amax[:,None]])
+        outside = np.isnan(alpha) | (alpha < amin[:,None]) | (alpha > amax[:,None])
+        alpha = np.where(outside, amax[:,None], alpha)
+        alpha.sort(axis=1)
+
+        # voxel lengths; the pixel containing the midpoint of a segment
+        # contains the whole segment
+        d12 = np.sqrt(ddx**2.0 + ddy**2.0)
+        l = d12[:,None] * np.diff(alpha, axis=1)
+        amid = 0.5 * (alpha[:,1:] + alpha[:,:-1])
+        i = np.floor((bx1[:,None] + amid*ddx[:,None] - x_grid[0])/dx).astype(int)
+        j = np.floor((by1[:,None] + amid*ddy[:,None] - y_grid[0])/dy).astype(int)
+
+        keep = (l > 1e-12 * np.maximum(d12, 1.0)[:,None]) & \
+               (i >= 0) & (i < Nx-1) & (j >= 0) & (j < Ny-1)
+        r, c = np.nonzero(keep)
+        rows.append(r + b0)
+        cols.append(((Ny-2) - j[r,c]) * (Nx-1) + i[r,c])
+        lens.append(l[r,c])
+
+    if not rows:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(lens)
+
+def _trace_chunk(args):
+    """ process-pool worker: traces one chunk of rays with siddon_triplets """
+    offset, x1, y1, x2, y2, x_grid, y_grid, batch = args
+    rows, cols, lens = siddon_triplets(x1, y1, x2, y2, x_grid, y_grid, batch=batch)
+    return rows + offset, cols, lens
+
+def trace_rays(x1, y1, x2, y2, x_grid, y_grid, batch=1024, n_jobs=1, chunk=None):
+    """
+    Traces all rays into COO triplets, optionally in a process pool.
+
+    Rays are split into contiguous chunks (a multiple of `batch` rays each)
+    that are traced independently and concatenated in ray order, so the
+    triplets, and the matrix built from them, are identical to the serial
+    siddon_triplets output.
+    Args:
+        n_jobs: number of worker processes (1 = serial, None = all cpus)
+        chunk:  rays per task (default: rays split evenly over 4*n_jobs tasks)
+    Returns:
+        (rows, cols, lengths) as in siddon_triplets
+    """
+    x1, y1 = np.atleast_1d(np.asarray(x1, dtype=float)), np.atleast_1d(np.asarray(y1, dtype=float))
+    x2, y2 = np.atleast_1d(np.asarray(x2, dtype=float)), np.atleast_1d(np.asarray(y2, dtype=float))
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    n_rays = x1.size
+    if n_jobs <= 1 or n_rays <= batch:
+        return siddon_triplets(x1, y1, x2, y2, x_grid, y_grid, batch=batch)
+
+    if chunk is None:
+        chunk = int(np.ceil(n_rays / float(4*n_jobs)))
+    chunk = int(np.ceil(chunk / float(batch))) * batch
+    tasks = [(s, x1[s:s+chunk], y1[s:s+chunk], x2[s:s+chunk], y2[s:s+chunk], x_grid, y_grid, batch) \
+             for s in range(0, n_rays, chunk)]
+
+    pool = multiprocessing.Pool(processes=n_jobs)
+    try:
+        pieces = pool.map(_trace_chunk, tasks)   # map keeps task order
+    finally:
+        pool.close()
+        pool.join()
+
+    rows = np.concatenate([p[0] for p in pieces])
+    cols = np.concatenate([p[1] for p in pieces])
+    lens = np.concatenate([p[2] for p in pieces])
+    return rows, cols, lens
+
 def gen_grids(n_1, n_2):
     """
     generates x_grid and y_grid from even n_1, n_2
@@ -255,14 +367,103 @@ def gen_eep(x_grid, y_grid, thetas, debug=False):
         print("")
     return points
 
-def gen_X(n_1, n_2, m, sp_rep=False, debug=False):
+class ParallelBeam:
+    """
+    Parallel-beam geometry: `n_angles` projection angles evenly dividing
+    [0, pi), each with `n_det` parallel rays whose detector offsets are
+    `spacing` apart and centred on the image centre. Rays are ordered
+    angle-major (row k*n_det + d of X is angle k, detector bin d).
+
+    With n_det=1 the rays are the central rays of gen_eep (up to the
+    5-decimal rounding of its end points).
+    """
+
+    def __init__(self, n_angles, n_det=1, spacing=1.0, thetas=None):
+        if thetas is None:
+            thetas = np.linspace(0, np.pi, int(n_angles)+1)[0:int(n_angles)]
+        self.thetas = np.asarray(thetas, dtype=float)
+        self.n_det, self.spacing = int(n_det), float(spacing)
+        self.offsets = self.spacing * (np.arange(self.n_det) - (self.n_det-1)/2.)
+        self.m = self.thetas.size * self.n_det
+
+    def rays(self, x_grid, y_grid):
+        """ (x1, y1, x2, y2) arrays of ray end points, beyond the grid """
+        L = np.hypot(np.abs(x_grid).max(), np.abs(y_grid).max()) + 1.0
+        th = np.repeat(self.thetas, self.n_det)
+        s = np.tile(self.offsets, self.thetas.size)
+        dx, dy = np.cos(th), np.sin(th)
+        ## exact axis directions: cos(pi/2) = 6e-17 would tilt a ray lying
+        ## on a gridline into the pixels on one side of it
+        dx[np.abs(dx) < 10**-12], dy[np.abs(dy) < 10**-12] = 0.0, 0.0
+        px, py = -s*dy, s*dx           # foot of the ray on the detector line
+        return px - L*dx, py - L*dy, px + L*dx, py + L*dy
+
+class FanBeam:
+    """
+    Fan-beam geometry: a point source on a circle of radius `src_radius`
+    about the image centre at `n_angles` positions evenly dividing
+    [0, 2pi), each firing `n_det` rays evenly spread over `fan_angle`
+    (default: just wide enough to cover the image). Rays are ordered
+    source-major (row k*n_det + d of X is source k, detector bin d).
+    """
+
+    def __init__(self, n_angles, n_det, src_radius, fan_angle=None, betas=None):
+        if betas is None:
+            betas = np.linspace(0, 2*np.pi, int(n_angles)+1)[0:int(n_angles)]
+        self.betas = np.asarray(betas, dtype=float)
+        self.n_det, self.src_radius = int(n_det), float(src_radius)
+        self.fan_angle = fan_angle
+        self.m = self.betas.size * self.n_det
+
+    def rays(self, x_grid, y_grid):
+        """ (x1, y1, x2, y2) arrays of ray end points, from the source """
+        R = self.src_radius
+        r_img = np.hypot(np.abs(x_grid).max(), np.abs(y_grid).max())
+        if R <= r_img:
+            raise ValueError('source radius must exceed the image half-diagonal %s' % r_img)
+        fan = self.fan_angle
+        if fan is None:
+            fan = 2*np.arcsin(r_img/R)
+        if self.n_det > 1:
+            gammas = np.linspace(-fan/2., fan/2., self.n_det)
+        else:
+            gammas = np.zeros(1)
+        b = np.repeat(self.betas, self.n_det)
+        g = np.tile(gammas, self.betas.size)
+        sx, sy = R*np.cos(b), R*np.sin(b)
+        dx, dy = -np.cos(b + g), -np.sin(b + g)   # towards the centre, rotated by gamma
+        return sx, sy, sx + 2*R*dx, sy + 2*R*dy
+
+def gen_rays(x_grid, y_grid, m=None, geometry=None, debug=False):
+    """
+    Ray end points (x1, y1, x2, y2) as arrays: from `geometry` if given,
+    else `m` central rays at angles dividing [0, pi) (gen_eep).
+    """
+    if geometry is not None:
+        return [np.asarray(a, dtype=float) for a in geometry.rays(x_grid, y_grid)]
+
+    ## partition [0,pi] with m angles
+    m = int(m)
+    theta = np.linspace(0, np.pi, m+1)[0:m]
+
+    ## compute entry/exit points on grid for each slope
+    eepoints = gen_eep(x_grid=x_grid, y_grid=y_grid, thetas=theta, debug=debug)
+    return np.array(eepoints, dtype=float).reshape(m, 4).T
+
+def gen_X(n_1, n_2, m=None, sp_rep=False, debug=False, batch=1024, n_jobs=1, geometry=None):
     """
     Args:
         (int)          n_1: number of rows in image.
         (int)          n_2: number of columns in image.
-        (int)            m: number of rays to fire.
+        (int)            m: number of rays to fire (one central ray per angle);
+                            ignored when `geometry` is given.
         (boolean)   sp_rep: whether to return X as a CSR matrix.
         (boolean)    debug: debugging tool.
+        (int)        batch: rays traced per vectorized pass of siddon_triplets.
+        (int)       n_jobs: worker processes for tracing (see trace_rays);
+                            the result is identical to the serial build.
+        (object)  geometry: ParallelBeam or FanBeam; X then has one row per
+                            ray of the geometry (geometry.m rows).
 
     Returns:
         (numpy.ndarray OR scipy.sparse.csr_matrix)  X:
@@ -275,26 +476,239 @@ def gen_X(n_1, n_2, m, sp_rep=False, debug=False):
 
     n_1 = int(n_1)
     n_2 = int(n_2)
-    m = int(m)
 
     ## generate grid
     xgrid, ygrid = gen_grids(n_1,n_2)
 
-    ## partition [0,pi] with m angles
-    theta = np.linspace(0, np.pi, m+1)[0:m]
+    ## ray end points
+    x1, y1, x2, y2 = gen_rays(xgrid, ygrid, m=m, geometry=geometry, debug=debug)
+    m = x1.size
 
-    ## compute entry/exit points on grid for each slope
-    eepoints = gen_eep(x_grid=xgrid, y_grid=ygrid, thetas=theta, debug=debug)
-
-    ## initialize X-ray transform matrix
-    X = np.zeros([m, n_1*n_2])
-    for k in range(m):
-        x1,y1, x2,y2 = eepoints[k]
-        X[k,:] = siddon_algorithm(x1, y1, x2, y2, xgrid, ygrid, debug=debug)
+    ## trace all rays straight into sparse (ray, pixel, length) triplets
+    rows, cols, lens = trace_rays(x1, y1, x2, y2, xgrid, ygrid, batch=batch, n_jobs=n_jobs)
+    X = sparse.csr_matrix((lens, (rows, cols)), shape=(m, n_1*n_2))
+    if debug:
+        print("X: %s x %s, nnz: %s" % (X.shape[0], X.shape[1], X.nnz))
     if sp_rep:
-        return(sparse.csr_matrix(X))
-    else:
         return(X)
+    else:
+        return(X.toarray())
+
+class XrayOperator(spsla.LinearOperator):
+    """
+    Matrix-free x-ray projector: X v and X^T w are computed by tracing the
+    rays on demand (siddon_triplets, `batch` rays at a time), so the m x n
+    system matrix is never held in memory. Same rays and pixel ordering as
+    gen_X.
+
+    Args:
+        n_1, n_2:   image rows and cols (even)
+        m:          number of rays fired through the centre (as in gen_X)
+        geometry:   ParallelBeam or FanBeam (overrides m)
+        batch:      rays traced per vectorized pass
+        cache_nnz:  keep traced batches in memory, up to this many nonzeros
+                    in total (0 = retrace on every product); each cached
+                    batch skips its retrace on all later products
+    """
+
+    def __init__(self, n_1, n_2, m=None, batch=1024, cache_nnz=0, geometry=None):
+        if (n_1 % 2) == 1 or (n_2 % 2) == 1:
+            raise ValueError('Dimensions of image must be even.')
+        self.n_1, self.n_2 = int(n_1), int(n_2)
+        self.batch, self.cache_nnz = int(batch), int(cache_nnz)
+
+        ## same rays as gen_X
+        self.x_grid, self.y_grid = gen_grids(self.n_1, self.n_2)
+        self.rays = np.array(gen_rays(self.x_grid, self.y_grid, m=m, geometry=geometry))
+        self.m = self.rays.shape[1]
+
+        self._cache = {}
+        self._cached_nnz = 0
+        super(XrayOperator, self).__init__(dtype=np.dtype(float), shape=(self.m, self.n_1*self.n_2))
+
+    def _block(self, b0):
+        """ rows b0:b0+batch of X as a csr_matrix (traced or from cache) """
+        if b0 in self._cache:
+            return self._cache[b0]
+        x1, y1, x2, y2 = self.rays[:, b0:b0+self.batch]
+        rows, cols, lens = siddon_triplets(x1, y1, x2, y2, self.x_grid, self.y_grid, batch=self.batch)
+        X_b = sparse.csr_matrix((lens, (rows, cols)), shape=(x1.size, self.shape[1]))
+        if self._cached_nnz + X_b.nnz <= self.cache_nnz:
+            self._cache[b0] = X_b
+            self._cached_nnz += X_b.nnz
+        return X_b
+
+    def _matmat(self, V):
+        V = np.asarray(V)
+        Y = np.zeros((self.m,) + V.shape[1:])
+        for b0 in range(0, self.m, self.batch):
+            Y[b0:b0+self.batch] = self._block(b0).dot(V)
+        return Y
+
+    def _matvec(self, v):
+        return self._matmat(np.asarray(v).reshape(-1))
+
+    def _rmatvec(self, w):
+        w = np.asarray(w).reshape(-1)
+        u = np.zeros(self.shape[1])
+        for b0 in range(0, self.m, self.batch):
+            u += self._block(b0).T.dot(w[b0:b0+self.batch])
+        return u
+
+def grid_symmetries(n_1, n_2):
+    """
+    Symmetries of the n_1 x n_2 pixel grid as 2x2 integer matrices acting on
+    (x, y): the four reflections/half-turn of a rectangle, plus quarter-turns
+    and diagonal reflections (8 in all) when the grid is square.
+    """
+    G = [np.array([[1, 0], [0, 1]]), np.array([[-1, 0], [0, 1]]),
+         np.array([[1, 0], [0, -1]]), np.array([[-1, 0], [0, -1]])]
+    if n_1 == n_2:
+        G += [np.array([[0, -1], [1, 0]]), np.array([[0, 1], [-1, 0]]),
+              np.array([[0, 1], [1, 0]]), np.array([[0, -1], [-1, 0]])]
+    return G
+
+def _line_keys(x1, y1, x2, y2, decimals=6):
+    """ hashable (angle mod pi, signed offset) of the lines through the end points """
+    phi = np.arctan2(y2 - y1, x2 - x1) % np.pi
+    s = -np.sin(phi)*x1 + np.cos(phi)*y1
+    ## angles rounding to pi are the same line as angle 0 with offset -s
+    wrap = np.round(phi, decimals) >= np.round(np.pi, decimals)
+    phi[wrap], s[wrap] = 0.0, -s[wrap]
+    return list(zip(np.round(phi, decimals) + 0.0, np.round(s, decimals) + 0.0))
+
+class SymmetricXrayOperator(spsla.LinearOperator):
+    """
+    Symmetry-compressed x-ray projector. Rays that are images of one another
+    under a symmetry g of the pixel grid (grid_symmetries) share one stored
+    row: if ray j = g(ray f) then X[j, perm_g[q]] = X0[f, q], where perm_g
+    maps pixel q to the pixel g sends it to. Only the rays X0 of a
+    fundamental set are traced and stored (up to 4x smaller, 8x on square
+    grids, for evenly spaced angles); X v stacks the |G| permuted copies of v
+    into one sparse-times-dense product with X0, and so does a block X V or
+    X^T W (one product for all columns).
+
+    Usable as X of problems.Problem(prob='x', op='symmetric') everywhere the
+    sparse X is: the Z solves then run by CG (util.z_solver), the ESI
+    systems are block LinearOperators (util.block_operator), and
+    pocs/dr/raar work on operators (projection._system_matrices).
+
+    Args:
+        n_1, n_2:   image rows and cols (even)
+        m:          number of rays fired through the centre (as in gen_X)
+        geometry:   ParallelBeam or FanBeam (overrides m)
+        batch:      rays traced per vectorized pass
+        n_jobs:     worker processes used to trace the fundamental rays
+    """
+
+    def __init__(self, n_1, n_2, m=None, batch=1024, n_jobs=1, geometry=None):
+        if (n_1 % 2) == 1 or (n_2 % 2) == 1:
+            raise ValueError('Dimensions of image must be even.')
+        self.n_1, self.n_2 = int(n_1), int(n_2)
+        x_grid, y_grid = gen_grids(self.n_1, self.n_2)
+        x1, y1, x2, y2 = gen_rays(x_grid, y_grid, m=m, geometry=geometry)
+        self.m, n = x1.size, self.n_1*self.n_2
+
+        ## pixel permutations: pixel (i,j) is row (n_1-1-j), col i of the image
+        j, i = np.divmod(np.arange(n), self.n_2)
+        j = self.n_1 - 1 - j
+        cx, cy = x_grid[i] + 0.5, y_grid[j] + 0.5
+        self.G = grid_symmetries(self.n_1, self.n_2)
+        self.perms = []
+        for g in self.G:
+            gx, gy = g[0, 0]*cx + g[0, 1]*cy, g[1, 0]*cx + g[1, 1]*cy
+            gi = np.round(gx - 0.5 - x_grid[0]).astype(int)
+            gj = np.round(gy - 0.5 - y_grid[0]).astype(int)
+            self.perms.append((self.n_1 - 1 - gj)*self.n_2 + gi)
+
+        ## orbits: each ray is g(fundamental ray) for one g; rays along the
+        ## same line (e.g. opposite fan-beam sources) share a row outright
+        keys = _line_keys(x1, y1, x2, y2)
+        index = {}
+        for r, key in enumerate(keys):
+            index.setdefault(key, []).append(r)
+        ## a ray lying on a grid line goes to one of its two pixel rows by
+        ## the tracer's tie-break, which depends on the ray's direction and
+        ## is not preserved by symmetries: such rays are kept as they are
+        on_grid = [(phi in (0.0, np.round(np.pi/2, 6))) and s == np.round(s) for phi, s in keys]
+        fund = -np.ones(self.m, dtype=int)
+        elem = np.zeros(self.m, dtype=int)
+        rep = []
+        for r in range(self.m):
+            if fund[r] >= 0:
+                continue
+            f = len(rep)
+            rep.append(r)
+            fund[r] = f
+            if on_grid[r]:
+                continue
+            for e, g in enumerate(self.G):
+                gx1, gy1 = g.dot([x1[r], y1[r]])
+                gx2, gy2 = g.dot([x2[r], y2[r]])
+                key = _line_keys(*[np.array([a]) for a in (gx1, gy1, gx2, gy2)])[0]
+                for t in index.get(key, []):
+                    if fund[t] < 0:
+                        fund[t], elem[t] = f, e
+        rep = np.array(rep)
+        self.groups = [(np.where(elem == e)[0], fund[elem == e]) for e in range(len(self.G))]
+
+        ## trace the fundamental rays only
+        rows, cols, lens = trace_rays(x1[rep], y1[rep], x2[rep], y2[rep], x_grid, y_grid,
+                                      batch=batch, n_jobs=n_jobs)
+        self.X0 = sparse.csr_matrix((lens, (rows, cols)), shape=(rep.size, n))
+        super(SymmetricXrayOperator, self).__init__(dtype=np.dtype(float), shape=(self.m, n))
+
+    def _matvec(self, v):
+        v = np.asarray(v).reshape(-1)
+        Y = self.X0.dot(np.column_stack([v[p] for p in self.perms]))
+        y = np.zeros(self.m)
+        for e, (rays, f) in enumerate(self.groups):
+            y[rays] = Y[f, e]
+        return y
+
+    def _rmatvec(self, w):
+        w = np.asarray(w).reshape(-1)
+        W = np.zeros((self.X0.shape[0], len(self.G)))
+        for e, (rays, f) in enumerate(self.groups):
+            np.add.at(W[:, e], f, w[rays])
+        Z = self.X0.T.dot(W)
+        u = np.zeros(self.shape[1])
+        for e, p in enumerate(self.perms):
+            u[p] += Z[:, e]
+        return u
+
+    def _matmat(self, V):
+        ## all K columns and |G| permutations in one product with X0
+        V = np.asarray(V)
+        K = V.shape[1]
+        Y = self.X0.dot(np.hstack([V[p] for p in self.perms]))
+        out = np.zeros((self.m, K))
+        for e, (rays, f) in enumerate(self.groups):
+            out[rays] = Y[f, e*K:(e+1)*K]
+        return out
+
+    def _rmatmat(self, W):
+        W = np.asarray(W)
+        K = W.shape[1]
+        Wf = np.zeros((self.X0.shape[0], len(self.G)*K))
+        for e, (rays, f) in enumerate(self.groups):
+            np.add.at(Wf[:, e*K:(e+1)*K], f, W[rays])
+        Z = self.X0.T.dot(Wf)
+        U = np.zeros((self.shape[1], K))
+        for e, p in enumerate(self.perms):
+            U[p] += Z[:, e*K:(e+1)*K]
+        return U
+
+    def tocsr(self):
+        """ expand to the full m x n csr_matrix """
+        rows, cols, vals = [], [], []
+        for e, (rays, f) in enumerate(self.groups):
+            sub = self.X0[f].tocoo()
+            rows.append(rays[sub.row])
+            cols.append(self.perms[e][sub.col])
+            vals.append(sub.data)
+        return sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                                 shape=self.shape)
 
 if __name__ == "__main__":
     X = gen_X(n_1=8, n_2=4, m=10, sp_rep=False, debug=True)
@@ -4,8 +4,8 @@ from numpy.lib import scimath
 import scipy.linalg as sla
 import scipy.sparse.linalg as spsla
 import scipy.sparse as sps
-import matplotlib.pyplot as plt
-import optimize, traceback, sys
+import scipy.fftpack as fftpack
+import optimize, traceback, sys, os
 from tomo1D import blur_1d as blur_1d
 from tomo2D import blur_2d as blur_2d
 import tomo2D.drt as drt
@@ -222,6 +222,7 @@ def iter_vs_cnum(solver, n_range=None, cnum_range=None, verbose=0, \
     if cnum_range is None:
         cnum_range = [10**i for i in range(1,10)]
 
+    import matplotlib.pyplot as plt
     n_mats = len(n_range) * len(cnum_range)
     print('Evaluating %d matrices' % n_mats)
 
@@ -289,6 +290,112 @@ def gen_Kb(m=None, K_diag=None, sparse=True):
             K[i][i] = d[i]
         return K
 
+def roi_indices(n_1=None, n_2=None, ri=None, k=None, rect=None, disc=None, mask=None):
+    """
+    Flat pixel indices of an ROI, in the column-major order used to vectorize
+    images (`f.flatten('F')`). Only the ROI pixels are touched, so the cost is
+    O(k) for rows, rectangles and discs (O(n) for an explicit boolean mask).
+
+    Exactly one ROI description is used, checked in this order:
+        mask: boolean array of shape (n_1,) or (n_1, n_2)
+        rect: (i0, i1) in 1d or (i0, i1, j0, j1) in 2d; half-open bounds
+        disc: (ci, r) in 1d or (ci, cj, r) in 2d; centre pixel and radius
+        ri, k: centred window of `k` pixels in row `ri` (or list of rows) in
+               2d, or the centred k-window in 1d (gen_M_1d / gen_M_2d ROI)
+    A rect, disc, row or window reaching outside the image raises a
+    ValueError (nothing is clipped).
+    Args
+        n_1: n rows of image (number of pixels in 1d)
+        n_2: n cols of image (None for 1d)
+    Returns
+        idx: sorted int array of the ROI pixel indices
+    """
+    if n_1 is None:
+        print("specify `n_1` in roi_indices")
+        sys.exit(0)
+    dim_2 = n_2 is not None
+    n = n_1*n_2 if dim_2 else n_1
+
+    def check(name, lo, hi, size):
+        ## pixel range [lo, hi) along an axis of `size` pixels
+        if lo < 0 or hi > size or lo >= hi:
+            raise ValueError('%s covers pixels %d:%d, not a nonempty range within 0:%d' % (name, lo, hi, size))
+
+    def span(c, r):
+        ## pixels within r of centre c, [lo, hi)
+        return int(np.ceil(c-r)), int(np.floor(c+r))+1
+
+    if mask is not None:
+        mask = np.asarray(mask, dtype=bool)
+        if mask.size != n:
+            raise ValueError('mask has %d pixels, image has %d' % (mask.size, n))
+        idx = np.flatnonzero(mask.ravel(order='F'))
+    elif rect is not None:
+        if dim_2:
+            i0, i1, j0, j1 = [int(x) for x in rect]
+            check('rect rows', i0, i1, n_1)
+            check('rect cols', j0, j1, n_2)
+            idx = np.add.outer(np.arange(j0, j1)*n_1, np.arange(i0, i1)).ravel()
+        else:
+            i0, i1 = [int(x) for x in rect]
+            check('rect', i0, i1, n_1)
+            idx = np.arange(i0, i1)
+    elif disc is not None:
+        if dim_2:
+            ci, cj, r = disc
+            (i0, i1), (j0, j1) = span(ci, r), span(cj, r)
+            check('disc rows', i0, i1, n_1)
+            check('disc cols', j0, j1, n_2)
+            i, j = np.arange(i0, i1), np.arange(j0, j1)
+            inside = np.add.outer((j-cj)**2, (i-ci)**2) <= r**2
+            idx = np.add.outer(j*n_1, i)[inside]
+        else:
+            ci, r = disc
+            i0, i1 = span(ci, r)
+            check('disc', i0, i1, n_1)
+            idx = np.arange(i0, i1)
+    elif k is not None:
+        if dim_2:
+            if ri is None:
+                ri = int(float(n_1)/2.)
+            rows = np.atleast_1d(ri).astype(int)
+            if rows.min() < 0 or rows.max() >= n_1:
+                raise ValueError('ROI row %s outside of 0:%d' % (ri, n_1))
+            s1 = (n_2-k)//2
+            check('ROI window', s1, s1+k, n_2)
+            j = np.arange(s1, s1+k)
+            idx = np.sort(np.add.outer(j*n_1, rows).ravel())
+        else:
+            s1 = (n_1-k)//2
+            check('ROI window', s1, s1+k, n_1)
+            idx = np.arange(s1, s1+k)
+    else:
+        raise ValueError('specify one of `mask`, `rect`, `disc` or `k` for the ROI')
+
+    return np.asarray(idx, dtype=int)
+
+def gen_M(n_1=None, n_2=None, sparse=True, idx=None, **roi):
+    """
+    Builds the ROI mask operator `M` straight from the ROI pixel indices
+    (see `roi_indices` for the supported ROI descriptions in `roi`).
+    Args
+        n_1: n rows of image (number of pixels in 1d)
+        n_2: n cols of image (None for 1d)
+        idx: precomputed ROI pixel indices (skips `roi_indices`)
+    Returns
+        M: a k x n selection matrix (csr_matrix if `sparse`)
+    """
+    if idx is None:
+        idx = roi_indices(n_1=n_1, n_2=n_2, **roi)
+    n = n_1*n_2 if n_2 is not None else n_1
+    k = len(idx)
+    if sparse:
+        M = sps.csr_matrix((np.ones(k), idx, np.arange(k+1)), shape=(k, n))
+    else:
+        M = np.zeros([k, n])
+        M[np.arange(k), idx] = 1
+    return M
+
 def gen_M_1d(k=None, n=None, sparse=True):
     """
     centers the k-dim ROI in an n-vector
@@ -306,22 +413,10 @@ def gen_M_1d(k=None, n=None, sparse=True):
         print("specify `k` in gen_M_1d")
         sys.exit(0)
 
-    ## find split1 and split 2 indices
-    s1 = (n-k)/2
-    s2 = n-(s1+k)
-
-    ## build diagonal
-    if sparse:
-        data = np.ones(n)
-        offsets = s1
-        M = sps.dia_matrix((data,offsets), shape=(k,n))
-    else:
-        d = np.concatenate([np.zeros(s1), np.ones(k), np.zeros(s2)])
-        M = np.diag(d)
-        M = M[s1:(s1+k),:]
-    return M
+    return gen_M(n_1=n, k=k, sparse=sparse)
 
-def gen_instance_1d_blur(m=None, n=None, k=None, K_diag=None, sigma=3, t=10, sparse=True):
+def gen_instance_1d_blur(m=None, n=None, k=None, K_diag=None, sigma=3, t=10, sparse=True, boundary='periodic', \
+                         op='sparse'):
     """
     Args
         m: dimension of data space
@@ -329,11 +424,19 @@ def gen_instance_1d_blur(m=None, n=None, k=None, K_diag=None, sigma=3, t=10, spa
         n: dimension of image space (number of 1d pixels)
         sigma: gaussian blur standard deviation
         t: gaussian blur pixel window size
+        boundary: blur boundary condition, `periodic`, `zero` or `reflect`
+        op: `sparse` assembles X; `fft` returns the matrix-free
+            blur_1d.FFTBlurOperator1d (periodic only)
     Returns
         M: a k x n matrix
     """
     Kb = gen_Kb(m=m, K_diag=K_diag, sparse=sparse)
-    X = blur_1d.fwdblur_operator_1d(n=n, sigma=sigma, t=t, sparse=sparse)
+    if op == 'fft':
+        if boundary != 'periodic':
+            raise ValueError('`fft` blur operator requires periodic boundary')
+        X = blur_1d.FFTBlurOperator1d(n=n, sigma=sigma, t=t)
+    else:
+        X = blur_1d.fwdblur_operator_1d(n=n, sigma=sigma, t=t, sparse=sparse, boundary=boundary)
     M = gen_M_1d(k=k, n=n, sparse=sparse)
 
     return Kb, X, M
@@ -342,28 +445,18 @@ def gen_M_2d(ri=None, k=None, n_1=None, n_2=None, sparse=True):
     """
     Generates a mask `M` to extract the middle `k` pixels from image row `ri`
     Args:
-        ri: row index (beginning from zero) of interest in 2d image
+        ri: row index (beginning from zero) of interest in 2d image; a list
+            of rows stacks several row ROIs
         k: (centered) window length
         n_1: n rows of image
         n_2: n cols of image
     Returns:
         M: mask operator matrix
     """
-    if ri is None:
-        ri = int(float(n_1)/2.)
-
-    t = np.zeros(n_1)
-    t[ri] = 1
-    M = t
-    s1 = (n_2-k)/2
-    for i in range(n_2-1):
-        M = sla.block_diag(M,t)
-    M = M[s1:(s1+k),:]
-    if sparse:
-        M = sps.csr_matrix(M)
-    return M
+    return gen_M(n_1=n_1, n_2=n_2, ri=ri, k=k, sparse=sparse)
 
-def gen_instance_2d_blur(m=None, n_1=None, n_2=None, ri=None, k=None, K_diag=None, sigma=None, t=None, sparse=True):
+def gen_instance_2d_blur(m=None, n_1=None, n_2=None, ri=None, k=None, K_diag=None, sigma=None, t=None, sparse=True, \
+                         boundary='periodic', op='sparse'):
     """
     Args
         m: dimension of data space
@@ -374,17 +467,30 @@ def gen_instance_2d_blur(m=None, n_1=None, n_2=None, ri=None, k=None, K_diag=Non
         k: dimension of ROI
         sigma: gaussian blur standard deviation
         t: gaussian blur pixel window size
+        boundary: blur boundary condition, `periodic`, `zero` or `reflect`
+        op: `sparse` assembles X = X_col X_row; `kron` returns the matrix-free
+            blur_2d.KronBlurOperator; `fft` the blur_2d.FFTBlurOperator2d
+            (periodic only)
     Returns
         M: a k x n matrix
     """
     Kb = gen_Kb(m=m, K_diag=K_diag, sparse=sparse)
-    X_col, X_row = blur_2d.fwdblur_operator_2d(n_1=n_1, n_2=n_2, sigma=sigma, t=t, sparse=sparse)
-    X = X_col.dot(X_row)
+    if op == 'fft':
+        if boundary != 'periodic':
+            raise ValueError('`fft` blur operator requires periodic boundary')
+        X = blur_2d.FFTBlurOperator2d(n_1=n_1, n_2=n_2, sigma=sigma, t=t)
+    elif op == 'kron':
+        X = blur_2d.KronBlurOperator(n_1=n_1, n_2=n_2, sigma=sigma, t=t, boundary=boundary)
+    else:
+        X_col, X_row = blur_2d.fwdblur_operator_2d(n_1=n_1, n_2=n_2, sigma=sigma, t=t, sparse=sparse, \
+                                                   boundary=boundary)
+        X = X_col.dot(X_row)
     M = gen_M_2d(ri=ri, k=k, n_1=n_1, n_2=n_2, sparse=sparse)
 
     return Kb, X, M
 
-def gen_instance_2d_xray(m=None, n_1=None, n_2=None, ri=None, k=None, K_diag=None, sparse=True):
+def gen_instance_2d_xray(m=None, n_1=None, n_2=None, ri=None, k=None, K_diag=None, sparse=True, n_jobs=1, \
+                         op='sparse', geometry=None):
     """
     Args
         m: dimension of data space
@@ -395,15 +501,73 @@ def gen_instance_2d_xray(m=None, n_1=None, n_2=None, ri=None, k=None, K_diag=Non
         k: dimension of ROI
         sigma: gaussian blur standard deviation
         t: gaussian blur pixel window size
+        n_jobs: worker processes used to trace the rays of X
+        op: `sparse` assembles X; `matfree` returns drt.XrayOperator, which
+            traces rays on demand; `symmetric` returns
+            drt.SymmetricXrayOperator, which stores only the rays of a
+            fundamental set under the symmetries of the pixel grid
+        geometry: drt.ParallelBeam or drt.FanBeam (m must equal geometry.m)
     Returns
         M: a k x n matrix
     """
+    if geometry is not None and m != geometry.m:
+        raise ValueError('m = %s but geometry fires %s rays' % (m, geometry.m))
     Kb = gen_Kb(m=m, K_diag=K_diag, sparse=sparse)
-    X = drt.gen_X(n_1=n_1, n_2=n_2, m=m, sp_rep=sparse)
+    if op == 'matfree':
+        X = drt.XrayOperator(n_1=n_1, n_2=n_2, m=m, geometry=geometry)
+    elif op == 'symmetric':
+        X = drt.SymmetricXrayOperator(n_1=n_1, n_2=n_2, m=m, n_jobs=n_jobs, geometry=geometry)
+    else:
+        X = drt.gen_X(n_1=n_1, n_2=n_2, m=m, sp_rep=sparse, n_jobs=n_jobs, geometry=geometry)
     M = gen_M_2d(ri=ri, k=k, n_1=n_1, n_2=n_2, sparse=sparse)
 
     return Kb, X, M
 
+HOTOMO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'HOTomoMats')
+
+def load_hotomo(path=None, mmap=True, sparse=True):
+    """
+    Loads the HOTomoMats data set (35 x 70 image, 1050 measurements, 30 ROI
+    pixels). The .npy files are memory-mapped, not read into memory.
+    Args
+        path: directory holding DiagKb.npy, Mmat.npy, lambdas.npy, sb.npy
+              (and Amat.npy, if available); defaults to data/HOTomoMats
+        mmap: memory-map the arrays (read-only)
+        sparse: return Kb and M as sparse operators (else dense)
+    Returns
+        Kb: m x m diagonal data covariance (dia_matrix)
+        X: m x n system matrix from Amat.npy, or None if it is not shipped
+        M: k x n ROI selection matrix (csr_matrix)
+        sb: m x 1 data signal
+        lams: regularization parameters of the data set
+    """
+    path = HOTOMO_DIR if path is None else path
+    mmap_mode = 'r' if mmap else None
+    load = lambda name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+
+    d, Mmat = load('DiagKb'), load('Mmat')
+    sb, lams = load('sb').reshape(-1, 1), load('lambdas')
+    m, (k, n) = d.size, Mmat.shape
+
+    if sparse:
+        Kb = sps.dia_matrix((d.reshape(1, m), [0]), shape=(m, m))
+    else:
+        Kb = np.diag(d)
+
+    ## each ROI row selects one pixel: build M from the pixel indices
+    rows, idx = np.nonzero(Mmat)
+    if np.array_equal(rows, np.arange(k)):
+        M = gen_M(n_1=n, sparse=sparse, idx=idx)
+    else:
+        M = sps.csr_matrix(Mmat, dtype=float) if sparse else np.asarray(Mmat, dtype=float)
+
+    X = None
+    if os.path.exists(os.path.join(path, 'Amat.npy')):
+        X = load('Amat')
+        if sparse:
+            X = sps.csr_matrix(X)
+    return Kb, X, M, sb, lams
+
 def scipy_sparse_to_spmatrix(A):
     """
     Takes scipy sparse matrix to a cvxopt spmatrix
@@ -416,19 +580,166 @@ def calc_hot(X=None, B=None, lam=None, M=None, u=None, ESI=False):
     m, n = X.shape[0], X.shape[1]
     if B is None: B = sps.eye(n)
 
-    ## intermediate matrix
-    Z = X.T.dot(X) + lam*B.T.dot(B)
+    ## w = M Z u, Z = X^T X + lam B^T B applied without forming it
+    if ESI:
+        u = u[0:n]
+    w = M.dot(X.T.dot(X.dot(u)) + lam*B.T.dot(B.dot(u)))
+    return w.reshape(len(w),1)
+
+## ========== Fast Z = X^T X + lam I solves ==========
+def _dct(V, axes, inverse=False):
+    """ Orthonormal DCT-II (or its inverse) along each of `axes` """
+    for ax in axes:
+        if inverse:
+            V = fftpack.idct(V, type=2, norm='ortho', axis=ax)
+        else:
+            V = fftpack.dct(V, type=2, norm='ortho', axis=ax)
+    return V
 
+class SpectralZSolver(spsla.LinearOperator):
+    """
+    Applies Z^{-1} for Z = X^T X + lam I when X is diagonalized by the FFT
+    (periodic blur: X circulant, block-circulant-circulant-block in 2d) or
+    by the DCT-II (reflective blur with a symmetric kernel). Each solve is a
+    pointwise division in the transform domain, O(n log n).
 
-    if ESI:
-        w = M.dot(Z).dot(u[0:n])
-        return w.reshape(len(w),1)
-    else:
-        w = M.dot(Z).dot(u)
-        return w.reshape(len(w),1)
+    Args:
+        eigs:      eigenvalues of X laid out as `np.fft.rfftn` (`fft`) or
+                   `dctn` (`dct`) of an image of shape `shape`
+        lam:       regularization parameter
+        shape:     (n_1,) or (n_1, n_2) image shape (column-major vectorized)
+        transform: `fft` or `dct`
+        exact:     False when built as a preconditioner for an X that is only
+                   approximately diagonalized
+    """
+
+    def __init__(self, eigs=None, lam=None, shape=None, transform='fft', exact=True):
+        self.eigs, self.lam = eigs, lam
+        self.shape_img, self.transform, self.exact = tuple(shape), transform, exact
+        self.denom = np.abs(eigs)**2 + lam
+        n = int(np.prod(self.shape_img))
+        super(SpectralZSolver, self).__init__(dtype=np.dtype(float), shape=(n, n))
+
+    def _solve(self, V):
+        axes = tuple(range(len(self.shape_img)))
+        if V.ndim > len(self.shape_img):
+            D = self.denom[..., None]
+        else:
+            D = self.denom
+        if self.transform == 'fft':
+            return np.fft.irfftn(np.fft.rfftn(V, axes=axes) / D, s=self.shape_img, axes=axes)
+        return _dct(_dct(V, axes) / D, axes, inverse=True)
+
+    def _matvec(self, v):
+        V = np.asarray(v).reshape(self.shape_img, order='F')
+        return self._solve(V).reshape(-1, order='F')
 
-def direct_rxn(X=None, lam=None, B=None, sparse=True):
+    def _rmatvec(self, v):
+        return self._matvec(v)
+
+    def _matmat(self, V):
+        V = np.asarray(V)
+        K = V.shape[1]
+        Y = self._solve(V.reshape(self.shape_img + (K,), order='F'))
+        return Y.reshape(-1, K, order='F')
+
+def spectral_Z_solver(X=None, lam=None, B=None, n_1=None, n_2=None, boundary=None, precond=False, tol=10**-8):
+    """
+    Builds a SpectralZSolver for Z = X^T X + lam B^T B from a few products
+    with X, when X is circulant (FFT) or reflective-symmetric (DCT).
+
+    Args:
+        X:        forward operator (dense, sparse or LinearOperator)
+        B:        regularization matrix; must be None or the identity
+        n_1, n_2: image shape (n_2=None for 1d)
+        boundary: `periodic` or `reflect` declares the structure (no checks);
+                  None detects it by comparing X against its spectral form on
+                  a random image
+        precond:  return the (periodic by default) spectral approximation even
+                  when X is not exactly diagonalized (e.g. `zero` boundaries
+                  or B != I), for use as a preconditioner for Z
+        tol:      relative tolerance of the detection test
+
+    Returns:
+        Zinv: SpectralZSolver, or None when X is not diagonalized
+    """
+    shape = (n_1,) if n_2 is None else (n_1, n_2)
+    n = int(np.prod(shape))
+    axes = tuple(range(len(shape)))
+    if X.shape != (n, n):
+        return None
+
+    ## B must be the identity for exact solves
+    exact = True
+    if B is not None:
+        v = np.random.randn(n)
+        if la.norm(B.dot(v) - v) > tol*la.norm(v):
+            if not precond:
+                return None
+            exact = False
+
+    def column(i):
+        e = np.zeros(n)
+        e[i] = 1.
+        return np.asarray(X.dot(e)).reshape(shape, order='F')
+
+    def eigs_of(bc):
+        if bc == 'periodic':
+            if hasattr(X, 'spectrum'):
+                return X.spectrum
+            ## centre column shifted back to the origin (= first column if circulant)
+            centre = [s//2 for s in shape]
+            C = np.roll(column(int(np.ravel_multi_index(centre, shape, order='F'))), \
+                        [-c for c in centre], axis=axes)
+            return np.fft.rfftn(C, axes=axes)
+        elif bc == 'reflect':
+            e0 = np.zeros(shape)
+            e0[(0,)*len(shape)] = 1.
+            return _dct(column(0), axes) / _dct(e0, axes)
+        else:
+            raise ValueError('boundary must be `periodic` or `reflect`')
+
+    def matches(eigs, bc):
+        V = np.random.randn(*shape)
+        if bc == 'periodic':
+            Y = np.fft.irfftn(eigs * np.fft.rfftn(V, axes=axes), s=shape, axes=axes)
+        else:
+            Y = _dct(eigs * _dct(V, axes), axes, inverse=True)
+        XV = np.asarray(X.dot(V.reshape(-1, order='F'))).reshape(shape, order='F')
+        return la.norm(XV - Y) <= tol*la.norm(XV)
+
+    if boundary is not None:
+        bcs = [boundary]
+    elif precond:
+        bcs = ['periodic']
+    else:
+        bcs = ['periodic', 'reflect']
+
+    for bc in bcs:
+        eigs = eigs_of(bc)
+        if boundary is None and not precond and not matches(eigs, bc):
+            continue
+        transform = 'fft' if bc == 'periodic' else 'dct'
+        return SpectralZSolver(eigs=eigs, lam=lam, shape=shape, transform=transform, \
+                               exact=(exact and not precond))
+    return None
+
+def direct_rxn(X=None, lam=None, B=None, sparse=True, Zinv=None):
+    """
+    Reconstruction operator R = Z^{-1} X^T, Z = X^T X + lam B^T B.
+    If `Zinv` (an exact SpectralZSolver) is given, the solves are done in the
+    Fourier/DCT domain instead of through spsolve, and R is returned as the
+    dense n x m ndarray they produce (util.hotelling_system takes either).
+    A matrix-free X (LinearOperator) is handled the same way, with the m
+    solves done by CG (z_solver).
+    """
     n = X.shape[1]
+    if (Zinv is not None and Zinv.exact) or isinstance(X, spsla.LinearOperator):
+        if sps.issparse(X):
+            Xt = X.T.toarray()
+        else:
+            Xt = np.asarray(X.T.dot(np.eye(X.shape[0])))
+        return z_solver(X=X, lam=lam, B=B, sparse=sparse, Zinv=Zinv)(Xt)
     if B is None:
         if sparse:
             B = sps.eye(n)
@@ -441,19 +752,596 @@ def direct_rxn(X=None, lam=None, B=None, sparse=True):
         R = la.solve(A, X.T)
     return R
 
-def direct_solve(Kb=None, R=None, M=None, B=None, sb=None, sparse=True):
-    MR = M.dot(R)
-    Lx = MR.dot(Kb)
+def z_solver(X=None, lam=None, B=None, sparse=True, Zinv=None, tol=10**-10):
+    """
+    Factors Z = X^T X + lam B^T B once and returns solve(V) = Z^{-1} V: the
+    exact Fourier/DCT `Zinv` if given, else sparse LU (splu) or dense
+    Cholesky of Z. A matrix-free X (LinearOperator, e.g.
+    blur_2d.KronBlurOperator or drt.XrayOperator) cannot be factored: Z is
+    then applied as z_operator and solved by CG (cg_z_solver) to relative
+    residual `tol`, preconditioned by `Zinv` if it is an inexact
+    SpectralZSolver (spectral_Z_solver with precond=True).
+    """
+    if Zinv is not None and Zinv.exact:
+        return Zinv.dot
+    if isinstance(X, spsla.LinearOperator):
+        return cg_z_solver(X=X, lam=lam, B=B, Zinv=Zinv, tol=tol)
+    n = X.shape[1]
+    if B is None:
+        B = sps.eye(n) if sparse else np.eye(n)
+    Z = X.T.dot(X) + lam*B.T.dot(B)
+    if sparse and sps.issparse(Z):
+        return spsla.splu(sps.csc_matrix(Z)).solve
+    c = sla.cho_factor(np.asarray(Z))
+    return lambda V: sla.cho_solve(c, V)
+
+def chol_update(L=None, V=None, downdate=False):
+    """
+    Cholesky factor of L L^T + V V^T (or L L^T - V V^T if `downdate`) for
+    lower-triangular L and V n x r, in O(n^2 r) instead of O(n^3). Column
+    by column, a Householder reflection compresses row k of V into one
+    entry (leaving V V^T unchanged), which a Givens (update) or hyperbolic
+    (downdate) rotation then folds into L[:, k]. Fewer flops than a
+    refactor for r < n/3, but at matrix-vector speed: for a dense Z that
+    can be re-formed, LAPACK refactoring is still as fast up to n ~ 4000.
+    Returns
+        new lower-triangular factor (L is not modified)
+    """
+    ## work on the transposes, so that columns of L and V are contiguous rows
+    R = np.array(L, dtype=float).T.copy()
+    Vt = np.array(V, dtype=float).reshape(R.shape[0], -1).T.copy()
+    n = R.shape[0]
+    for k in range(n):
+        v = Vt[:, k]
+        nv = la.norm(v)
+        if nv == 0:
+            continue
+        ## Householder: V[k] -> (-sign(v_0) ||v||, 0, ..., 0)
+        if Vt.shape[0] > 1:
+            u = v.copy()
+            u[0] += np.copysign(nv, v[0])
+            Vt[:, k:] -= np.outer(2*u / u.dot(u), u.dot(Vt[:, k:]))
+        l, x = R[k, k], Vt[0, k]
+        r_k, v_k = R[k, k:], Vt[0, k:]
+        if downdate:
+            if abs(x) >= l:
+                raise la.LinAlgError('downdated matrix is not positive definite')
+            r = np.sqrt((l - x)*(l + x))
+            c, s = l / r, x / r
+            R[k, k:], Vt[0, k:] = c*r_k - s*v_k, c*v_k - s*r_k
+        else:
+            r = np.hypot(l, x)
+            c, s = l / r, x / r
+            R[k, k:], Vt[0, k:] = c*r_k + s*v_k, c*v_k - s*r_k
+    return R.T.copy()
+
+class ZFactor:
+    """
+    Solves with Z = X^T X + lam B^T B kept up to date as rays (rows of X)
+    are added or removed, e.g. the rows drt.gen_X(n_1, n_2, geometry=
+    drt.ParallelBeam(thetas=...)) of extra angles: each change is the
+    low-rank term +-X_rows^T X_rows.
+
+        'woodbury': any base solver (z_solver's splu/Cholesky/`Zinv`, or an
+                    iterative `zsolve`) for the initial Z0, corrected by the
+                    Woodbury identity for Z = Z0 + U D U^T; a change of r rays
+                    costs r base solves, and each solve one base solve plus
+                    O(n p) for the p changed rays. Once p exceeds `max_rank`,
+                    the rays are folded into Z0, which is formed from X (if
+                    not yet) and refactored by splu/Cholesky, replacing the
+                    base solver. A matrix-free X (LinearOperator) cannot be
+                    refactored: p then grows without bound (a message is
+                    printed once it passes `max_rank`).
+        'cholesky': dense Cholesky factor, updated/downdated by chol_update
+                    (O(n^2 r) per r rays); solves stay at one factor's cost.
+                    Z is always formed from X, so X must be dense or sparse
+                    (`zsolve` and `Zinv` are not used).
+
+    Args:
+        zsolve:     base solver for Z0 (default util.z_solver)
+        method:     'woodbury' or 'cholesky'
+        max_rank:   changed rays kept in the Woodbury correction before a
+                    refactor (None: never refactor)
+    """
+
+    def __init__(self, X=None, lam=None, B=None, sparse=True, Zinv=None, zsolve=None, \
+                 method='woodbury', max_rank=500):
+        n = X.shape[1]
+        self.method, self.max_rank, self.sparse = method, max_rank, sparse
+        if B is None:
+            B = sps.eye(n) if sparse else np.eye(n)
+        self.X, self.lam, self.B = X, lam, B
+        self.explicit = not isinstance(X, spsla.LinearOperator)
+        self.Z0, self._warned = None, False
+        if method == 'cholesky':
+            if not self.explicit:
+                raise ValueError("method='cholesky' forms Z: X must be dense or sparse, not a LinearOperator")
+            Z0 = self._form_Z0()
+            self.L = la.cholesky(Z0.toarray() if sps.issparse(Z0) else np.asarray(Z0))
+        elif method == 'woodbury':
+            self.base = zsolve if zsolve is not None else \
+                        z_solver(X=X, lam=lam, B=B, sparse=sparse, Zinv=Zinv)
+            self._reset()
+        else:
+            raise ValueError("method must be 'cholesky' or 'woodbury'")
+
+    def _form_Z0(self):
+        return self.X.T.dot(self.X) + self.lam*self.B.T.dot(self.B)
+
+    def _reset(self):
+        self.U, self.d, self.W, self.C = [], np.zeros(0), None, None
+
+    def add_rays(self, X_rows):
+        """ Z <- Z + X_rows^T X_rows """
+        self._change(X_rows, 1.0)
+
+    def remove_rays(self, X_rows):
+        """ Z <- Z - X_rows^T X_rows """
+        self._change(X_rows, -1.0)
+
+    def _change(self, X_rows, sign):
+        Ut = X_rows.toarray() if sps.issparse(X_rows) else np.atleast_2d(np.asarray(X_rows, dtype=float))
+        if self.method == 'cholesky':
+            self.L = chol_update(self.L, Ut.T, downdate=(sign < 0))
+            return
+        ## woodbury: append columns, solve only for the new ones
+        Wn = np.asarray(self.base(Ut.T)).reshape(Ut.shape[1], -1)
+        self.U.append(Ut.T)
+        self.d = np.concatenate([self.d, sign*np.ones(Ut.shape[0])])
+        self.W = Wn if self.W is None else np.hstack([self.W, Wn])
+        if self.max_rank is not None and self.d.size > self.max_rank:
+            if self.explicit:
+                self.refactor()
+                return
+            if not self._warned:
+                print('ZFactor: %d changed rays > max_rank = %d, but a matrix-free X '
+                      'cannot be refactored' % (self.d.size, self.max_rank))
+                self._warned = True
+        U = np.hstack(self.U)
+        self.C = sla.lu_factor(np.diag(1.0/self.d) + U.T.dot(self.W))
+
+    def refactor(self):
+        """ fold the accumulated rays into Z0 and refactor it """
+        if self.method == 'cholesky' or not self.U:
+            return
+        if not self.explicit:
+            raise ValueError('Z0 cannot be formed from a matrix-free X')
+        if self.Z0 is None:
+            self.Z0 = self._form_Z0()
+        U = np.hstack(self.U)
+        DU = sps.csr_matrix(U * self.d) if self.sparse else U * self.d
+        Uc = sps.csr_matrix(U) if self.sparse else U
+        self.Z0 = self.Z0 + DU.dot(Uc.T)
+        if self.sparse and sps.issparse(self.Z0):
+            self.base = spsla.splu(sps.csc_matrix(self.Z0)).solve
+        else:
+            c = sla.cho_factor(np.asarray(self.Z0))
+            self.base = lambda V: sla.cho_solve(c, V)
+        self._reset()
+
+    def solve(self, V):
+        """ Z^{-1} V for the current ray set """
+        V = np.asarray(V, dtype=float)
+        if self.method == 'cholesky':
+            return sla.cho_solve((self.L, True), V)
+        Y = np.asarray(self.base(V))
+        if self.C is None or not self.U:
+            return Y
+        U = np.hstack(self.U)
+        return Y - self.W.dot(sla.lu_solve(self.C, U.T.dot(Y)))
+
+    __call__ = solve
+
+def direct_mrxn(X=None, lam=None, B=None, M=None, sparse=True, Zinv=None):
+    """
+    ROI rows M R of the reconstruction operator, without forming R: Z is
+    symmetric, so M R = M Z^{-1} X^T = (X Z^{-1} M^T)^T takes k solves with
+    Z instead of the m solves of direct_rxn.
+    Returns
+        MR: k x m ndarray
+    """
+    MT = M.T.toarray() if sps.issparse(M) else np.asarray(M.T, dtype=float)
+    ZiMT = z_solver(X=X, lam=lam, B=B, sparse=sparse, Zinv=Zinv)(MT)
+    return np.asarray(X.dot(ZiMT)).T
+
+class RxnOperator(spsla.LinearOperator):
+    """
+    R = Z^{-1} X^T (or M R, if M is given) applied through Z solves, for
+    randomized_svd; `zsolve` as returned by z_solver.
+    """
+
+    def __init__(self, X, zsolve, M=None):
+        self.X, self.zsolve, self.M = X, zsolve, M
+        k = X.shape[1] if M is None else M.shape[0]
+        super(RxnOperator, self).__init__(dtype=np.dtype(float), shape=(k, X.shape[0]))
+
+    def _matmat(self, V):
+        Y = self.zsolve(np.asarray(self.X.T.dot(V)))
+        return Y if self.M is None else np.asarray(self.M.dot(Y))
+
+    def _matvec(self, v):
+        return self._matmat(np.asarray(v).reshape(-1, 1)).reshape(-1)
+
+    def _rmatmat(self, U):
+        if self.M is not None:
+            U = np.asarray(self.M.T.dot(U))
+        return np.asarray(self.X.dot(self.zsolve(U)))
+
+    def _rmatvec(self, u):
+        return self._rmatmat(np.asarray(u).reshape(-1, 1)).reshape(-1)
+
+    def _adjoint(self):
+        return spsla.LinearOperator(shape=self.shape[::-1], dtype=self.dtype, \
+                                    matvec=self._rmatvec, rmatvec=self._matvec, matmat=self._rmatmat)
+
+def lowrank_rxn(X=None, lam=None, B=None, M=None, sparse=True, Zinv=None, rank=None, tol=10**-6, **kwargs):
+    """
+    Randomized low-rank factorization U S V^T of R = Z^{-1} X^T (or of M R,
+    if M is given) to relative accuracy `tol` (or of rank `rank`), built
+    from block solves with one factorization of Z (z_solver) and products
+    with X^T; R is never formed. kwargs go to optimize.randomized_svd.
+    Returns
+        optimize.LowRank, usable as R (or MR) in direct_solve
+    """
+    zsolve = z_solver(X=X, lam=lam, B=B, sparse=sparse, Zinv=Zinv)
+    return optimize.randomized_svd(RxnOperator(X, zsolve, M=M), rank=rank, tol=tol, **kwargs)
+
+def hotelling_system(Kb=None, M=None, sb=None, R=None, MR=None):
+    """
+    Hotelling template equations Kx w = sx, with Kx = M R Kb R^T M^T
+    (k x k) and sx = M R sb, from R or directly from MR = M R. R or MR may
+    be an optimize.LowRank (lowrank_rxn): then Kx = A (V^T Kb V) A^T with
+    A = M U S, and nothing of size m x m or n x m is formed.
+    """
+    if MR is None:
+        MR = R.left(M) if isinstance(R, optimize.LowRank) else M.dot(R)
+    if isinstance(MR, optimize.LowRank):
+        A = MR.U * MR.s
+        C = MR.Vt.dot(np.asarray(Kb.T.dot(MR.Vt.T)))
+        return A.dot(C).dot(A.T), A.dot(MR.Vt.dot(sb))
+    Lx = Kb.T.dot(MR.T).T   # MR Kb, also for dense MR with sparse Kb
     Kx = Lx.dot(MR.T)
     sx = MR.dot(sb)
-    if sparse:
-        w = spsla.spsolve(Kx,sx)
-        w = w.reshape(len(w),1)
-    else:
-        w = la.solve(Kx,sx)
-        w = w.reshape(len(w),1)
+    return Kx, sx
+
+def direct_solve(Kb=None, R=None, M=None, B=None, sb=None, sparse=True, MR=None):
+    """
+    Direct Hotelling template w from R (or MR = M R, see direct_mrxn); the
+    k x k system Kx w = sx is solved by Cholesky.
+    Returns
+        w, Kx, sx
+    """
+    Kx, sx = hotelling_system(Kb=Kb, M=M, sb=sb, R=R, MR=MR)
+    Kx_d = Kx.toarray() if sps.issparse(Kx) else np.asarray(Kx)
+    sx_d = sx.toarray() if sps.issparse(sx) else np.asarray(sx)
+    try:
+        w = sla.cho_solve(sla.cho_factor(Kx_d), sx_d)
+    except la.LinAlgError:
+        ## Kx numerically semidefinite (e.g. lam -> 0)
+        w = la.solve(Kx_d, sx_d)
+    w = w.reshape(len(w),1)
     return w, Kx, sx
 
+def z_operator(X=None, lam=None, B=None):
+    """ Z = X^T X + lam B^T B as a LinearOperator (never formed) """
+    n = X.shape[1]
+    if B is None: B = sps.eye(n)
+    Zv = lambda v: X.T.dot(X.dot(v)) + lam*B.T.dot(B.dot(v))
+    return spsla.LinearOperator((n, n), dtype=float, matvec=Zv, rmatvec=Zv)
+
+def z_cg(Z, Zinv=None):
+    """
+    CG solver for Z y = c: preconditioned by M^{-1} = `Zinv` when it is an
+    inexact SpectralZSolver (spectral_Z_solver with precond=True), plain CG
+    otherwise. Set `b` and call solve(tol=..., x_0=..., max_iter=...).
+    """
+    if Zinv is not None and not Zinv.exact:
+        return optimize.PreconditionedCGSolver(A=Z, b=None, Minv=Zinv, full_output=True)
+    return optimize.ConjugateGradientsSolver(A=Z, b=None, full_output=True)
+
+def cg_z_solver(X=None, lam=None, B=None, Zinv=None, tol=10**-10, max_iter=None):
+    """
+    solve(V) = Z^{-1} V by (preconditioned, see z_cg) CG on z_operator, one
+    column of V at a time, to relative residual `tol` (max_iter defaults to
+    n); Z is never formed.
+    """
+    Z = z_operator(X=X, lam=lam, B=B)
+    n = Z.shape[0]
+    if max_iter is None: max_iter = n
+    cg = z_cg(Z, Zinv)
+
+    def solve(V):
+        V = np.asarray(V, dtype=float)
+        Vc, Y = V.reshape(n, -1), np.zeros((n, V.size // n))
+        for j in range(Vc.shape[1]):
+            v_norm = la.norm(Vc[:, j])
+            if v_norm == 0:
+                continue
+            cg.b = Vc[:, j].copy()
+            Y[:, j] = cg.solve(tol=tol*v_norm, max_iter=max_iter)[0]
+        return Y.reshape(V.shape)
+    return solve
+
+def iterative_solve(X=None, Kb=None, M=None, B=None, lam=None, sb=None, Zinv=None, tol=10**-8, \
+                    max_iter=500, inner_tol=10**-10, inner_max=10**-6, inner_iter=1000, full_output=False):
+    """
+    Hotelling template w of Kx w = sx without forming R, M R or Kx: CG on the
+    k x k system, with Kx v = M Z^{-1} X^T Kb X Z^{-1} M^T v applied through
+    two inner CG solves with Z (or `Zinv`, if exact; an inexact `Zinv`
+    preconditions the inner CG, see z_cg).
+
+    Each outer search direction is p_j = r_j + beta p_{j-1}, so the inner
+    solves for p_j are warm-started from beta times those for p_{j-1}. The
+    relative inner tolerance is relaxed as the outer residual falls (inexact
+    Krylov): eta_j = min(inner_max, tol ||sx|| / ||r_j||), and never below
+    inner_tol. The products' errors are amplified by the conditioning of Kx,
+    so inner_max should shrink for badly conditioned Kx.
+    Args
+        tol: relative outer residual ||Kx w - sx|| / ||sx||
+        max_iter: outer iterations
+        inner_iter: iterations per inner solve
+    Returns
+        w: k x 1 template; with full_output also the number of outer
+           iterations, the outer residuals and the total inner iterations
+    """
+    k = M.shape[0]
+    Z = z_operator(X=X, lam=lam, B=B)
+    exact = Zinv is not None and Zinv.exact
+    cg = z_cg(Z, Zinv)
+    n_inner = [0]
+
+    def zsolve(c, eta, y_0):
+        if exact:
+            return Zinv.dot(c)
+        cg.b = c
+        y, i, _ = cg.solve(tol=max(eta, inner_tol)*la.norm(c), x_0=y_0, max_iter=inner_iter)
+        n_inner[0] += i
+        return y
+
+    def Kx(v, eta, guess):
+        y1 = zsolve(M.T.dot(v), eta, guess[0])
+        y2 = zsolve(X.T.dot(Kb.dot(X.dot(y1))), eta, guess[1])
+        return M.dot(y2), (y1, y2)
+
+    ## right-hand side sx = M Z^{-1} X^T sb, solved tightly
+    sx = M.dot(zsolve(X.T.dot(np.asarray(sb).reshape(-1)), inner_tol, None))
+    sx_norm = la.norm(sx)
+
+    w = np.zeros(k)
+    r = sx.copy()
+    p = r.copy()
+    rTr = r.dot(r)
+    Y = (None, None)
+    beta = 0.0
+    residuals = [np.sqrt(rTr) / sx_norm]
+    i = 0
+    while i < max_iter and residuals[-1] > tol:
+        eta = min(inner_max, tol / residuals[-1])
+        guess = tuple(None if y is None else beta*y for y in Y)
+        q, Y = Kx(p, eta, guess)
+        a = rTr / p.dot(q)
+        w += a*p
+        r -= a*q
+        new_rTr = r.dot(r)
+        beta = new_rTr / rTr
+        p = r + beta*p
+        rTr = new_rTr
+        residuals.append(np.sqrt(rTr) / sx_norm)
+        i += 1
+
+    w = w.reshape(k, 1)
+    if full_output:
+        return w, i, residuals, n_inner[0]
+    return w
+
+## ========== Regularization parameter selection ==========
+def golub_kahan(A=None, b=None, k=None, reorth=True):
+    """
+    k steps of Golub-Kahan-Lanczos bidiagonalization of A started from b:
+        A V = U Bk,     b = beta_0 U e_1,
+    with U (m x k+1) and V (n x k) orthonormal and Bk (k+1 x k) lower
+    bidiagonal. Stops early if the Krylov space is exhausted.
+    Args
+        reorth: fully reorthogonalize U and V (k extra inner products per
+                step; without it orthogonality is lost as Ritz values converge)
+    Returns
+        U, Bk, V, beta_0
+    """
+    A = spsla.aslinearoperator(A)
+    m, n = A.shape
+    b = np.asarray(b, dtype=float).reshape(-1)
+    beta_0 = la.norm(b)
+    U, V = np.zeros((m, k+1)), np.zeros((n, k))
+    alphas, betas = np.zeros(k), np.zeros(k)
+    U[:, 0] = b / beta_0
+    v = np.asarray(A.rmatvec(U[:, 0])).reshape(-1)
+    for j in range(k):
+        if j > 0:
+            v = np.asarray(A.rmatvec(U[:, j])).reshape(-1) - betas[j-1]*V[:, j-1]
+        if reorth:
+            v -= V[:, :j].dot(V[:, :j].T.dot(v))
+        alphas[j] = la.norm(v)
+        if alphas[j] <= 10**-14 * beta_0:
+            j -= 1
+            break
+        V[:, j] = v / alphas[j]
+        u = np.asarray(A.matvec(V[:, j])).reshape(-1) - alphas[j]*U[:, j]
+        if reorth:
+            u -= U[:, :j+1].dot(U[:, :j+1].T.dot(u))
+        betas[j] = la.norm(u)
+        if betas[j] <= 10**-14 * beta_0:
+            break
+        U[:, j+1] = u / betas[j]
+    k = j + 1
+    Bk = np.zeros((k+1, k))
+    Bk[np.arange(k), np.arange(k)] = alphas[:k]
+    Bk[np.arange(1, k+1), np.arange(k)] = betas[:k]
+    return U[:, :k+1], Bk, V[:, :k], beta_0
+
+class LamSelector:
+    """
+    Chooses lam in min ||W (X f - g)||^2 + lam ||B f||^2 (the Z = X^T X +
+    lam B^T B of direct_rxn, with optional noise whitening W = Kb^{-1/2})
+    from one Golub-Kahan bidiagonalization of A = W X B^{-1}, instead of a
+    full solve per candidate lam.
+
+    After k steps A V = U Bk, and with Bk = P diag(theta) Q^T the projected
+    Tikhonov solutions y(lam) = Q diag(theta / (theta^2 + lam)) c, c =
+    beta_0 P^T e_1, give for every lam in O(k):
+        ||r(lam)||^2 = sum (lam c_i / (theta_i^2 + lam))^2 + c_perp^2
+        ||B f(lam)||^2 = sum (theta_i c_i / (theta_i^2 + lam))^2
+    These are exact for the Krylov-projected problem; they match the full
+    problem once the singular values above ~sqrt(lam) have converged, so k
+    must grow as lam shrinks. The L-curve corner and the discrepancy lam
+    settle within a few dozen steps; GCV needs the trace of the influence
+    matrix, which the projection only approximates (see `gcv`), and tends
+    to over-regularize until k is past the numerical rank at lam.
+
+    Args:
+        X, g:   forward operator and data
+        B:      square, invertible regularization matrix (None: identity)
+        Kb:     diagonal data covariance for whitening (None: no whitening)
+        k:      bidiagonalization steps
+    """
+
+    def __init__(self, X=None, g=None, B=None, Kb=None, k=50, reorth=True):
+        m, n = X.shape
+        g = np.asarray(g, dtype=float).reshape(-1)
+        w = None
+        if Kb is not None:
+            d = Kb.diagonal() if sps.issparse(Kb) else np.diag(np.asarray(Kb))
+            w = 1.0 / np.sqrt(d)
+            g = w * g
+        Bsolve = None
+        if B is not None:
+            lu = spsla.splu(sps.csc_matrix(B))
+            Bsolve = lu.solve
+        self.m, self.n, self.Bsolve, self.whitened = m, n, Bsolve, w is not None
+
+        def matvec(y):
+            f = y if Bsolve is None else Bsolve(y)
+            u = np.asarray(X.dot(f)).reshape(-1)
+            return u if w is None else w*u
+
+        def rmatvec(u):
+            u = u if w is None else w*u
+            y = np.asarray(X.T.dot(u)).reshape(-1)
+            return y if Bsolve is None else Bsolve(y, trans='T')
+
+        A = spsla.LinearOperator((m, n), dtype=float, matvec=matvec, rmatvec=rmatvec)
+        self.U, self.Bk, self.V, beta_0 = golub_kahan(A=A, b=g, k=min(k, m, n), reorth=reorth)
+        self.k = self.Bk.shape[1]
+        P, self.theta, Qt = la.svd(self.Bk, full_matrices=False)
+        self.Q = Qt.T
+        self.c = beta_0 * P[0, :]
+        self.c_perp2 = max(beta_0**2 - self.c.dot(self.c), 0.0)
+
+    def norms(self, lams):
+        """ squared residual and (B-)solution norms rho(lam), eta(lam) """
+        L = np.asarray(lams, dtype=float).reshape(-1, 1)
+        t2, c2 = self.theta**2, self.c**2
+        rho = np.sum((L / (t2 + L))**2 * c2, axis=1) + self.c_perp2
+        eta = np.sum(t2 / (t2 + L)**2 * c2, axis=1)
+        return rho, eta
+
+    def gcv(self, lams, projected=True):
+        """
+        GCV(lam) = ||r||^2 / trace(I - A A_lam^+)^2. With `projected` the
+        trace is that of the (k+1)-dimensional projected problem (the
+        hybrid-method GCV); otherwise it is m minus the Ritz-value sum,
+        which is too large for lam below the unconverged spectrum.
+        """
+        L = np.asarray(lams, dtype=float).reshape(-1, 1)
+        rho, _ = self.norms(lams)
+        dim = self.k + 1 if projected else self.m
+        dof = dim - np.sum(self.theta**2 / (self.theta**2 + L), axis=1)
+        return rho / dof**2
+
+    def curvature(self, lams):
+        """ curvature of the L-curve (log ||r||, log ||B f||) at each lam """
+        L = np.asarray(lams, dtype=float).reshape(-1)
+        t2, c2 = self.theta**2, self.c**2
+        rho, eta = self.norms(L)
+        T = t2 + L.reshape(-1, 1)
+        ## derivatives in lam; rho' = -lam eta'
+        d_eta = -2 * np.sum(t2 * c2 / T**3, axis=1)
+        dd_eta = 6 * np.sum(t2 * c2 / T**4, axis=1)
+        d_rho = -L * d_eta
+        dd_rho = -d_eta - L * dd_eta
+        xi_1, zeta_1 = d_rho / (2*rho), d_eta / (2*eta)
+        xi_2 = (dd_rho*rho - d_rho**2) / (2*rho**2)
+        zeta_2 = (dd_eta*eta - d_eta**2) / (2*eta**2)
+        return (xi_1*zeta_2 - xi_2*zeta_1) / (xi_1**2 + zeta_1**2)**1.5
+
+    def discrepancy(self, lams, delta=None, tau=1.0):
+        """
+        ||r(lam)|| - tau delta; delta defaults to sqrt(m), the expected
+        norm of whitened noise
+        """
+        if delta is None:
+            if not self.whitened:
+                raise ValueError('pass the noise level `delta` (or Kb to whiten)')
+            delta = np.sqrt(self.m)
+        rho, _ = self.norms(lams)
+        return np.sqrt(rho) - tau*delta
+
+    def select(self, lams, method='gcv', **kwargs):
+        """
+        Best of the candidate `lams`: GCV minimizer, L-curve corner (maximum
+        curvature) or the largest lam meeting the discrepancy principle.
+        Returns
+            lam, values of the criterion at `lams`
+        """
+        lams = np.asarray(lams, dtype=float).reshape(-1)
+        if method == 'gcv':
+            vals = self.gcv(lams)
+            return lams[np.argmin(vals)], vals
+        elif method == 'lcurve':
+            vals = self.curvature(lams)
+            return lams[np.argmax(vals)], vals
+        elif method == 'discrepancy':
+            vals = self.discrepancy(lams, **kwargs)
+            ok = vals <= 0
+            if not np.any(ok):
+                return lams[np.argmin(vals)], vals
+            return lams[ok].max(), vals
+        else:
+            raise ValueError("method must be 'gcv', 'lcurve' or 'discrepancy'")
+
+    def solution(self, lam):
+        """ projected regularized solution f(lam) = B^{-1} V y(lam) """
+        y = self.V.dot(self.Q.dot(self.theta / (self.theta**2 + lam) * self.c))
+        return y if self.Bsolve is None else self.Bsolve(y)
+
+def block_operator(blocks):
+    """
+    Block matrix as a LinearOperator, the matrix-free counterpart of
+    sps.bmat: `blocks` is a list of block rows of dense, sparse or
+    LinearOperator blocks, with None for zero blocks.
+    """
+    blocks = [[None if A is None else spsla.aslinearoperator(A) for A in row] for row in blocks]
+    rows = [[A.shape[0] for A in row if A is not None][0] for row in blocks]
+    cols = [[row[j].shape[1] for row in blocks if row[j] is not None][0] for j in range(len(blocks[0]))]
+    r_off, c_off = np.cumsum([0] + rows), np.cumsum([0] + cols)
+
+    def matvec(v):
+        v, y = np.asarray(v).reshape(-1), np.zeros(r_off[-1])
+        for i, row in enumerate(blocks):
+            for j, A in enumerate(row):
+                if A is not None:
+                    y[r_off[i]:r_off[i+1]] += np.ravel(A.matvec(v[c_off[j]:c_off[j+1]]))
+        return y
+
+    def rmatvec(v):
+        v, y = np.asarray(v).reshape(-1), np.zeros(c_off[-1])
+        for i, row in enumerate(blocks):
+            for j, A in enumerate(row):
+                if A is not None:
+                    y[c_off[j]:c_off[j+1]] += np.ravel(A.rmatvec(v[r_off[i]:r_off[i+1]]))
+        return y
+
+    return spsla.LinearOperator((r_off[-1], c_off[-1]), dtype=float, matvec=matvec, rmatvec=rmatvec)
+
 def gen_ESI_system(X=None, Kb=None, B=None, M=None, lam=None, sb=None):
     """
     Generates "Equivalent Symmetric Indefinite" LHS and RHS based on III
@@ -461,6 +1349,15 @@ def gen_ESI_system(X=None, Kb=None, B=None, M=None, lam=None, sb=None):
     m, n = X.shape[0], X.shape[1]
     if B is None: B = sps.eye(n)
 
+    ## matrix-free X: the same blocks as LinearOperators
+    if isinstance(X, spsla.LinearOperator):
+        XtKbX = lambda v: X.T.dot(Kb.dot(X.dot(v)))
+        A11 = spsla.LinearOperator((n, n), dtype=float, matvec=XtKbX, rmatvec=XtKbX)
+        A12 = z_operator(X=X, lam=lam, B=B) * spsla.aslinearoperator(sps.eye(n) - M.T.dot(M))
+        A = block_operator([[A11, A12], [A12.H, None]])
+        b1 = X.T.dot(sb)
+        return A, np.concatenate([b1.reshape(n,), np.zeros(n)])
+
     ## intermediate calc
     Z = (X.T.dot(X) + lam*B.T.dot(B))
 
@@ -484,6 +1381,15 @@ def gen_ESI3_system(X=None, Kb=None, B=None, M=None, lam=None, sb=None, sparse=T
     m, n = X.shape[0], X.shape[1]
     if B is None: B = sps.eye(n)
 
+    ## matrix-free X (diagonal Kb): the same blocks as LinearOperators
+    if isinstance(X, spsla.LinearOperator):
+        d = Kb.diagonal() if sps.issparse(Kb) else np.diag(np.asarray(Kb))
+        Q = spsla.aslinearoperator(sps.diags(np.lib.scimath.sqrt(d))) * X
+        C = z_operator(X=X, lam=lam, B=B) * spsla.aslinearoperator(sps.eye(n) - M.T.dot(M))
+        A = block_operator([[None, Q.H, C.H], [Q, -sps.eye(m), None], [C, None, None]])
+        b1 = X.T.dot(sb)
+        return A, np.concatenate([b1.reshape(n,), np.zeros(m), np.zeros(n)])
+
     ## intermediate calc
     Z = (X.T.dot(X) + lam*B.T.dot(B))
     C = Z.dot(sps.eye(n) - M.T.dot(M))